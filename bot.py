@@ -1,20 +1,111 @@
+import asyncio
+import functools
+import os
+import re
+
 import interactions
 import dice
-from asgiref.sync import sync_to_async
+from django.conf import settings
 from interactions import (Extension, OptionType, Modal, ShortText,
                           ParagraphText, SlashContext, Embed, StringSelectMenu,
                           StringSelectOption, ActionRow, Button, ButtonStyle, Attachment, slash_option,
-                          AutocompleteContext)
-from interactions.api.events import Startup, Component
+                          AutocompleteContext, ComponentContext, ModalContext, SlashCommandChoice)
+from interactions.api.events import Startup
+
+from game import images, metrics, repository, rolls
+from game.cache import LRUCache
+from game.checks import check_embed, roll_check
+from game.models import NO_GUILD, Item, Describable, Character, Feat, Spell, format_bulk
+from game.name_index import build_name_indexes, search_names
+from game.outbox import outbox
+from game.owners import SHEET_CHOICES, owner_cache, owner_embed
+from game.reference import REFERENCE_MODELS, compendium, reload_if_requested
+from game.odds import PERCENTILES, UnsupportedFormula, odds as dice_odds
+from game.repository import db_task
+from game.tag_index import build_tag_indexes, format_tag_query, parse_id_query
+from game.write_behind import resource_buffer
+
+
+ROLL_SUMMARY_VALUES = 100
+EMBED_CACHE_SIZE = 2048
+
+# Wizard steps: the draft id (and page) ride in the custom_id, see game/wizards.py
+ITEM_MODAL = re.compile(r'^item_modal:(\d+)$')
+ITEM_BULK = re.compile(r'^item_bulk:(\d+)$')
+CHARACTER_MODAL = re.compile(r'^character_modal:(\d+)$')
+CHARACTER_STAT = re.compile(r'^character_stat:(\d+):(\d+):(\w+)$')
+CHARACTER_NEXT = re.compile(r'^character_next:(\d+):(\d+)$')
+STAT_PAGES = [
+    [('strength', 'Сила'), ('dexterity', 'Ловкость'), ('constitution', 'Телосложение')],
+    [('intelligence', 'Интеллект'), ('wisdom', 'Мудрость'), ('charisma', 'Харизма')],
+]
+ABILITY_LABELS = dict(stat for page in STAT_PAGES for stat in page)
+STAT_RANGE = [i for i in range(6, 22, 2)] + [21, 22]
+DRAFT_GONE = 'Черновик устарел или принадлежит не вам, начните заново'
+# /report page buttons carry the page to show
+REPORT_PAGE = re.compile(r'^report:(\d+)$')
+# /party page buttons carry the page and the party's pks in base 36
+PARTY_PAGE = re.compile(r'^party:(\d+):([0-9a-z.]+)$')
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+# /find page buttons carry the model, the page and the query as tag ids
+FIND_PAGE = re.compile(r'^find:(\w+):(\d+):(.*)$')
+FIND_MODELS = {'item': Item, 'feat': Feat, 'spell': Spell}
+CUSTOM_ID_LIMIT = 100
+# /me select menu: the chosen character's sheet, by pk
+ME_SHEET = 'me_sheet'
+# Discord's cap on a select option's label and value
+OPTION_LIMIT = 100
+RESOURCE_LABELS = {'hp': 'ОЗ', 'focus_points': 'очки фокуса', 'hero_points': 'очки героизма'}
+
+# Rendered embed payloads keyed by (model, pk, version), see embed_key
+embed_cache = LRUCache(maxsize=EMBED_CACHE_SIZE)
 
-from game.models import Item, Describable, Character, InventoryEntry
+
+metrics.register_gauge('underking_embed_cache_hits', 'Embed renders served from cache', lambda: embed_cache.hits)
+metrics.register_gauge('underking_embed_cache_misses', 'Embeds rendered', lambda: embed_cache.misses)
+metrics.register_gauge('underking_outbox_queued', 'Requests queued or in flight in the outbox', lambda: len(outbox))
+metrics.register_gauge('underking_resource_pending_changes', 'HP/focus/hero changes waiting for a flush',
+                       lambda: resource_buffer.pending_changes)
+metrics.register_gauge('underking_owner_cache_hits', '/me lookups served from cache', lambda: owner_cache.hits)
+metrics.register_gauge('underking_owner_cache_misses', '/me lookups that queried', lambda: owner_cache.misses)
+metrics.register_gauge('underking_compendium_records', 'Records in the compendium snapshot',
+                       lambda: len(compendium.snapshot or ()))
 
 
 class CharacterExtension(Extension):
+    def __init__(self, bot):
+        metrics.install_query_counter()
+        metrics.instrument_client(bot)
+        metrics.instrument_extension(self)
+
     @interactions.listen(Startup)
     async def on_ready(self):
+        await db_task(build_name_indexes)()
+        await db_task(build_tag_indexes)()
+        await repository.prepare_search()
+        await db_task(compendium.reload)()
+        self.write_metrics.start()
+        self.evict_drafts.start()
+        self.flush_resources.start()
+        self.reload_compendium.start()
         print(f"Ready! Owned by {self.bot.owner}")
 
+    @interactions.Task.create(interactions.IntervalTrigger(seconds=settings.METRICS_INTERVAL))
+    async def write_metrics(self):
+        await db_task(write_metrics_file)()
+
+    @interactions.Task.create(interactions.IntervalTrigger(minutes=10))
+    async def evict_drafts(self):
+        await repository.evict_expired_drafts()
+
+    @interactions.Task.create(interactions.IntervalTrigger(seconds=settings.RESOURCE_FLUSH_INTERVAL))
+    async def flush_resources(self):
+        await repository.flush_resources()
+
+    @interactions.Task.create(interactions.IntervalTrigger(seconds=settings.COMPENDIUM_POLL_INTERVAL))
+    async def reload_compendium(self):
+        await db_task(reload_if_requested)()
+
     @interactions.slash_command(
         name='roll',
         description='Roll the dice!'
@@ -24,13 +115,53 @@ class CharacterExtension(Extension):
         description='Dice roll formula, like 4d6 or d20+3',
         opt_type=OptionType.STRING,
     )
-    async def roll(self, ctx: SlashContext, formula: str):
+    @interactions.slash_option(
+        name='times',
+        description='How many times to roll',
+        required=False,
+        opt_type=OptionType.INTEGER,
+        min_value=1,
+        max_value=rolls.MAX_TIMES
+    )
+    async def roll(self, ctx: SlashContext, formula: str, times: int = 1):
         try:
-            result = dice.roll(formula)
-            await ctx.send(f'{formula}: {result} ')
+            if times > 1:
+                await ctx.send(roll_summary(formula, rolls.roll_many(formula, times)))
+            else:
+                result = rolls.roll(formula)
+                await ctx.send(f'{formula}: {result} ')
         except dice.DiceBaseException as e:
             await ctx.send(e.pretty_print())
 
+    @interactions.slash_command(
+        name='odds',
+        description='Exact odds of a dice roll'
+    )
+    @interactions.slash_option(
+        name='formula',
+        description='Dice roll formula, like 4d6h3 or d20+7',
+        required=True,
+        opt_type=OptionType.STRING,
+    )
+    @interactions.slash_option(
+        name='target',
+        description='Chance to roll at least this much',
+        required=False,
+        opt_type=OptionType.INTEGER
+    )
+    async def odds(self, ctx: SlashContext, formula: str, target: int = None):
+        try:
+            # Big pools take a while: keep the event loop serving everyone else
+            distribution = await asyncio.to_thread(dice_odds, formula)
+        except dice.DiceBaseException as e:
+            await ctx.send(e.pretty_print())
+            return
+        except UnsupportedFormula:
+            await ctx.send('Для этой формулы вероятности не считаются: поддерживаются кубы, '
+                           'h/l и арифметика с числами', ephemeral=True)
+            return
+        await ctx.send(embeds=[odds_embed(formula, distribution, target)])
+
     @interactions.slash_command(
         name='create',
         group_description='Создание записи в БД'
@@ -55,7 +186,9 @@ class CharacterExtension(Extension):
         opt_type=OptionType.ATTACHMENT
     )
     async def create_item(self, ctx: SlashContext, image: Attachment = None):
-        await self.modify_or_create_item(ctx, image)
+        draft_id = await repository.open_draft('item', int(ctx.author_id), guild_id=guild_of(ctx), **image_data(image))
+        await ctx.send_modal(name_description_modal('Создать вещь', effectable=True,
+                                                    custom_id=f'item_modal:{draft_id}'))
 
     @edit.subcommand(
         sub_cmd_name='item'
@@ -74,44 +207,44 @@ class CharacterExtension(Extension):
         opt_type=OptionType.ATTACHMENT
     )
     async def edit_item(self, ctx: SlashContext, name: str, image: Attachment = None):
-        item = await sync_to_async(Item.objects.get)(name=name)
-        await self.modify_or_create_item(ctx, image, item)
+        item = await repository.get_item(guild_of(ctx), name)
+        draft_id = await repository.open_draft('item', int(ctx.author_id), item.pk, **image_data(image))
+        await ctx.send_modal(name_description_modal('Изменить вещь', effectable=True,
+                                                    custom_id=f'item_modal:{draft_id}',
+                                                    name=item.name, description=item.description,
+                                                    level=str(item.level), effect=item.effect))
 
-    async def modify_or_create_item(self,ctx: SlashContext, image: Attachment = None, item: Item = None):
-        if item is None:
-            item = Item()
-            modal = name_description_modal('Создать вещь', effectable=True)
-        else:
-            modal = name_description_modal('Изменить вещь', effectable=True
-                                           , name=item.name, description=item.description,
-                                           level=str(item.level),effect=item.effect)
-
-        await ctx.send_modal(modal)
-        modal_ctx = await self.bot.wait_for_modal(modal)
+    @interactions.modal_callback(ITEM_MODAL)
+    async def item_modal(self, ctx: ModalContext):
+        draft_id = int(ITEM_MODAL.match(ctx.custom_id)[1])
         try:
+            level = int(ctx.responses['level'])
+        except ValueError:
+            await ctx.send('Уровень должен быть числом!', ephemeral=True)
+            return
+        item = await repository.edit_draft(draft_id, int(ctx.author_id), name=ctx.responses['name'],
+                                           description=ctx.responses['description'], level=level,
+                                           effect=ctx.responses['effect'])
+        if item is None:
+            await ctx.send(DRAFT_GONE, ephemeral=True)
+            return
+        options = [StringSelectOption(label='-', value='-'),
+                   StringSelectOption(label='L', value='L')]
+        options.extend([StringSelectOption(label=str(i), value=str(i)) for i in range(1, 21)])
+        components = StringSelectMenu(*options, custom_id=f'item_bulk:{draft_id}')
+        await ctx.send(content="", embeds=[to_embed(item)], components=components)
 
-            if image is not None:
-                item.image_url = image.url
-            item.name = modal_ctx.responses["name"]
-            item.description = modal_ctx.responses["description"]
-            item.level = int(modal_ctx.responses['level'])
-            item.effect = modal_ctx.responses['effect']
-            options = [StringSelectOption(label='-', value='-'),
-                       StringSelectOption(label='L', value='L')]
-            options.extend([StringSelectOption(label=str(i), value=str(i)) for i in range(1, 21)])
-            components = StringSelectMenu(*options)
-            msg = await modal_ctx.send(content="", embeds=[to_embed(item)], components=components)
-
-            comp = await self.bot.wait_for_component(msg)
-            bulk = comp.ctx.values[0]
-            item.txt_to_bulk(bulk)
-
-            await sync_to_async(item.save, thread_sensitive=True)()
-            await comp.ctx.edit_origin(content="", embeds=[to_embed(item)], components=[])
+    @interactions.component_callback(ITEM_BULK)
+    async def item_bulk(self, ctx: ComponentContext):
+        draft_id = int(ITEM_BULK.match(ctx.custom_id)[1])
+        item = await repository.edit_draft(draft_id, int(ctx.author_id), bulk_txt=ctx.values[0])
+        if item is not None:
+            item = await repository.commit_draft(draft_id, int(ctx.author_id), **await stored_image_data(ctx, item))
+        if item is None:
+            await ctx.send(DRAFT_GONE, ephemeral=True)
+            return
+        await ctx.edit_origin(content="", embeds=[embed_payload(item)], components=[])
 
-        except ValueError as ex:
-            print(ex)
-            await modal_ctx.send('Уровень должен быть числом!', ephemeral=True)
     @create.subcommand(
         sub_cmd_name='character'
     )
@@ -122,7 +255,9 @@ class CharacterExtension(Extension):
         opt_type=OptionType.ATTACHMENT
     )
     async def create_character(self, ctx: SlashContext, image: Attachment = None):
-        await self.modify_or_create_character(ctx, image, set_author=True)
+        draft_id = await repository.open_draft('character', int(ctx.author_id), guild_id=guild_of(ctx),
+                                               discord_id=int(ctx.author_id), **image_data(image))
+        await ctx.send_modal(name_description_modal('Создать персонажа', custom_id=f'character_modal:{draft_id}'))
 
     @edit.subcommand(
         sub_cmd_name='character'
@@ -141,82 +276,57 @@ class CharacterExtension(Extension):
         opt_type=OptionType.ATTACHMENT
     )
     async def edit_character(self, ctx: SlashContext, name: str, image: Attachment = None):
-        character = await sync_to_async(Character.objects.get)(name=name)
-        await self.modify_or_create_character(ctx, image, character)
+        character = await repository.get_character(guild_of(ctx), name)
+        draft_id = await repository.open_draft('character', int(ctx.author_id), character.pk, **image_data(image))
+        await ctx.send_modal(name_description_modal('Изменить персонажа', custom_id=f'character_modal:{draft_id}',
+                                                    name=character.name, description=character.description,
+                                                    level=str(character.level)))
 
-    async def modify_or_create_character(self, ctx: SlashContext, image:Attachment=None, character = None, set_author = False):
+    @interactions.modal_callback(CHARACTER_MODAL)
+    async def character_modal(self, ctx: ModalContext):
+        draft_id = int(CHARACTER_MODAL.match(ctx.custom_id)[1])
+        try:
+            level = int(ctx.responses['level'])
+        except ValueError:
+            await ctx.send('Уровень должен быть числом!', ephemeral=True)
+            return
+        character = await repository.edit_draft(draft_id, int(ctx.author_id), name=ctx.responses['name'],
+                                                description=ctx.responses['description'], level=level)
         if character is None:
-            character = Character()
-            modal = name_description_modal('Создать персонажа')
-        else:
-            modal = name_description_modal('Изменить персонажа', name=character.name,
-                                           description=character.description, level=str(character.level))
-        await ctx.send_modal(modal)
-        modal_ctx = await self.bot.wait_for_modal(modal)
+            await ctx.send(DRAFT_GONE, ephemeral=True)
+            return
+        await ctx.send(content='', embeds=[to_embed(character)], components=stat_components(draft_id, 0))
 
-        try:
+    @interactions.component_callback(CHARACTER_STAT)
+    async def character_stat(self, ctx: ComponentContext):
+        draft_id, page, stat = CHARACTER_STAT.match(ctx.custom_id).groups()
+        draft_id, page = int(draft_id), int(page)
+        if page >= len(STAT_PAGES) or stat not in dict(STAT_PAGES[page]):
+            return
+        await acknowledge(ctx)
+        character = await repository.edit_draft(draft_id, int(ctx.author_id), **{stat: int(ctx.values[0])})
+        if character is None:
+            await ctx.send(DRAFT_GONE, ephemeral=True)
+            return
+        await update_origin(ctx, content="", embeds=[to_embed(character)], components=stat_components(draft_id, page))
 
-            if image is not None:
-                character.image_url = image.url
-            if set_author:
-                character.discord_id = int(ctx.author_id)
-            character.name = modal_ctx.responses["name"]
-            character.description = modal_ctx.responses["description"]
-            character.level = int(modal_ctx.responses['level'])
-            stats1 = [('strength', 'Сила'), ('dexterity', 'Ловкость'), ('constitution', 'Телосложение')]
-            components = []
-            stat_range = [i for i in range(6, 22, 2)] + [21, 22]
-            for stat_id, stat in stats1:
-                options = [StringSelectOption(label=f'{i}', value=f'{i}') for i in stat_range]
-                components.append(ActionRow(StringSelectMenu(*options, placeholder=stat, custom_id=stat_id)))
-            components.append(ActionRow(Button(label='Далее', custom_id='next', style=ButtonStyle.GREEN)))
-            msg = await modal_ctx.send(content='', embeds=[to_embed(character)], components=components)
-
-            finished = False
-            comp = await self.bot.wait_for_component(msg)
-            first = True
-            while not finished:
-                if first:
-                    first = False
-                else:
-                    comp = await self.bot.wait_for_component(msg)
-
-                if comp.ctx.custom_id == 'next':
-                    finished = True
-                else:
-                    character.__setattr__(comp.ctx.custom_id, int(comp.ctx.values[0]))
-                    await comp.ctx.edit_origin(content="",
-                                               embeds=[to_embed(character)], components=components)
-
-            stats2 = [('intelligence', 'Интеллект'), ('wisdom', 'Мудрость'), ('charisma', 'Харизма')]
+    @interactions.component_callback(CHARACTER_NEXT)
+    async def character_next(self, ctx: ComponentContext):
+        draft_id, page = map(int, CHARACTER_NEXT.match(ctx.custom_id).groups())
+        await acknowledge(ctx)
+        if page + 1 < len(STAT_PAGES):
+            character = await repository.edit_draft(draft_id, int(ctx.author_id))
+            components = stat_components(draft_id, page + 1)
+        else:
+            character = await repository.edit_draft(draft_id, int(ctx.author_id))
+            if character is not None:
+                character = await repository.commit_draft(draft_id, int(ctx.author_id),
+                                                          **await stored_image_data(ctx, character))
             components = []
-            for stat_id, stat in stats2:
-                options = [StringSelectOption(label=f'{i}', value=f'{i}') for i in stat_range]
-                components.append(ActionRow(StringSelectMenu(*options, placeholder=stat, custom_id=stat_id)))
-            components.append(ActionRow(Button(label='Далее', custom_id='next', style=ButtonStyle.GREEN)))
-            await comp.ctx.edit_origin(content="", embeds=[to_embed(character)], components=components)
-
-            finished = False
-            comp = await self.bot.wait_for_component(msg)
-            first = True
-            while not finished:
-                if first:
-                    first = False
-                else:
-                    comp = await self.bot.wait_for_component(msg)
-
-                if comp.ctx.custom_id == 'next':
-                    finished = True
-                else:
-                    character.__setattr__(comp.ctx.custom_id, int(comp.ctx.values[0]))
-                    await comp.ctx.edit_origin(content="",
-                                               embeds=[to_embed(character)], components=components)
-
-            await comp.ctx.edit_origin(content="", embeds=[to_embed(character)], components=[])
-            await sync_to_async(character.save, thread_sensitive=True)()
-
-        except ValueError as ex:
-            await modal_ctx.send('Уровень должен быть числом!', ephemeral=True)
+        if character is None:
+            await ctx.send(DRAFT_GONE, ephemeral=True)
+            return
+        await update_origin(ctx, content="", embeds=[to_embed(character)], components=components)
 
     @interactions.slash_command(
         name='view',
@@ -240,9 +350,22 @@ class CharacterExtension(Extension):
         desc_button = Button(label="Описание", disabled=True,style=ButtonStyle.BLUE, custom_id='desc')
         inv_button = Button(label="Инвентарь", disabled=False,style=ButtonStyle.BLUE, custom_id='inv')
         close_button = Button(label="Закрыть", style=ButtonStyle.RED, custom_id='exit')
-        character = await sync_to_async(Character.objects.get)(name=name)
-        msg = await ctx.send(embeds=[to_embed(character)], components=[ActionRow(desc_button, inv_button, close_button)])
+        prev_button = Button(label="<", style=ButtonStyle.GREY, custom_id='prev')
+        next_button = Button(label=">", style=ButtonStyle.GREY, custom_id='next')
+        character = await repository.get_character(guild_of(ctx), name)
+        msg = await ctx.send(embeds=[embed_payload(character)], components=[ActionRow(desc_button, inv_button, close_button)])
+        # Rendered once per open view, then only paged through
+        inv_pages = None
         inv_index = 0
+
+        def inventory_components():
+            prev_button.disabled = inv_index == 0
+            next_button.disabled = inv_index >= len(inv_pages) - 1
+            rows = [ActionRow(desc_button, inv_button, close_button)]
+            if len(inv_pages) > 1:
+                rows.append(ActionRow(prev_button, next_button))
+            return rows
+
         while not closed:
             comp = await self.bot.wait_for_component(msg)
             if comp.ctx.custom_id=='exit':
@@ -251,21 +374,17 @@ class CharacterExtension(Extension):
             elif comp.ctx.custom_id=='desc':
                 desc_button.disabled = True
                 inv_button.disabled = False
-                await comp.ctx.edit_origin(embeds=[to_embed(character)], components=[ActionRow(desc_button, inv_button, close_button)])
-            elif comp.ctx.custom_id=='inv':
+                await comp.ctx.edit_origin(embeds=[embed_payload(character)], components=[ActionRow(desc_button, inv_button, close_button)])
+            elif comp.ctx.custom_id in ('inv', 'prev', 'next'):
                 desc_button.disabled = False
                 inv_button.disabled = True
-                embed = Embed(title=f'Инвентарь {character.name}')
-                items = await sync_to_async(list)(InventoryEntry.objects.filter(character=character))
-                for item in items:
-                    i = await sync_to_async(Item.objects.get)(inventoryentry=item)
-                    total_bulk = await sync_to_async(item.total_bulk_txt)()
-                    await sync_to_async(embed.add_field)(f'{i.name} x{item.quantity}', value=f'Масса {total_bulk}')
-                await comp.ctx.edit_origin(embeds=[embed], components=[ActionRow(desc_button, inv_button, close_button)])
-
-
-
-
+                if inv_pages is None:
+                    inv_pages = await repository.inventory_pages(character)
+                if comp.ctx.custom_id == 'prev':
+                    inv_index = max(inv_index - 1, 0)
+                elif comp.ctx.custom_id == 'next':
+                    inv_index = min(inv_index + 1, len(inv_pages) - 1)
+                await comp.ctx.edit_origin(embeds=[inv_pages[inv_index]], components=inventory_components())
 
     @interactions.slash_command(
         name='give',
@@ -301,35 +420,392 @@ class CharacterExtension(Extension):
         if quantity==0:
             await ctx.send("Нельзя выдать или взять 0 вещей!", ephemeral=True)
             return
-        item = await sync_to_async(Item.objects.get)(name=item_name)
-        character = await sync_to_async(Character.objects.get)(name=char_name)
-        present = await sync_to_async(InventoryEntry.objects.filter(item=item, character=character).exists)()
-        if present:
-            entry: InventoryEntry = await sync_to_async(character.inventory.get)(item=item)
-            entry.quantity += quantity
-            if quantity<0:
-                await ctx.send(f"У [{character.name}] взято  [{item.name}]x{-quantity}")
-                if entry.quantity<1:
-                    await sync_to_async(entry.delete)()
-            else:
-                await ctx.send(f"[{character.name}] выдано  [{item.name}]x{quantity}")
-                await sync_to_async(entry.save)()
+        characters, items, present = await repository.give_items(guild_of(ctx), [char_name], [item_name], quantity)
+        missing = missing_names([char_name, item_name], characters + items)
+        if missing:
+            await ctx.send(f"Не найдено: {', '.join(missing)}", ephemeral=True)
+        elif not present and quantity<0:
+            await ctx.send(f"У {char_name} нет {item_name}!", ephemeral=True)
+        elif quantity<0:
+            await ctx.send(f"У [{char_name}] взято  [{item_name}]x{-quantity}")
         else:
-            if quantity>0:
-                entry: InventoryEntry = InventoryEntry(character=character, item=item,quantity=quantity)
-                await ctx.send(f"[{character.name}] выдано  [{item.name}]x{quantity}")
-                await sync_to_async(entry.save)()
-            else:
-                await ctx.send(f"У {character.name} нет {item.name}!", ephemeral=True)
+            await ctx.send(f"[{char_name}] выдано  [{item_name}]x{quantity}")
+
+    @give.subcommand(
+        sub_cmd_name='loot'
+    )
+    @slash_option(
+        name='characters',
+        description='Имена персонажей через запятую',
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    @slash_option(
+        name='items',
+        description='Имена предметов через запятую',
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    @slash_option(
+        name='quantity',
+        description='Количество каждого предмета',
+        required=False,
+        opt_type=OptionType.INTEGER
+    )
+    async def give_loot(self, ctx: SlashContext, characters: str, items: str, quantity: int = 1):
+        if quantity==0:
+            await ctx.send("Нельзя выдать или взять 0 вещей!", ephemeral=True)
+            return
+        character_names, item_names = split_names(characters), split_names(items)
+        found_characters, found_items, _ = await repository.give_items(guild_of(ctx), character_names, item_names, quantity)
+        missing = missing_names(character_names + item_names, found_characters + found_items)
+        if not found_characters or not found_items:
+            await ctx.send(f"Не найдено: {', '.join(missing)}", ephemeral=True)
+            return
+        verb = 'выдано' if quantity>0 else 'взято'
+        lines = [f"[{', '.join(found_characters)}] {verb}: " +
+                 ', '.join(f'[{name}]x{abs(quantity)}' for name in found_items)]
+        if missing:
+            lines.append(f"Не найдено: {', '.join(missing)}")
+        await ctx.send('\n'.join(lines))
+
+    @interactions.slash_command(
+        name='party',
+        description='Сводка по нескольким персонажам'
+    )
+    @slash_option(
+        name='characters',
+        description='Имена персонажей через запятую',
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def party(self, ctx: SlashContext, characters: str):
+        guild_id = guild_of(ctx)
+        embed, page, page_count, pks = await repository.party_page(guild_id, 0, names=split_names(characters))
+        components = party_components(pks, page, page_count)
+        await ctx.send(embeds=[embed], components=components)
+        if page_count > 1 and not components:
+            # Too many members for the buttons: the rest follows, a page per message
+            # to stay under Discord's per-message embed size
+            for page in range(1, page_count):
+                embed, *_ = await repository.party_page(guild_id, page, pks=pks)
+                await ctx.send(embeds=[embed])
+
+    @interactions.component_callback(PARTY_PAGE)
+    async def party_turn(self, ctx: ComponentContext):
+        await acknowledge(ctx)
+        page, members = PARTY_PAGE.match(ctx.custom_id).groups()
+        pks = [int(pk, 36) for pk in members.split('.')]
+        embed, page, page_count, pks = await repository.party_page(guild_of(ctx), int(page), pks=pks)
+        await update_origin(ctx, embeds=[embed], components=party_components(pks, page, page_count))
+
+    @interactions.slash_command(
+        name='report',
+        description='Сводка по всем персонажам'
+    )
+    async def report(self, ctx: SlashContext):
+        embed, page, page_count = await repository.report_page(guild_of(ctx), 0)
+        await ctx.send(embeds=[embed], components=report_components(page, page_count))
+
+    @interactions.component_callback(REPORT_PAGE)
+    async def report_turn(self, ctx: ComponentContext):
+        await acknowledge(ctx)
+        page = int(REPORT_PAGE.match(ctx.custom_id)[1])
+        embed, page, page_count = await repository.report_page(guild_of(ctx), page)
+        await update_origin(ctx, embeds=[embed], components=report_components(page, page_count))
+
+    @interactions.slash_command(
+        name='rest',
+        description='Отдых: восстановить ОЗ, очки фокуса и ячейки заклинаний'
+    )
+    @slash_option(
+        name='characters',
+        description='Имена персонажей через запятую, без них отдыхают все',
+        required=False,
+        opt_type=OptionType.STRING
+    )
+    async def rest(self, ctx: SlashContext, characters: str = None):
+        names = split_names(characters) if characters else None
+        rested = await repository.rest(guild_of(ctx), names)
+        if not rested:
+            await ctx.send('Некому отдыхать' if names is None else f"Не найдено: {', '.join(names)}",
+                           ephemeral=True)
+            return
+        lines = [f"Отдохнули: {', '.join(rested)}" if names is not None else f'Отдохнули все ({len(rested)})']
+        missing = missing_names(names or [], rested)
+        if missing:
+            lines.append(f"Не найдено: {', '.join(missing)}")
+        await ctx.send('\n'.join(lines))
+
+    @interactions.slash_command(
+        name='check',
+        description='Проверка характеристики для нескольких персонажей разом'
+    )
+    @slash_option(
+        name='ability',
+        description='Характеристика',
+        required=True,
+        opt_type=OptionType.STRING,
+        choices=[SlashCommandChoice(name=label, value=ability) for ability, label in ABILITY_LABELS.items()]
+    )
+    @slash_option(
+        name='formula',
+        description='Бросок без модификатора, по умолчанию d20',
+        required=False,
+        opt_type=OptionType.STRING
+    )
+    @slash_option(
+        name='characters',
+        description='Имена персонажей через запятую, без них проверяются все',
+        required=False,
+        opt_type=OptionType.STRING
+    )
+    @slash_option(
+        name='dc',
+        description='Класс сложности',
+        required=False,
+        opt_type=OptionType.INTEGER
+    )
+    async def check(self, ctx: SlashContext, ability: str, formula: str = 'd20', characters: str = None,
+                    dc: int = None):
+        try:
+            rolls.compile_formula(formula)
+        except dice.DiceBaseException as e:
+            await ctx.send(e.pretty_print(), ephemeral=True)
+            return
+        names = split_names(characters) if characters else None
+        rows = await repository.check_rows(guild_of(ctx), ability, names)
+        if not rows:
+            await ctx.send('Некого проверять' if names is None else f"Не найдено: {', '.join(names)}",
+                           ephemeral=True)
+            return
+        try:
+            results = roll_check(formula, rows)
+        except dice.DiceBaseException as e:
+            await ctx.send(e.pretty_print(), ephemeral=True)
+            return
+        embed = check_embed(f'Проверка: {ABILITY_LABELS[ability]} ({formula} + мод.)', results, dc)
+        missing = missing_names(names or [], [name for name, _ in rows])
+        if missing:
+            embed.set_footer(f"Не найдено: {', '.join(missing)}")
+        await ctx.send(embeds=[embed])
+
+    @interactions.slash_command(
+        name='hp',
+        description='Изменить ОЗ персонажа'
+    )
+    @slash_option(
+        name='character',
+        description='Имя персонажа',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    @slash_option(
+        name='amount',
+        description='Изменение: -5 урон, 5 лечение',
+        required=True,
+        opt_type=OptionType.INTEGER
+    )
+    async def change_hp(self, ctx: SlashContext, character: str, amount: int):
+        await self.change_resource(ctx, character, 'hp', amount)
+
+    @interactions.slash_command(
+        name='focus',
+        description='Изменить очки фокуса персонажа'
+    )
+    @slash_option(
+        name='character',
+        description='Имя персонажа',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    @slash_option(
+        name='amount',
+        description='Изменение: -1 потратить, 1 вернуть',
+        required=True,
+        opt_type=OptionType.INTEGER
+    )
+    async def change_focus(self, ctx: SlashContext, character: str, amount: int):
+        await self.change_resource(ctx, character, 'focus_points', amount)
+
+    @interactions.slash_command(
+        name='hero',
+        description='Изменить очки героизма персонажа'
+    )
+    @slash_option(
+        name='character',
+        description='Имя персонажа',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    @slash_option(
+        name='amount',
+        description='Изменение: -1 потратить, 1 получить',
+        required=True,
+        opt_type=OptionType.INTEGER
+    )
+    async def change_hero(self, ctx: SlashContext, character: str, amount: int):
+        await self.change_resource(ctx, character, 'hero_points', amount)
+
+    async def change_resource(self, ctx: SlashContext, character, field, amount):
+        # Answered from the in-memory copy; the database catches up on the next flush
+        guild_id = guild_of(ctx)
+        result = resource_buffer.change(guild_id, character, field, amount)
+        if result is None:
+            row = await repository.load_resources(guild_id, character)
+            if row is None:
+                await ctx.send(f'Не найдено: {character}', ephemeral=True)
+                return
+            resource_buffer.remember(row)
+            result = resource_buffer.change(guild_id, character, field, amount)
+        if result is None:
+            # Dropped again while loading, e.g. by a save; rare enough to ask for a retry
+            await ctx.send(f'{character} только что изменился, повторите команду', ephemeral=True)
+            return
+        value, limit = result
+        await ctx.send(f'{character}: {RESOURCE_LABELS[field]} {value}/{limit}')
+        if resource_buffer.pending_changes >= settings.RESOURCE_FLUSH_CHANGES:
+            await repository.flush_resources()
+
+    @interactions.slash_command(
+        name='spells',
+        description='Подготовленные заклинания персонажа'
+    )
+    @slash_option(
+        name='character',
+        description='Имя персонажа',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def spells(self, ctx: SlashContext, character: str):
+        embed = await repository.spells_embed(guild_of(ctx), character)
+        if embed is None:
+            await ctx.send(f'Не найдено: {character}', ephemeral=True)
+            return
+        await ctx.send(embeds=[embed])
+
+    @interactions.slash_command(
+        name='me',
+        description='Мои персонажи'
+    )
+    async def me(self, ctx: SlashContext):
+        key = (guild_of(ctx), int(ctx.author_id))
+        rows = owner_cache.get(key)
+        if rows is None:
+            rows = await repository.owned_characters(*key)
+            owner_cache.put(key, rows)
+        if not rows:
+            await ctx.send('У вас нет персонажей, создайте их через /create character', ephemeral=True)
+            return
+        options = [StringSelectOption(label=shorten(name, OPTION_LIMIT), value=str(pk))
+                   for pk, name, *_ in rows[:SHEET_CHOICES]]
+        await ctx.send(embeds=[owner_embed(ctx.author.display_name, rows)],
+                       components=StringSelectMenu(*options, placeholder='Открыть лист', custom_id=ME_SHEET))
+
+    @interactions.component_callback(ME_SHEET)
+    async def me_sheet(self, ctx: ComponentContext):
+        try:
+            character = await repository.get_character_by_pk(guild_of(ctx), int(ctx.values[0]))
+        except Character.DoesNotExist:
+            await ctx.send('Персонаж уже удалён', ephemeral=True)
+            return
+        await ctx.send(embeds=[embed_payload(character)], ephemeral=True)
+
+    @interactions.slash_command(
+        name='search',
+        description='Поиск по названиям, описаниям и эффектам'
+    )
+    @slash_option(
+        name='query',
+        description='Слова для поиска',
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def search(self, ctx: SlashContext, query: str):
+        results = await repository.search(guild_of(ctx), query)
+        if not results:
+            await ctx.send(f'По запросу «{query}» ничего не найдено', ephemeral=True)
+            return
+        await ctx.send(embeds=[search_embed(query, results)])
+
+    @interactions.slash_command(
+        name='find',
+        group_description='Поиск по тегам'
+    )
+    async def find(self, ctx: SlashContext):
+        await ctx.send('Выберите сущность для поиска!')
+
+    @find.subcommand(
+        sub_cmd_name='item'
+    )
+    @slash_option(
+        name='tags',
+        description='Теги через запятую; | — любой из, - — без тега: магический, зелье | свиток, -проклятый',
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def find_item(self, ctx: SlashContext, tags: str):
+        await self.find_tagged(ctx, 'item', tags)
+
+    @find.subcommand(
+        sub_cmd_name='feat'
+    )
+    @slash_option(
+        name='tags',
+        description='Теги через запятую; | — любой из, - — без тега',
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def find_feat(self, ctx: SlashContext, tags: str):
+        await self.find_tagged(ctx, 'feat', tags)
+
+    @find.subcommand(
+        sub_cmd_name='spell'
+    )
+    @slash_option(
+        name='tags',
+        description='Теги через запятую; | — любой из, - — без тега',
+        required=True,
+        opt_type=OptionType.STRING
+    )
+    async def find_spell(self, ctx: SlashContext, tags: str):
+        await self.find_tagged(ctx, 'spell', tags)
+
+    async def find_tagged(self, ctx: SlashContext, kind, tags):
+        model = FIND_MODELS[kind]
+        terms, missing, (names, page, page_count, total) = await repository.find_tagged(model, guild_of(ctx), tags)
+        if not terms:
+            await ctx.send('Укажите хотя бы один тег', ephemeral=True)
+            return
+        embed = find_embed(f'Поиск по тегам: {tags}', names, page, page_count, total, missing)
+        await ctx.send(embeds=[embed], components=find_components(kind, terms, page, page_count))
+
+    @interactions.component_callback(FIND_PAGE)
+    async def find_turn(self, ctx: ComponentContext):
+        kind, page, query = FIND_PAGE.match(ctx.custom_id).groups()
+        await acknowledge(ctx)
+        terms = parse_id_query(query)
+        names, page, page_count, total = await repository.find_page(FIND_MODELS[kind], guild_of(ctx), terms,
+                                                                    int(page))
+        embed = find_embed(ctx.message.embeds[0].title, names, page, page_count, total)
+        await update_origin(ctx, embeds=[embed], components=find_components(kind, terms, page, page_count))
 
     @view_character.autocomplete("name")
     @edit_character.autocomplete('name')
     @give_item.autocomplete('char_name')
+    @spells.autocomplete('character')
+    @change_hp.autocomplete('character')
+    @change_focus.autocomplete('character')
+    @change_hero.autocomplete('character')
     async def vc_autocomplete(self, ctx: AutocompleteContext):
         search = ctx.input_text
 
-        filtered = await sync_to_async(list)(Character.objects.filter(name__icontains=search)[:10])
-        choices = [dict(name=c.name, value=c.name) for c in filtered]
+        names = await search_names(Character, guild_of(ctx), search)
+        choices = [dict(name=name, value=name) for name in names]
 
         await ctx.send(choices=choices)
 
@@ -344,8 +820,8 @@ class CharacterExtension(Extension):
         autocomplete=True
     )
     async def view_item(self, ctx: SlashContext, name: str):
-        item = await sync_to_async(Item.objects.get)(name=name)
-        await ctx.send(embeds=[to_embed(item)])
+        item = await repository.get_item(guild_of(ctx), name)
+        await ctx.send(embeds=[embed_payload(item)])
 
     @view_item.autocomplete('name')
     @edit_item.autocomplete('name')
@@ -353,12 +829,285 @@ class CharacterExtension(Extension):
     async def vi_autocomplete(self, ctx: AutocompleteContext):
         search = ctx.input_text
 
-        filtered = await sync_to_async(list)(Item.objects.filter(name__icontains=search)[:10])
-        choices = [dict(name=c.name, value=c.name) for c in filtered]
+        names = await search_names(Item, guild_of(ctx), search)
+        choices = [dict(name=name, value=name) for name in names]
 
         await ctx.send(choices=choices)
 
-def name_description_modal(title, leleved=True, effectable=False, **defaults):
+    @view.subcommand(
+        sub_cmd_name='feat'
+    )
+    @slash_option(
+        name='name',
+        description='Название черты',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_feat(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'feat', name)
+
+    @view.subcommand(
+        sub_cmd_name='spell'
+    )
+    @slash_option(
+        name='name',
+        description='Название заклинания',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_spell(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'spell', name)
+
+    @view.subcommand(
+        sub_cmd_name='action'
+    )
+    @slash_option(
+        name='name',
+        description='Название действия',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_action(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'action', name)
+
+    @view.subcommand(
+        sub_cmd_name='class'
+    )
+    @slash_option(
+        name='name',
+        description='Название класса',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_class(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'class', name)
+
+    @view.subcommand(
+        sub_cmd_name='ancestry'
+    )
+    @slash_option(
+        name='name',
+        description='Название родословной',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_ancestry(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'ancestry', name)
+
+    @view.subcommand(
+        sub_cmd_name='background'
+    )
+    @slash_option(
+        name='name',
+        description='Название предыстории',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_background(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'background', name)
+
+    @view.subcommand(
+        sub_cmd_name='heritage'
+    )
+    @slash_option(
+        name='name',
+        description='Название наследия',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_heritage(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'heritage', name)
+
+    @view.subcommand(
+        sub_cmd_name='tag'
+    )
+    @slash_option(
+        name='name',
+        description='Название тега',
+        required=True,
+        opt_type=OptionType.STRING,
+        autocomplete=True
+    )
+    async def view_tag(self, ctx: SlashContext, name: str):
+        await self.view_reference(ctx, 'tag', name)
+
+    async def view_reference(self, ctx: SlashContext, kind, name):
+        # Answered from the compendium snapshot, without a query
+        snapshot = compendium.snapshot
+        record = snapshot.get(REFERENCE_MODELS[kind], guild_of(ctx), name) if snapshot is not None else None
+        if record is None:
+            await ctx.send(f'«{name}» не найдено', ephemeral=True)
+            return
+        await ctx.send(embeds=[reference_payload(snapshot, record)])
+
+    @view_feat.autocomplete('name')
+    @view_spell.autocomplete('name')
+    @view_action.autocomplete('name')
+    @view_class.autocomplete('name')
+    @view_ancestry.autocomplete('name')
+    @view_background.autocomplete('name')
+    @view_heritage.autocomplete('name')
+    @view_tag.autocomplete('name')
+    async def reference_autocomplete(self, ctx: AutocompleteContext):
+        # invoke_target is "view <kind>"
+        model = REFERENCE_MODELS[ctx.invoke_target.split()[-1]]
+        snapshot = compendium.snapshot
+        names = snapshot.search(model, guild_of(ctx), ctx.input_text) if snapshot is not None else []
+        choices = [dict(name=name, value=name) for name in names]
+
+        await ctx.send(choices=choices)
+
+def write_metrics_file():
+    path = settings.METRICS_FILE
+    with open(f'{path}.tmp', 'w') as file:
+        file.write(metrics.render())
+    os.replace(f'{path}.tmp', path)
+
+
+def search_embed(query, results):
+    embed = Embed(title=f'Поиск: {query}')
+    for model, _, name, snippet in results:
+        embed.add_field(f'{name} ({model.__name__})', snippet or ' ')
+    return embed
+
+
+def image_data(image: Attachment = None):
+    if image is None:
+        return {}
+    # Fetching and resizing starts now, while the user fills in the modal
+    images.prefetch(image.url)
+    return {'image_url': image.url, 'image_hash': None}
+
+
+async def stored_image_data(ctx, entity: Describable):
+    # Called right before a wizard saves: waits for the local copy of a new image
+    if not entity.image_url or entity.image_hash:
+        return {}
+    ingest = images.prefetch(entity.image_url)
+    if not ingest.done():
+        # Component steps have already acknowledged through the outbox
+        await ctx.defer(edit_origin=True, suppress_error=True)
+    digest = await ingest
+    return {'image_hash': digest} if digest else {}
+
+
+def guild_of(ctx):
+    # Commands sent in DMs share the guildless namespace
+    return int(ctx.guild_id) if ctx.guild_id else NO_GUILD
+
+
+def acknowledge(ctx: ComponentContext):
+    # Answers the click straight away; the new state follows through update_origin
+    return outbox.ack(functools.partial(ctx.defer, edit_origin=True))
+
+
+def update_origin(ctx: ComponentContext, **payload):
+    # Rapid edits to one message collapse into the latest state
+    return outbox.edit(ctx.message.id, ('interaction', ctx.token), functools.partial(ctx.edit_origin, **payload))
+
+
+def stat_components(draft_id, page):
+    components = []
+    for stat_id, stat in STAT_PAGES[page]:
+        options = [StringSelectOption(label=f'{i}', value=f'{i}') for i in STAT_RANGE]
+        components.append(ActionRow(StringSelectMenu(*options, placeholder=stat,
+                                                     custom_id=f'character_stat:{draft_id}:{page}:{stat_id}')))
+    components.append(ActionRow(Button(label='Далее', custom_id=f'character_next:{draft_id}:{page}',
+                                       style=ButtonStyle.GREEN)))
+    return components
+
+
+def report_components(page, page_count):
+    if page_count <= 1:
+        return []
+    return [ActionRow(Button(label='<', style=ButtonStyle.GREY, custom_id=f'report:{max(page - 1, 0)}',
+                             disabled=page == 0),
+                      Button(label='>', style=ButtonStyle.GREY, custom_id=f'report:{min(page + 1, page_count - 1)}',
+                             disabled=page >= page_count - 1))]
+
+
+def party_components(pks, page, page_count):
+    members = '.'.join(map(to_base36, pks))
+    # Parties too big for a custom_id get their pages as separate messages
+    if page_count <= 1 or len(f'party:{page_count}:{members}') > CUSTOM_ID_LIMIT:
+        return []
+    return [ActionRow(Button(label='<', style=ButtonStyle.GREY, custom_id=f'party:{max(page - 1, 0)}:{members}',
+                             disabled=page == 0),
+                      Button(label='>', style=ButtonStyle.GREY,
+                             custom_id=f'party:{min(page + 1, page_count - 1)}:{members}',
+                             disabled=page >= page_count - 1))]
+
+
+def to_base36(number):
+    digits = ''
+    while True:
+        number, digit = divmod(number, 36)
+        digits = BASE36_DIGITS[digit] + digits
+        if not number:
+            return digits
+
+
+def find_embed(title, names, page, page_count, total, missing=()):
+    lines = ['\n'.join(names) or 'Ничего не найдено']
+    if missing:
+        lines.append(f"Неизвестные теги: {', '.join(missing)}")
+    embed = Embed(title=title, description='\n\n'.join(lines))
+    embed.set_footer(f'Найдено: {total}' + (f' · страница {page + 1}/{page_count}' if page_count > 1 else ''))
+    return embed
+
+
+def find_components(kind, terms, page, page_count):
+    query = format_tag_query(terms)
+    # Queries too long for a custom_id show their first page only
+    if page_count <= 1 or len(f'find:{kind}:{page_count}:{query}') > CUSTOM_ID_LIMIT:
+        return []
+    return [ActionRow(Button(label='<', style=ButtonStyle.GREY, custom_id=f'find:{kind}:{max(page - 1, 0)}:{query}',
+                             disabled=page == 0),
+                      Button(label='>', style=ButtonStyle.GREY,
+                             custom_id=f'find:{kind}:{min(page + 1, page_count - 1)}:{query}',
+                             disabled=page >= page_count - 1))]
+
+
+def shorten(text, limit):
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def split_names(text):
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+
+def missing_names(requested, found):
+    found = set(found)
+    return [name for name in requested if name not in found]
+
+
+def roll_summary(formula, values):
+    shown = ', '.join(str(value) for value in values[:ROLL_SUMMARY_VALUES])
+    if len(values) > ROLL_SUMMARY_VALUES:
+        shown += ', …'
+    return (f'{formula} ×{len(values)}: [{shown}]\n'
+            f'Сумма: {values.sum()}, мин: {values.min()}, макс: {values.max()}, среднее: {values.mean():.2f}')
+
+
+def odds_embed(formula, distribution, target=None):
+    embed = Embed(title=f'Вероятности {formula}')
+    embed.add_field('Среднее', f'{distribution.mean:.2f}', inline=True)
+    embed.add_field('Диапазон', f'{distribution.minimum}–{distribution.maximum}', inline=True)
+    if target is not None:
+        embed.add_field(f'Не меньше {target}', f'{distribution.at_least(target):.2%}', inline=True)
+    embed.add_field('Процентили', '\n'.join(f'{percent}%: {distribution.percentile(percent)}'
+                                            for percent in PERCENTILES))
+    return embed
+
+
+def name_description_modal(title, leleved=True, effectable=False, custom_id=None, **defaults):
     components = [ShortText(label='Имя', custom_id='name', max_length=256, value=defaults.get('name', None)),
                   ParagraphText(label='Описание', custom_id='description', max_length=2000, value=defaults.get('description', None))]
     if leleved:
@@ -368,6 +1117,7 @@ def name_description_modal(title, leleved=True, effectable=False, **defaults):
     modal = Modal(
         *components,
         title=title,
+        custom_id=custom_id,
     )
     return modal
 
@@ -377,18 +1127,19 @@ def to_embed(entity: Describable):
     base_embed.title = entity.name
     base_embed.add_field(entity_type_name(entity), value=' ')
     base_embed.add_field('Описание', entity.description)
-    if entity.image_url:
-        base_embed.set_image(entity.image_url)
+    set_image(base_embed, entity)
     if isinstance(entity, Character):
         base_embed.add_field('Характеристики',
                              f'\
-Сила: {entity.strength} ({((entity.strength - 10) // 2)})\n\
-Ловкость: {entity.dexterity} ({(entity.dexterity - 10) // 2})\n\
-Телосложение: {entity.constitution} ({(entity.constitution - 10) // 2})\n\
-Интеллект: {entity.intelligence} ({(entity.intelligence - 10) // 2})\n\
-Мудрость: {entity.wisdom} ({(entity.wisdom - 10) // 2})\n\
-Харизма: {entity.charisma} ({(entity.charisma - 10) // 2})'
+Сила: {entity.strength} ({entity.strength_mod})\n\
+Ловкость: {entity.dexterity} ({entity.dexterity_mod})\n\
+Телосложение: {entity.constitution} ({entity.constitution_mod})\n\
+Интеллект: {entity.intelligence} ({entity.intelligence_mod})\n\
+Мудрость: {entity.wisdom} ({entity.wisdom_mod})\n\
+Харизма: {entity.charisma} ({entity.charisma_mod})'
                              )
+        base_embed.add_field('Нагрузка', f'{format_bulk(entity.carried_bulk)} из {5 + entity.strength_mod}, '
+                                         f'{entity.get_encumbrance_display().lower()}')
     if isinstance(entity, Item):
         base_embed.add_field('Масса', entity.bulk_txt)
     if hasattr(entity, 'effect'):
@@ -396,6 +1147,61 @@ def to_embed(entity: Describable):
     return base_embed
 
 
+def set_image(embed, entity, size='large'):
+    # The thumbnail sits beside the text instead of under it
+    show = embed.set_thumbnail if size == 'thumb' else embed.set_image
+    if entity.image_hash and settings.IMAGE_BASE_URL:
+        show(images.image_url(entity.image_hash, size))
+    elif entity.image_url:
+        show(entity.image_url)
+
+
+def embed_key(entity: Describable):
+    key = (entity._meta.label, entity.pk, entity.version)
+    if isinstance(entity, Character):
+        # The sheet shows its class's name, which changes without the character's version
+        character_class = entity.character_class
+        key += ((character_class.pk, character_class.version) if character_class is not None else None,)
+    return key
+
+
+def embed_payload(entity: Describable):
+    # Saved entities only: drafts in the create/edit flows change without a version bump
+    key = embed_key(entity)
+    payload = embed_cache.get(key)
+    if payload is None:
+        payload = to_embed(entity).to_dict()
+        embed_cache.put(key, payload)
+    return payload
+
+
+def reference_payload(snapshot, record):
+    # Tag names come from the same snapshot, so its generation is part of the key
+    key = (record.model._meta.label, record.pk, record.version, snapshot.generation)
+    payload = embed_cache.get(key)
+    if payload is None:
+        payload = reference_embed(snapshot, record).to_dict()
+        embed_cache.put(key, payload)
+    return payload
+
+
+def reference_embed(snapshot, record):
+    embed = Embed(title=record.name)
+    type_name = record.model.__name__
+    embed.add_field(type_name if record.level is None else f'{type_name} {record.level}', ' ')
+    embed.add_field('Описание', record.description)
+    # Rules text comes first in the compendium: its art is the thumbnail
+    set_image(embed, record, 'thumb')
+    for label, value in record.details:
+        embed.add_field(label, value)
+    tags = snapshot.tag_names(record)
+    if tags:
+        embed.add_field('Теги', ', '.join(tags))
+    if record.effect:
+        embed.add_field('Эффект', record.effect)
+    return embed
+
+
 def entity_type_name(entity):
     if isinstance(entity, Character):
         if entity.character_class is not None:
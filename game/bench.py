@@ -0,0 +1,94 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+from game.derived import recompute_derived_stats
+from game.models import Character, InventoryEntry, Item
+
+SYLLABLES = ['ка', 'ра', 'мир', 'дор', 'гул', 'эль', 'тан', 'вор', 'лин', 'зар',
+             'bel', 'dra', 'gor', 'mith', 'ril', 'sha', 'tor', 'vel', 'xan', 'yth']
+# Seeded rows belong to this guild, the one replay.FakeContext plays in
+BENCH_GUILD = 1
+CHARACTERS_PER_OWNER = 4
+
+
+@contextmanager
+def bench_database():
+    # Throwaway database built the same way the test runner builds one. SQLite gets a
+    # real file rather than the shared in-memory database so worker threads behave as
+    # they do against db.sqlite3.
+    with tempfile.TemporaryDirectory() as directory:
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        old_test_name = test_settings.get('NAME')
+        if connection.vendor == 'sqlite':
+            test_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+
+
+def random_name(rng: random.Random, words=2):
+    return ' '.join(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+                    for _ in range(words))
+
+
+def unique_names(rng: random.Random, count, words=2):
+    names = set()
+    while len(names) < count:
+        names.add(random_name(rng, words))
+    return sorted(names)
+
+
+def seed_items(count, rng: random.Random, batch_size=2000):
+    Item.objects.bulk_create((Item(guild_id=BENCH_GUILD, name=name, description='', bulk=rng.randint(-1, 3),
+                                   level=rng.randint(0, 20))
+                              for name in unique_names(rng, count, words=3)),
+                             batch_size=batch_size)
+
+
+def seed_characters(count, rng: random.Random, batch_size=2000):
+    # A few characters per player, like a real table
+    owners = max(1, count // CHARACTERS_PER_OWNER)
+    Character.objects.bulk_create((Character(guild_id=BENCH_GUILD, name=name, description='', level=rng.randint(1, 20),
+                                             discord_id=rng.randint(1, owners))
+                                   for name in unique_names(rng, count)),
+                                  batch_size=batch_size)
+
+
+def seed_inventories(per_character, rng: random.Random, batch_size=5000):
+    item_ids = list(Item.objects.values_list('pk', flat=True))
+    entries = (InventoryEntry(character_id=character_id, item_id=item_id, quantity=rng.randint(1, 50))
+               for character_id in Character.objects.values_list('pk', flat=True)
+               for item_id in rng.sample(item_ids, min(per_character, len(item_ids))))
+    InventoryEntry.objects.bulk_create(entries, batch_size=batch_size)
+    recompute_derived_stats(Character.objects.all())
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    # Seconds in, milliseconds out
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(samples, 0.5) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples) * 1000,
+    }
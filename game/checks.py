@@ -0,0 +1,42 @@
+import numpy as np
+from interactions import Embed
+
+from game import rolls
+from game.models import Character
+
+# Longer results are cut to fit an embed description
+CHECK_LINES = 40
+
+
+def check_rows(guild_id, ability, names=None):
+    # (name, modifier) of the named characters, or of everyone in the guild, in
+    # one query. The stored modifiers are the ones character sheets show.
+    characters = Character.objects.for_guild(guild_id)
+    if names is not None:
+        characters = characters.filter(name__in=names)
+    return list(characters.order_by('name').values_list('name', f'{ability}_mod'))
+
+
+def roll_check(formula, rows, rng=None):
+    # Everyone rolls in one batch; [(name, roll, modifier, total)], best first,
+    # ties in name order
+    modifiers = np.fromiter((modifier for _, modifier in rows), dtype=np.int64, count=len(rows))
+    rolled = rolls.roll_many(formula, len(rows), rng)
+    totals = rolled + modifiers
+    return [(rows[i][0], int(rolled[i]), int(modifiers[i]), int(totals[i]))
+            for i in np.argsort(-totals, kind='stable')]
+
+
+def check_embed(title, results, dc=None):
+    lines = []
+    for name, rolled, modifier, total in results[:CHECK_LINES]:
+        line = f'**{total}** {name} ({rolled} {modifier:+d})'
+        if dc is not None:
+            line += ' ✓' if total >= dc else ' ✗'
+        lines.append(line)
+    if len(results) > CHECK_LINES:
+        lines.append(f'… и ещё {len(results) - CHECK_LINES}')
+    embed = Embed(title=title, description='\n'.join(lines))
+    if dc is not None:
+        embed.add_field(f'КС {dc}', f'Успехов: {sum(total >= dc for *_, total in results)}/{len(results)}')
+    return embed
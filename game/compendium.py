@@ -0,0 +1,186 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+
+from game.derived import recompute_derived_stats
+from game.models import (NO_GUILD, Action, Ancestry, Background, Character, Class, EquipmentEntry, Feat,
+                         Heritage, InventoryEntry, Item, Spell, Tag)
+
+COMPENDIUM_MODELS = {
+    'tag': Tag,
+    'item': Item,
+    'feat': Feat,
+    'spell': Spell,
+    'action': Action,
+    'ancestry': Ancestry,
+    'background': Background,
+    'heritage': Heritage,
+    'class': Class,
+}
+IMPORT_BATCH_SIZE = 1000
+# Separates several names in one CSV cell, e.g. tags
+CSV_LIST_SEPARATOR = ';'
+
+
+def read_rows(path):
+    # One dict per record, never the whole file
+    with open(path, newline='', encoding='utf-8') as file:
+        if str(path).endswith('.csv'):
+            for row in csv.DictReader(file):
+                yield {key: _csv_value(value) for key, value in row.items()}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _csv_value(value):
+    if value is None or value == '':
+        return None
+    return value
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def _names(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [name.strip() for name in value.split(CSV_LIST_SEPARATOR) if name.strip()]
+    return list(value)
+
+
+def _bulk(value):
+    if isinstance(value, str):
+        item = Item()
+        item.txt_to_bulk(value)
+        return item.bulk
+    return value
+
+
+class CompendiumImporter:
+    # Upserts rows into one compendium model by name within a guild: a name lookup
+    # and an upserting bulk_create per batch. Tag and other references resolve
+    # through the guild's name -> id maps loaded once, and missing tags are
+    # created on the way.
+
+    def __init__(self, model, batch_size=IMPORT_BATCH_SIZE, guild_id=NO_GUILD):
+        self.model = model
+        self.batch_size = batch_size
+        self.guild_id = guild_id
+        self.fields = {field.name: field for field in model._meta.concrete_fields
+                       if not field.primary_key and field.editable and field.name not in ('guild_id', 'name')
+                       and not field.is_relation}
+        self.foreign_keys = {field.name: field for field in model._meta.concrete_fields if field.is_relation}
+        # Relations with their own through model (a character's inventory) carry more
+        # than names and are left to subclasses
+        self.many_to_many = {field.name: field for field in model._meta.many_to_many
+                             if field.remote_field.through._meta.auto_created}
+        self._references = {}
+        self.created = self.updated = self.skipped = 0
+        self.missing = set()
+
+    def references(self, model):
+        if model not in self._references:
+            self._references[model] = dict(model.objects.for_guild(self.guild_id).values_list('name', 'pk'))
+        return self._references[model]
+
+    def resolve(self, model, names):
+        known = self.references(model)
+        unknown = [name for name in dict.fromkeys(names) if name not in known]
+        if unknown and model is Tag:
+            Tag.objects.bulk_create((Tag(guild_id=self.guild_id, name=name, description='') for name in unknown),
+                                    ignore_conflicts=True)
+            known.update(Tag.objects.for_guild(self.guild_id).filter(name__in=unknown).values_list('name', 'pk'))
+        ids = []
+        for name in names:
+            if name in known:
+                ids.append(known[name])
+            else:
+                self.missing.add(f'{model.__name__} {name}')
+        return ids
+
+    def build(self, row):
+        values = {}
+        for name, field in self.fields.items():
+            if name in row:
+                value = row[name]
+                if name == 'bulk' and self.model is Item:
+                    value = _bulk(value)
+                values[name] = field.get_default() if value is None and not field.null else field.to_python(value)
+        for name, field in self.foreign_keys.items():
+            if name in row:
+                ids = self.resolve(field.related_model, _names(row[name]))
+                values[field.attname] = ids[0] if ids else None
+        return values
+
+    def run(self, rows):
+        for batch in batched(rows, self.batch_size):
+            with transaction.atomic():
+                self.import_batch(batch)
+            yield len(batch)
+
+    def import_batch(self, batch):
+        # Last row wins when a name repeats
+        rows = {}
+        for row in batch:
+            name = row.get('name')
+            if not name or len(str(name)) < 2:
+                self.skipped += 1
+                continue
+            rows[str(name).strip()] = row
+        existing = {name: (pk, version) for name, pk, version in
+                    self.scoped().filter(name__in=rows).values_list('name', 'pk', 'version')}
+
+        # ON CONFLICT(guild_id, name) DO UPDATE, grouped by which columns the rows carry so a
+        # row never resets a column it did not mention
+        groups = {}
+        for name, row in rows.items():
+            values = self.build(row)
+            # Rendered embeds are cached by version
+            version = existing[name][1] + 1 if name in existing else 1
+            groups.setdefault(frozenset(values), []).append(
+                self.model(guild_id=self.guild_id, name=name, version=version, **values))
+        for fields, objects in groups.items():
+            self.model.objects.bulk_create(objects, update_conflicts=True, unique_fields=['guild_id', 'name'],
+                                           update_fields=[*fields, 'version'])
+        self.updated += len(existing)
+        self.created += len(rows) - len(existing)
+        if self.model is Item and existing and any('bulk' in fields for fields in groups):
+            item_ids = [pk for pk, _ in existing.values()]
+            recompute_derived_stats(Character.objects.filter(
+                Q(pk__in=InventoryEntry.objects.filter(item_id__in=item_ids).values('character_id'))
+                | Q(pk__in=EquipmentEntry.objects.filter(item_id__in=item_ids).values('character_id'))))
+
+        ids = None
+        if self.model is Tag or any(field in row for row in rows.values() for field in self.many_to_many):
+            ids = dict(self.scoped().filter(name__in=rows).values_list('name', 'pk'))
+            if self.model is Tag:
+                self.references(Tag).update(ids)
+            self.link(rows, ids)
+        return rows, ids
+
+    def scoped(self):
+        return self.model.objects.for_guild(self.guild_id)
+
+    def link(self, rows, ids):
+        for name, field in self.many_to_many.items():
+            through = field.remote_field.through
+            source = f'{self.model._meta.model_name}_id'
+            target = f'{field.related_model._meta.model_name}_id'
+            present = {ids[row_name]: row[name] for row_name, row in rows.items() if name in row}
+            if not present:
+                continue
+            through.objects.filter(**{f'{source}__in': present}).delete()
+            through.objects.bulk_create(
+                (through(**{source: pk, target: related_id})
+                 for pk, names in present.items()
+                 for related_id in self.resolve(field.related_model, _names(names))),
+                ignore_conflicts=True)
@@ -0,0 +1,89 @@
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Least
+from django.db.models.lookups import GreaterThan
+
+from game.models import (ABILITIES, ENCUMBERED, L_PER_BULK, OVERLOADED, UNENCUMBERED, Character, EquipmentEntry,
+                         InventoryEntry, Item)
+
+# SQL versions of the derived Character stats in models.py, for changes made with
+# bulk queries that never call Character.save(). Each bumps Character.version,
+# which keys the rendered sheets.
+
+
+def units(item_prefix=''):
+    bulk = F(f'{item_prefix}bulk')
+    return Case(When(**{f'{item_prefix}bulk__lt': 0}, then=Value(0)),
+                When(**{f'{item_prefix}bulk': 0}, then=Value(1)),
+                default=bulk * L_PER_BULK, output_field=IntegerField())
+
+
+def _per_character(queryset, amount):
+    return Coalesce(Subquery(queryset.filter(character_id=OuterRef('pk')).order_by()
+                             .values('character_id').annotate(total=Sum(amount)).values('total')),
+                    Value(0))
+
+
+def _encumbrance(carried):
+    whole = carried / L_PER_BULK
+    return Case(When(GreaterThan(whole, F('strength_mod') + 10), then=Value(OVERLOADED)),
+                When(GreaterThan(whole, F('strength_mod') + 5), then=Value(ENCUMBERED)),
+                default=Value(UNENCUMBERED))
+
+
+def refresh_encumbrance(characters):
+    characters.update(encumbrance=_encumbrance(F('carried_bulk')), version=F('version') + 1)
+
+
+def recompute_derived_stats(characters, inventory=InventoryEntry.objects, equipment=EquipmentEntry.objects):
+    # From scratch, for imports and the migration that added the columns (which
+    # passes its historical managers): modifiers, then carried bulk over
+    # inventory and equipment
+    characters.update(**{f'{ability}_mod': (F(ability) + 10) / 2 - 10 for ability in ABILITIES})
+    characters.update(carried_bulk=_per_character(inventory, F('quantity') * units('item__'))
+                      + _per_character(equipment, units('item__')))
+    refresh_encumbrance(characters)
+
+
+def add_carried_bulk(character_ids, amount):
+    # One UPDATE: the encumbrance is worked out from the new total
+    carried = F('carried_bulk') + amount
+    Character.objects.filter(pk__in=character_ids).update(carried_bulk=carried, encumbrance=_encumbrance(carried),
+                                                         version=F('version') + 1)
+
+
+def take_carried_bulk(character_ids, item_ids, quantity):
+    # Before the inventory rows shrink: nobody loses more of an item than they hold
+    held = InventoryEntry.objects.filter(item_id__in=item_ids)
+    add_carried_bulk(character_ids, -_per_character(held, Least(F('quantity'), Value(quantity)) * units('item__')))
+
+
+def item_bulk_changed(item_id, old_units, new_units):
+    # Every holder moves by the difference, times how many they carry
+    delta = new_units - old_units
+    if not delta:
+        return
+    holders = (set(InventoryEntry.objects.filter(item_id=item_id).values_list('character_id', flat=True))
+               | set(EquipmentEntry.objects.filter(item_id=item_id).values_list('character_id', flat=True)))
+    if holders:
+        carried = (_per_character(InventoryEntry.objects.filter(item_id=item_id), F('quantity'))
+                   + _per_character(EquipmentEntry.objects.filter(item_id=item_id), Value(1)))
+        add_carried_bulk(holders, carried * delta)
+
+
+def entries_deleted(entries):
+    # entries: an inventory or equipment queryset about to be deleted. One UPDATE
+    # for all holders, whatever the number of rows.
+    amount = units('item__') if entries.model is EquipmentEntry else F('quantity') * units('item__')
+    add_carried_bulk(entries.values('character_id'), -_per_character(entries, amount))
+
+
+def entry_changed(old, new):
+    # old, new: (character id, item id, quantity) of an inventory or equipment
+    # row before and after a save, None for a row that did not or no longer exists
+    if old is not None and new is not None and old[:2] == new[:2]:
+        old, new = None, (*new[:2], new[2] - old[2])
+    for entry, sign in ((old, -1), (new, 1)):
+        if entry is not None and entry[2]:
+            character_id, item_id, quantity = entry
+            item_units = Subquery(Item.objects.filter(pk=item_id).annotate(units=units()).values('units'))
+            add_carried_bulk([character_id], item_units * (sign * quantity))
@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import aiohttp
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from game.cache import LRUCache
+
+# Attachments are fetched once, stored under the sha256 of their bytes, and
+# re-encoded into the sizes below; embeds link to those instead of Discord's
+# expiring CDN URLs. Identical uploads share one file.
+IMAGE_SIZES = {
+    'thumb': 256,
+    'large': 1024,
+}
+IMAGE_FORMAT = 'webp'
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+FETCH_TIMEOUT = 15
+
+_pool = None
+# Ingest tasks by attachment URL, finished ones included, so a wizard's last
+# step reuses the fetch its first step started
+_ingests = LRUCache(maxsize=256)
+
+logger = logging.getLogger(__name__)
+
+
+def _process_pool():
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: the bot process already runs DB and event loop threads
+        _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS,
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _discard_process_pool():
+    global _pool
+    _pool = None
+
+
+def original_path(root, digest):
+    return os.path.join(root, 'originals', digest[:2], digest)
+
+
+def image_path(root, size, digest):
+    return os.path.join(root, size, digest[:2], f'{digest}.{IMAGE_FORMAT}')
+
+
+def image_url(digest, size='large'):
+    return f'{settings.IMAGE_BASE_URL.rstrip("/")}/{size}/{digest[:2]}/{digest}.{IMAGE_FORMAT}'
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+def store_original(root, data: bytes):
+    digest = hashlib.sha256(data).hexdigest()
+    path = original_path(root, digest)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return digest
+
+
+def render_sizes(root, digest):
+    # Runs in the process pool: decoding and resampling hold the GIL for long stretches
+    with Image.open(original_path(root, digest)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+        for size, pixels in IMAGE_SIZES.items():
+            path = image_path(root, size, digest)
+            if os.path.exists(path):
+                continue
+            resized = original.copy()
+            resized.thumbnail((pixels, pixels), Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            resized.save(f'{path}.tmp', IMAGE_FORMAT.upper(), quality=85, method=4)
+            os.replace(f'{path}.tmp', path)
+    return digest
+
+
+async def fetch(url):
+    # file:// URLs read from disk, where settings.IMAGE_FILE_URLS allows it
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        if not settings.IMAGE_FILE_URLS:
+            raise PermissionError(f'file:// image URLs are disabled: {url}')
+        with open(url2pathname(parsed.path), 'rb') as file:
+            return file.read(MAX_IMAGE_BYTES + 1)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT)) as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return await response.content.read(MAX_IMAGE_BYTES + 1)
+
+
+async def _ingest(url):
+    try:
+        data = await fetch(url)
+        if len(data) > MAX_IMAGE_BYTES:
+            return None
+        root = str(settings.IMAGE_ROOT)
+        digest = await asyncio.to_thread(store_original, root, data)
+        return await asyncio.get_running_loop().run_in_executor(_process_pool(), render_sizes, root, digest)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        _discard_process_pool()
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+        return None
+    except Exception:
+        # A corrupt or oversized file fails in the decoder in many ways
+        # (DecompressionBombError, ValueError, SyntaxError...): the entity is
+        # saved without a stored copy either way
+        logger.exception('Could not store the image at %s', url)
+        return None
+
+
+def prefetch(url):
+    # Starts ingesting as soon as the attachment is known; ingest() picks it up later
+    task = _ingests.get(url)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_ingest(url))
+        _ingests.put(url, task)
+        task.add_done_callback(functools.partial(_forget_failure, url))
+    return task
+
+
+def _forget_failure(url, task):
+    # A failure may be a passing network error: the next ingest tries again
+    if (task.cancelled() or task.result() is None) and _ingests.get(url) is task:
+        _ingests.pop(url)
+
+
+async def ingest(url):
+    # sha256 of the stored image, or None if it could not be fetched or decoded
+    return await prefetch(url)
@@ -0,0 +1,87 @@
+from django.db import connection, transaction
+from django.db.models import F, IntegerField, Value
+from django.db.models.functions import Greatest
+from interactions import Embed
+
+from game.derived import add_carried_bulk, take_carried_bulk
+from game.models import Character, InventoryEntry, Item, bulk_units
+
+# Discord allows at most 25 fields per embed
+INVENTORY_PAGE_SIZE = 20
+# Tells the two halves of the give lookup apart
+CHARACTER, ITEM = 0, 1
+
+
+def inventory_entries(character: Character):
+    # One joined query instead of a lazy Item fetch per entry
+    return list(InventoryEntry.objects
+                .filter(character_id=character.pk)
+                .select_related('item')
+                .only('quantity', 'item__name', 'item__bulk')
+                .order_by('item__name'))
+
+
+def inventory_pages(character: Character, page_size=INVENTORY_PAGE_SIZE):
+    entries = inventory_entries(character)
+    title = f'Инвентарь {character.name}'
+    if not entries:
+        embed = Embed(title=title, description='Пусто')
+        return [embed]
+    pages = []
+    page_count = (len(entries) + page_size - 1) // page_size
+    for page, start in enumerate(range(0, len(entries), page_size), start=1):
+        embed = Embed(title=title)
+        for entry in entries[start:start + page_size]:
+            embed.add_field(f'{entry.item.name} x{entry.quantity}', value=f'Масса {entry.total_bulk_txt()}')
+        if page_count > 1:
+            embed.set_footer(f'Страница {page}/{page_count}')
+        pages.append(embed)
+    return pages
+
+
+def give_items(guild_id, character_names, item_names, quantity):
+    # Adds quantity (or takes, if negative) of every item to every character. Returns
+    # the character and item names that exist and, when taking, how many rows held
+    # an item.
+    characters, items = _lookup(guild_id, character_names, item_names)
+    item_names = [name for name, _ in items.values()]
+    if not characters or not items:
+        return list(characters.values()), item_names, 0
+    held = InventoryEntry.objects.filter(character_id__in=characters, item_id__in=items)
+    present = 0
+    with transaction.atomic():
+        # Writing first takes SQLite's write lock before anything is read, so a
+        # concurrent give waits instead of losing its update
+        if quantity > 0:
+            add_carried_bulk(characters, quantity * sum(bulk_units(bulk) for _, bulk in items.values()))
+            _add_entries(characters, items, quantity)
+        else:
+            take_carried_bulk(characters, items, -quantity)
+            present = held.update(quantity=Greatest(F('quantity') + quantity, Value(0)))
+            # Already taken off carried_bulk above
+            held.filter(quantity=0).raw_delete()
+    return list(characters.values()), item_names, present
+
+
+def _lookup(guild_id, character_names, item_names):
+    # Both name lookups in one query: {pk: name} of the characters, {pk: (name, bulk)} of the items
+    characters = (Character.objects.for_guild(guild_id).filter(name__in=character_names)
+                  .annotate(kind=Value(CHARACTER), weight=Value(None, output_field=IntegerField())))
+    items = (Item.objects.for_guild(guild_id).filter(name__in=item_names)
+             .annotate(kind=Value(ITEM), weight=F('bulk')))
+    found = {CHARACTER: {}, ITEM: {}}
+    for kind, pk, name, bulk in characters.values_list('kind', 'pk', 'name', 'weight').union(
+            items.values_list('kind', 'pk', 'name', 'weight'), all=True):
+        found[kind][pk] = name if kind == CHARACTER else (name, bulk)
+    return found[CHARACTER], found[ITEM]
+
+
+def _add_entries(character_ids, item_ids, quantity):
+    # One upsert adds to the rows already there and creates the rest
+    table = InventoryEntry._meta.db_table
+    rows = [(character_id, item_id, quantity) for character_id in character_ids for item_id in item_ids]
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} (character_id, item_id, quantity) '
+                       f'VALUES {", ".join(["(%s, %s, %s)"] * len(rows))} '
+                       f'ON CONFLICT (character_id, item_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity',
+                       [value for row in rows for value in row])
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from game.management.commands.cacheimages import describable_models
+from game.models import NO_GUILD
+from game.reference import request_reload
+
+
+class Command(BaseCommand):
+    help = 'Move everything created before guild scoping (or in DMs) into a guild'
+
+    def add_arguments(self, parser):
+        parser.add_argument('guild', type=int, help='Discord guild id to move the rows to')
+        parser.add_argument('--from-guild', type=int, default=NO_GUILD, help='Guild id to move the rows from')
+
+    def handle(self, *args, **options):
+        source, target = options['from_guild'], options['guild']
+        if source == target:
+            raise CommandError('Guilds are the same')
+        with transaction.atomic():
+            conflicts = []
+            for model in describable_models():
+                names = model.objects.for_guild(source).values('name')
+                taken = model.objects.for_guild(target).filter(name__in=names).values_list('name', flat=True)
+                conflicts.extend(f'{model.__name__}: {name}' for name in taken)
+            if conflicts:
+                raise CommandError('Already in the guild:\n' + '\n'.join(conflicts))
+            for model in describable_models():
+                moved = model.objects.for_guild(source).update(guild_id=target)
+                if moved:
+                    self.stdout.write(f'{model.__name__}: {moved}')
+        # The bot rebuilds its compendium and indexes on its next poll
+        request_reload()
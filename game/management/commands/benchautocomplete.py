@@ -0,0 +1,43 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand
+
+from game.bench import BENCH_GUILD, bench_database, seed_items, summarize, timed
+from game.models import Item
+from game.name_index import GuildNameIndexes, orm_search_names
+
+
+class Command(BaseCommand):
+    help = 'Compare the in-memory name index with the icontains ORM lookup used by autocomplete'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=20000)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with bench_database():
+            seed_items(options['items'], rng)
+            names = list(Item.objects.values_list('name', flat=True))
+            # Whatever a player has typed so far: prefixes and fragments of real names
+            queries = []
+            for _ in range(options['queries']):
+                name = rng.choice(names).casefold()
+                start = rng.choice([0, 0, rng.randrange(len(name))])
+                queries.append(name[start:start + rng.randint(1, 6)])
+
+            # The per-guild index the bot searches, against the lookup it replaced
+            index = GuildNameIndexes()
+            build_time, _ = timed(index.build, Item.objects.values_list('pk', 'guild_id', 'name'))
+            orm = [timed(orm_search_names, Item, BENCH_GUILD, query)[0] for query in queries]
+            indexed = [timed(index.search, BENCH_GUILD, query)[0] for query in queries]
+
+        report = {
+            'items': options['items'],
+            'index_build_ms': build_time * 1000,
+            'orm': summarize(orm),
+            'index': summarize(indexed),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+from itertools import count
+
+import interactions
+from django.core.management.base import BaseCommand
+
+from game import metrics
+from game.bench import CHARACTERS_PER_OWNER, bench_database, seed_characters, seed_inventories, seed_items, summarize
+from game.models import Character, Item
+from game.name_index import build_name_indexes
+from game.replay import ReplayClient, find_custom_id
+
+
+class Command(BaseCommand):
+    help = 'Replay scripted interactions against CharacterExtension offline and report JSON timings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--characters', type=int, default=5000)
+        parser.add_argument('--inventory', type=int, default=200, help='Inventory entries per character')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--only', nargs='*', help='Scenario names to run')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Earlier JSON report to print p50 ratios against')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with bench_database():
+            seed_items(options['items'], rng)
+            seed_characters(options['characters'], rng)
+            seed_inventories(options['inventory'], rng)
+            build_name_indexes()
+            characters = list(Character.objects.values_list('name', flat=True))
+            items = list(Item.objects.values_list('name', flat=True))
+            results = asyncio.run(self.replay(options, characters, items, rng))
+
+        report = {
+            'items': options['items'],
+            'characters': options['characters'],
+            'inventory': options['inventory'],
+            'iterations': options['iterations'],
+            'scenarios': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    async def replay(self, options, characters, items, rng):
+        client = interactions.Client(token='replay')
+        client.load_extension('bot')
+        extension = client.get_ext('CharacterExtension')
+        replay = ReplayClient()
+        extension.bot = replay
+
+        scenarios = self.scenarios(extension, replay, characters, items, rng)
+        if options['only']:
+            scenarios = {name: scenario for name, scenario in scenarios.items() if name in options['only']}
+
+        # The bot's own per-interaction counter; it follows DB work into the worker threads
+        metrics.install_query_counter()
+        results = {}
+        for name, scenario in scenarios.items():
+            samples, query_counts, api_calls = [], [], []
+            for _ in range(options['iterations']):
+                replay.api_calls = 0
+                with metrics.collecting() as stats:
+                    start = time.perf_counter()
+                    await scenario()
+                    samples.append(time.perf_counter() - start)
+                query_counts.append(stats.queries)
+                api_calls.append(replay.api_calls)
+            results[name] = {
+                **summarize(samples),
+                'queries': sum(query_counts) / len(query_counts),
+                'api_calls': sum(api_calls) / len(api_calls),
+            }
+
+        # Allocation tracing slows everything down, so it gets its own pass
+        tracemalloc.start()
+        for name, scenario in scenarios.items():
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await scenario()
+            _, peak = tracemalloc.get_traced_memory()
+            results[name]['peak_alloc_kib'] = (peak - before) / 1024
+        tracemalloc.stop()
+        return results
+
+    def scenarios(self, extension, replay, characters, items, rng):
+        serial = count()
+
+        def prefix(names):
+            name = rng.choice(names)
+            return name[:rng.randint(1, 5)]
+
+        async def view_character():
+            replay.script(components=[('inv', []), ('next', []), ('prev', []), ('desc', []), ('exit', [])])
+            await extension.view_character.callback(replay.context(), name=rng.choice(characters))
+
+        async def create_character():
+            ctx = replay.context()
+            await extension.create_character.callback(ctx)
+            ctx = replay.context(custom_id=ctx.modal.custom_id,
+                                 responses={'name': f'Replay {next(serial)}', 'description': 'replay', 'level': '3'})
+            await extension.character_modal.callback(ctx)
+            for page in (('strength', '16'), ('dexterity', '14')), (('wisdom', '12'),):
+                for stat, value in page:
+                    ctx = replay.context(custom_id=find_custom_id(ctx.message, 'character_stat:', f':{stat}'),
+                                         values=[value], message=ctx.message)
+                    await extension.character_stat.callback(ctx)
+                ctx = replay.context(custom_id=find_custom_id(ctx.message, 'character_next:'), message=ctx.message)
+                await extension.character_next.callback(ctx)
+
+        async def edit_item():
+            name = rng.choice(items)
+            ctx = replay.context()
+            await extension.edit_item.callback(ctx, name=name)
+            ctx = replay.context(custom_id=ctx.modal.custom_id,
+                                 responses={'name': name, 'description': f'replay {next(serial)}', 'level': '2',
+                                            'effect': ''})
+            await extension.item_modal.callback(ctx)
+            ctx = replay.context(custom_id=find_custom_id(ctx.message, 'item_bulk:'),
+                                 values=[str(rng.randint(1, 3))])
+            await extension.item_bulk.callback(ctx)
+
+        return {
+            'roll': lambda: extension.roll.callback(replay.context(), formula='4d6h3+2'),
+            'roll_times': lambda: extension.roll.callback(replay.context(), formula='d20+7', times=100),
+            'odds': lambda: extension.odds.callback(replay.context(), formula='10d20h1+3', target=20),
+            'autocomplete_character': lambda: extension.vc_autocomplete(
+                replay.context(input_text=prefix(characters))),
+            'autocomplete_item': lambda: extension.vi_autocomplete(replay.context(input_text=prefix(items))),
+            'view_character': view_character,
+            'check': lambda: extension.check.callback(
+                replay.context(), ability='wisdom', characters=', '.join(rng.sample(characters, 6)), dc=15),
+            'me': lambda: extension.me.callback(replay.context(
+                author_id=rng.randint(1, max(1, len(characters) // CHARACTERS_PER_OWNER)))),
+            'view_item': lambda: extension.view_item.callback(replay.context(), name=rng.choice(items)),
+            'give_item': lambda: extension.give_item.callback(
+                replay.context(), char_name=rng.choice(characters), item_name=rng.choice(items), quantity=2),
+            'give_loot': lambda: extension.give_loot.callback(
+                replay.context(), characters=', '.join(rng.sample(characters, 6)),
+                items=', '.join(rng.sample(items, 5))),
+            'create_character': create_character,
+            'edit_item': edit_item,
+        }
+
+    def compare(self, path, results):
+        with open(path) as file:
+            baseline = json.load(file)['scenarios']
+        for name, result in results.items():
+            if name in baseline:
+                ratio = result['p50_ms'] / baseline[name]['p50_ms']
+                self.stderr.write(f'{name}: p50 {baseline[name]["p50_ms"]:.3f} -> {result["p50_ms"]:.3f} ms '
+                                  f'(x{ratio:.2f}), queries {baseline[name]["queries"]:.1f} -> '
+                                  f'{result["queries"]:.1f}')
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from game import repository
+from game.bench import BENCH_GUILD, bench_database, seed_characters, seed_inventories, seed_items, summarize
+from game.models import Character, Item
+from game.name_index import orm_search_names
+
+
+class Command(BaseCommand):
+    help = 'Latency of simultaneous interactions on the thread-sensitive path versus the DB worker pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interactions', type=int, default=100)
+        parser.add_argument('--items', type=int, default=20000)
+        parser.add_argument('--characters', type=int, default=200)
+        parser.add_argument('--inventory', type=int, default=100)
+        parser.add_argument('--rate', type=float, default=200, help='Arrivals per second')
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with bench_database():
+            seed_items(options['items'], rng)
+            seed_characters(options['characters'], rng)
+            seed_inventories(options['inventory'], rng)
+            names = list(Character.objects.values_list('name', flat=True))
+            report = {'interactions': options['interactions']}
+            paths = {
+                'thread_sensitive': lambda func: sync_to_async(func),
+                'db_pool': repository.db_task,
+            }
+            for path, wrap in paths.items():
+                samples = []
+                for _ in range(options['rounds']):
+                    samples.extend(asyncio.run(self.burst(wrap, names, options, rng)))
+                report[path] = {kind: summarize([elapsed for sample_kind, elapsed in samples if sample_kind == kind])
+                                for kind in ('view', 'autocomplete')}
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def burst(self, wrap, names, options, rng):
+        get_character = wrap(repository.get_character.func)
+        inventory_pages = wrap(repository.inventory_pages.func)
+        # Every tenth interaction is an unindexed autocomplete scan, the slow query
+        # the rest of the guilds should not have to queue behind
+        search = wrap(orm_search_names)
+
+        async def view(delay, name):
+            await asyncio.sleep(delay)
+            start = time.perf_counter()
+            character = await get_character(BENCH_GUILD, name)
+            await inventory_pages(character)
+            return 'view', time.perf_counter() - start
+
+        async def autocomplete(delay):
+            await asyncio.sleep(delay)
+            start = time.perf_counter()
+            await search(Item, BENCH_GUILD, 'zzz')
+            return 'autocomplete', time.perf_counter() - start
+
+        # Latency counts from each interaction's arrival, arrivals spread at --rate
+        interval = 1 / options['rate']
+        return await asyncio.gather(*(autocomplete(i * interval) if i % 10 == 0
+                                      else view(i * interval, rng.choice(names))
+                                      for i in range(options['interactions'])))
@@ -0,0 +1,40 @@
+import asyncio
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from game import images
+from game.models import Describable
+
+
+def describable_models():
+    return [model for model in apps.get_app_config('game').get_models() if issubclass(model, Describable)]
+
+
+class Command(BaseCommand):
+    help = 'Store local copies of every image_url that does not have one yet (expired links are skipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8)
+
+    def handle(self, *args, **options):
+        for model in describable_models():
+            pending = list(model.objects.filter(image_url__isnull=False, image_hash__isnull=True)
+                           .exclude(image_url='').values_list('pk', 'image_url'))
+            if not pending:
+                continue
+            digests = asyncio.run(self.ingest_all([url for _, url in pending], options['concurrency']))
+            stored = 0
+            for (pk, _), digest in zip(pending, digests):
+                if digest:
+                    stored += model.objects.filter(pk=pk).update(image_hash=digest, version=F('version') + 1)
+            self.stdout.write(f'{model.__name__}: {stored}/{len(pending)} images stored')
+
+    async def ingest_all(self, urls, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def ingest(url):
+            async with semaphore:
+                return await images.ingest(url)
+        return await asyncio.gather(*(ingest(url) for url in urls))
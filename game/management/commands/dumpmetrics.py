@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Print the latest metrics snapshot written by the running bot'
+
+    def handle(self, *args, **options):
+        try:
+            with open(settings.METRICS_FILE) as file:
+                self.stdout.write(file.read(), ending='')
+        except FileNotFoundError:
+            raise CommandError(f'No metrics at {settings.METRICS_FILE}, is the bot running?')
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.models import NO_GUILD
+from game.sheets import EXPORT_CHUNK_SIZE, export_sheets, write_sheets
+
+
+class Command(BaseCommand):
+    help = 'Write every character sheet to a JSON-lines (.jsonl) or msgpack (.msgpack) file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--guild', type=int, default=NO_GUILD, help='Discord guild id the characters belong to')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            count = write_sheets(options['path'], export_sheets(options['guild'], options['chunk_size']))
+        except ImportError as error:
+            raise CommandError(error)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{count} sheets in {elapsed:.2f} s ({count / elapsed if elapsed else 0:.0f} sheets/s)')
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from game.compendium import COMPENDIUM_MODELS, IMPORT_BATCH_SIZE, CompendiumImporter, read_rows
+from game.models import NO_GUILD
+from game.reference import request_reload
+
+
+class Command(BaseCommand):
+    help = ('Upsert compendium entries by name from JSON-lines or CSV files. List fields such as tags '
+            'hold names (a JSON list, or ";"-separated in CSV); foreign keys hold a name.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=COMPENDIUM_MODELS)
+        parser.add_argument('paths', nargs='+', help='.jsonl or .csv files')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--guild', type=int, default=NO_GUILD, help='Discord guild id the entries belong to')
+
+    def handle(self, *args, **options):
+        importer = CompendiumImporter(COMPENDIUM_MODELS[options['model']], options['batch_size'], options['guild'])
+        start = time.perf_counter()
+        rows = 0
+        for path in options['paths']:
+            for count in importer.run(read_rows(path)):
+                rows += count
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{path}: {rows} rows')
+        elapsed = time.perf_counter() - start
+        # Upserts skip the signals that would ask the bot to reload
+        request_reload()
+
+        self.stdout.write(f'{rows} rows in {elapsed:.2f} s ({rows / elapsed if elapsed else 0:.0f} rows/s): '
+                          f'{importer.created} created, {importer.updated} updated, '
+                          f'{importer.skipped} skipped')
+        if importer.missing:
+            self.stderr.write(f'Unknown references left empty: {", ".join(sorted(importer.missing)[:20])}'
+                              + (' ...' if len(importer.missing) > 20 else ''))
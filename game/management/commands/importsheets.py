@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.compendium import IMPORT_BATCH_SIZE
+from game.models import NO_GUILD
+from game.reference import request_reload
+from game.sheets import SheetImporter, read_sheets
+
+
+class Command(BaseCommand):
+    help = 'Restore character sheets written by exportsheets, upserting characters by name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--guild', type=int, default=NO_GUILD, help='Discord guild id the characters belong to')
+
+    def handle(self, *args, **options):
+        importer = SheetImporter(options['batch_size'], options['guild'])
+        start = time.perf_counter()
+        try:
+            count = sum(importer.run(read_sheets(options['path'])))
+        except ImportError as error:
+            raise CommandError(error)
+        elapsed = time.perf_counter() - start
+        # Upserts skip the signals that keep the bot's indexes and cached characters current
+        request_reload()
+
+        self.stdout.write(f'{count} sheets in {elapsed:.2f} s ({count / elapsed if elapsed else 0:.0f} sheets/s): '
+                          f'{importer.created} created, {importer.updated} updated, '
+                          f'{importer.skipped} skipped')
+        if importer.missing:
+            self.stderr.write(f'Unknown references left empty: {", ".join(sorted(importer.missing)[:20])}'
+                              + (' ...' if len(importer.missing) > 20 else ''))
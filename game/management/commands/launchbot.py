@@ -1,12 +1,54 @@
+import hashlib
+import json
+import signal
+import sys
+import time
+
 from django.core.management.base import BaseCommand
-from underkingbot.settings import DISCORD_TOKEN, DISCORD_DEBUG_SCOPE
+from underkingbot.settings import DISCORD_TOKEN, DISCORD_DEBUG_SCOPE, COMMAND_TREE_HASH_FILE
 import interactions
+from interactions.api.events import Login, Ready
+
+from game.write_behind import flush_resources
+
+
+def command_tree_hash(client):
+    # Everything Discord stores about our commands: names, descriptions,
+    # options and their autocomplete flags, per scope
+    tree = {str(scope): sorted((command.to_dict() for command in commands.values()),
+                               key=lambda command: command['name'])
+            for scope, commands in client.interactions_by_scope.items()}
+    payload = json.dumps(tree, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def last_synced_hash():
+    try:
+        with open(COMMAND_TREE_HASH_FILE) as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
 
 
 class Command(BaseCommand):
     help = 'Launch the Discord bot'
+    # The bot does not serve URLs or templates, and the checks cost startup time
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync', action='store_true',
+                            help='Sync slash commands with Discord even if the tree is unchanged')
 
     def handle(self, *args, **options):
+        timings = {'interpreter and django setup (cpu)': time.process_time()}
+        start = mark = time.perf_counter()
+
+        def phase(name):
+            nonlocal mark
+            now = time.perf_counter()
+            timings[name] = now - mark
+            mark = now
+
         if DISCORD_DEBUG_SCOPE:
             client = interactions.Client(
                 token=DISCORD_TOKEN,
@@ -17,4 +59,49 @@ class Command(BaseCommand):
                 token=DISCORD_TOKEN,
                 intents=interactions.Intents.DEFAULT)
         client.load_extension('bot')
-        client.start()
+        phase('load extension')
+
+        tree_hash = command_tree_hash(client)
+        # Unchanged commands only need their ids fetched, not a full re-sync
+        client.sync_interactions = options['sync'] or tree_hash != last_synced_hash()
+        phase('hash command tree')
+        self.stdout.write(f'Command tree {tree_hash[:12]}: '
+                          f'{"syncing" if client.sync_interactions else "unchanged, skipping sync"}')
+
+        synchronise = client.synchronise_interactions
+
+        async def synchronise_and_record(*args, **kwargs):
+            await synchronise(*args, **kwargs)
+            with open(COMMAND_TREE_HASH_FILE, 'w') as file:
+                file.write(tree_hash)
+        client.synchronise_interactions = synchronise_and_record
+
+        init_interactions = client._init_interactions
+
+        async def timed_init_interactions():
+            phase('gateway connect and guilds')
+            await init_interactions()
+            phase('sync commands' if client.sync_interactions else 'fetch command ids')
+        client._init_interactions = timed_init_interactions
+
+        async def on_login(event):
+            phase('login')
+
+        async def on_ready(event):
+            phase('ready')
+            timings['time to ready'] = time.perf_counter() - start
+            self.stdout.write('Startup: ' + ', '.join(f'{name} {seconds * 1000:.0f} ms'
+                                                      for name, seconds in timings.items()))
+            client.listeners['ready'].remove(ready_listener)
+
+        client.add_listener(interactions.listen(Login)(on_login))
+        ready_listener = interactions.listen(Ready)(on_ready)
+        client.add_listener(ready_listener)
+        # SIGTERM unwinds like Ctrl-C, so buffered HP changes below still get written
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            client.start()
+        finally:
+            flushed = flush_resources()
+            if flushed:
+                self.stdout.write(f'Flushed buffered resources of {flushed} characters')
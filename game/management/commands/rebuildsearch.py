@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.search import SEARCH_TABLE, ensure_search_index, rebuild_search_index, search_supported
+
+
+class Command(BaseCommand):
+    help = f'Refill the {SEARCH_TABLE} full-text index from the compendium tables'
+
+    def handle(self, *args, **options):
+        if not search_supported():
+            raise CommandError('Full-text search needs SQLite FTS5')
+        start = time.perf_counter()
+        if not ensure_search_index():
+            rebuild_search_index()
+        self.stdout.write(f'Search index rebuilt in {time.perf_counter() - start:.2f} s')
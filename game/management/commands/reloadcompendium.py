@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.reference import request_reload
+
+
+class Command(BaseCommand):
+    help = 'Ask the running bot to reload its compendium snapshot'
+
+    def handle(self, *args, **options):
+        request_reload()
+        self.stdout.write(f'The bot reloads within {settings.COMPENDIUM_POLL_INTERVAL} s')
@@ -0,0 +1,255 @@
+import functools
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Seconds; Prometheus' default buckets plus a few for slow Discord round trips
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+_current = ContextVar('interaction', default=None)
+_lock = Lock()
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with _lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{_labels(key + (("le", bound),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(key + (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_labels(key)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._series = {}
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with _lock:
+            series = dict(self._series)
+        lines.extend(f'{self.name}{_labels(key)} {value}' for key, value in sorted(series.items()))
+        return lines
+
+
+class Gauge:
+    # Read from a callback at render time, e.g. cache sizes
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {self.read()}']
+
+
+interaction_seconds = Histogram('underking_interaction_seconds', 'Wall-clock time per interaction')
+interaction_active_seconds = Histogram('underking_interaction_active_seconds',
+                                       'Time per interaction excluding waits for the user')
+interaction_queries = Histogram('underking_interaction_queries', 'SQL queries per interaction', COUNT_BUCKETS)
+interaction_db_seconds = Histogram('underking_interaction_db_seconds', 'Time in SQL per interaction')
+interaction_executor_wait_seconds = Histogram('underking_interaction_executor_wait_seconds',
+                                              'Time DB work queued for a worker thread per interaction')
+interaction_api_calls = Histogram('underking_interaction_api_calls', 'Discord API calls per interaction',
+                                  COUNT_BUCKETS)
+user_wait_seconds = Histogram('underking_user_wait_seconds', 'Time spent waiting for a component or modal')
+interaction_errors = Counter('underking_interaction_errors_total', 'Interactions that raised')
+queries_total = Counter('underking_queries_total', 'SQL queries, including ones outside interactions')
+api_calls_total = Counter('underking_discord_api_calls_total', 'Discord HTTP API calls')
+outbox_requests = Counter('underking_outbox_requests_total',
+                          'Requests through the outbox: sent, or coalesced into a newer one')
+
+registry = [interaction_seconds, interaction_active_seconds, interaction_queries, interaction_db_seconds,
+            interaction_executor_wait_seconds, interaction_api_calls, user_wait_seconds, interaction_errors,
+            queries_total, api_calls_total, outbox_requests]
+
+
+def register_gauge(name, help_text, read):
+    registry.append(Gauge(name, help_text, read))
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class InteractionStats:
+    FIELDS = ('queries', 'db_seconds', 'executor_wait', 'api_calls', 'user_wait')
+    __slots__ = FIELDS + ('_lock',)
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.executor_wait = 0.0
+        self.api_calls = 0
+        self.user_wait = 0.0
+        # DB workers report from their own threads
+        self._lock = Lock()
+
+    def add(self, **deltas):
+        with self._lock:
+            for field, delta in deltas.items():
+                setattr(self, field, getattr(self, field) + delta)
+
+
+@contextmanager
+def collecting():
+    # Everything run inside, DB workers included, counts towards the yielded stats.
+    # Nested ones also count towards the stats around them, so a benchmark sees the
+    # queries of the instrumented commands it calls.
+    outer = _current.get()
+    stats = InteractionStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.add(**{field: getattr(stats, field) for field in InteractionStats.FIELDS})
+
+
+def instrumented(name, callback):
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with collecting() as stats:
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception:
+                interaction_errors.inc(interaction=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                interaction_seconds.observe(elapsed, interaction=name)
+                interaction_active_seconds.observe(elapsed - stats.user_wait, interaction=name)
+                interaction_queries.observe(stats.queries, interaction=name)
+                interaction_db_seconds.observe(stats.db_seconds, interaction=name)
+                interaction_executor_wait_seconds.observe(stats.executor_wait, interaction=name)
+                interaction_api_calls.observe(stats.api_calls, interaction=name)
+    return wrapper
+
+
+def instrument_extension(extension):
+    # Command objects are class attributes shared by every client that loads the
+    # extension; they stay partials so interactions.py does not bind them again
+    for command in extension._commands:
+        name = getattr(command, 'resolved_name', None) or str(command.name)
+        if not hasattr(command.callback, 'interaction'):
+            command.callback = _instrumented_partial(name, command.callback)
+        for option, callback in getattr(command, 'autocomplete_callbacks', {}).items():
+            if not hasattr(callback, 'interaction'):
+                command.autocomplete_callbacks[option] = _instrumented_partial(
+                    f'{name} autocomplete:{option}', callback)
+
+
+def _instrumented_partial(name, callback):
+    wrapper = functools.partial(instrumented(name, callback))
+    wrapper.interaction = name
+    return wrapper
+
+
+def instrument_client(client):
+    request = client.http.request
+
+    @functools.wraps(request)
+    async def counted_request(*args, **kwargs):
+        api_calls_total.inc()
+        stats = _current.get()
+        if stats is not None:
+            stats.add(api_calls=1)
+        return await request(*args, **kwargs)
+    client.http.request = counted_request
+
+    for wait_name in ('wait_for_component', 'wait_for_modal'):
+        client_wait = getattr(client, wait_name)
+        setattr(client, wait_name, _timed_wait(wait_name, client_wait))
+
+
+def _timed_wait(wait_name, client_wait):
+    @functools.wraps(client_wait)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await client_wait(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            user_wait_seconds.observe(elapsed, wait=wait_name)
+            stats = _current.get()
+            if stats is not None:
+                stats.add(user_wait=elapsed)
+    return wrapper
+
+
+def observe_executor_wait(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.add(executor_wait=seconds)
+
+
+def _count_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries_total.inc()
+        stats = _current.get()
+        if stats is not None:
+            stats.add(queries=1, db_seconds=time.perf_counter() - start)
+
+
+def _attach(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def install_query_counter():
+    # Worker threads open their own connections, so hook every new one
+    connection_created.connect(_attach)
+    for existing in connections.all(initialized_only=True):
+        _attach(existing.__class__, existing)
@@ -0,0 +1,254 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:20
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ancestry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('effect', models.CharField(blank=True, max_length=300, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Background',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('effect', models.CharField(blank=True, max_length=300, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Character',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('discord_id', models.BigIntegerField(blank=True, default=0, null=True)),
+                ('strength', models.PositiveIntegerField(default=10)),
+                ('dexterity', models.PositiveIntegerField(default=10)),
+                ('constitution', models.PositiveIntegerField(default=10)),
+                ('intelligence', models.PositiveIntegerField(default=10)),
+                ('wisdom', models.PositiveIntegerField(default=10)),
+                ('charisma', models.PositiveIntegerField(default=10)),
+                ('level', models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(20)])),
+                ('hp', models.PositiveIntegerField(default=0)),
+                ('max_hp', models.PositiveIntegerField(default=0)),
+                ('focus_points', models.PositiveIntegerField(default=0)),
+                ('max_focus', models.PositiveIntegerField(default=0)),
+                ('hero_points', models.PositiveIntegerField(default=0)),
+                ('ancestry', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='game.ancestry')),
+                ('background', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='game.background')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Spell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('effect', models.CharField(blank=True, max_length=300, null=True)),
+                ('level', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SpellSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveIntegerField(default=0)),
+                ('spontaneous', models.BooleanField(default=False)),
+                ('is_cast', models.BooleanField(default=False)),
+                ('character', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prepared_spells', to='game.character')),
+                ('spell', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='game.spell')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='spell',
+            name='tags',
+            field=models.ManyToManyField(to='game.tag'),
+        ),
+        migrations.CreateModel(
+            name='Item',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('effect', models.CharField(blank=True, max_length=300, null=True)),
+                ('bulk', models.IntegerField(default=-1, validators=[django.core.validators.MinValueValidator(-1)])),
+                ('level', models.PositiveIntegerField(default=0)),
+                ('tags', models.ManyToManyField(to='game.tag')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='InventoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('character', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.character')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.item')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Heritage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('effect', models.CharField(blank=True, max_length=300, null=True)),
+                ('tags', models.ManyToManyField(to='game.tag')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Feat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('effect', models.CharField(blank=True, max_length=300, null=True)),
+                ('level', models.PositiveIntegerField(default=1)),
+                ('tags', models.ManyToManyField(to='game.tag')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='EquipmentEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.CharField(max_length=100)),
+                ('character', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.character')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.item')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Class',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('features', models.ManyToManyField(to='game.feat')),
+                ('tag', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='linked_class', to='game.tag')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='character_class',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='game.class'),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='equipment',
+            field=models.ManyToManyField(related_name='wearers', through='game.EquipmentEntry', to='game.item'),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='feats',
+            field=models.ManyToManyField(to='game.feat'),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='heritage',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='game.heritage'),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='inventory',
+            field=models.ManyToManyField(related_name='owners', through='game.InventoryEntry', to='game.item'),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='spells',
+            field=models.ManyToManyField(to='game.spell'),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='tags',
+            field=models.ManyToManyField(to='game.tag'),
+        ),
+        migrations.AddField(
+            model_name='background',
+            name='tags',
+            field=models.ManyToManyField(to='game.tag'),
+        ),
+        migrations.AddField(
+            model_name='ancestry',
+            name='tag',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='linked_ancestry', to='game.tag'),
+        ),
+        migrations.AddField(
+            model_name='ancestry',
+            name='tags',
+            field=models.ManyToManyField(to='game.tag'),
+        ),
+        migrations.CreateModel(
+            name='Action',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, validators=[django.core.validators.MinLengthValidator(2)])),
+                ('description', models.CharField(max_length=2000)),
+                ('image_url', models.CharField(blank=True, max_length=2000, null=True)),
+                ('effect', models.CharField(blank=True, max_length=300, null=True)),
+                ('length', models.CharField(max_length=50)),
+                ('related_feat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='game.feat')),
+                ('tags', models.ManyToManyField(to='game.tag')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
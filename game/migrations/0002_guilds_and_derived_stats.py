@@ -0,0 +1,335 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:20
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+from game.derived import recompute_derived_stats
+
+
+def merge_inventory_entries(apps, schema_editor):
+    # Older databases may list an item twice for a character: one row keeps the total
+    InventoryEntry = apps.get_model('game', 'InventoryEntry')
+    duplicates = (InventoryEntry.objects.values('character_id', 'item_id')
+                  .annotate(rows=Count('pk'), total=Sum('quantity'), kept=Min('pk')).filter(rows__gt=1))
+    for row in duplicates:
+        entries = InventoryEntry.objects.filter(character_id=row['character_id'], item_id=row['item_id'])
+        entries.exclude(pk=row['kept']).delete()
+        entries.update(quantity=row['total'])
+
+
+def fill_derived_stats(apps, schema_editor):
+    recompute_derived_stats(apps.get_model('game', 'Character').objects.all(),
+                            apps.get_model('game', 'InventoryEntry').objects,
+                            apps.get_model('game', 'EquipmentEntry').objects)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WizardDraft',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('author_id', models.BigIntegerField()),
+                ('target_id', models.BigIntegerField(null=True)),
+                ('data', models.JSONField(default=dict)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ancestry',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ancestry',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='ancestry',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='background',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='background',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='background',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='carried_bulk',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='charisma_mod',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='constitution_mod',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='dexterity_mod',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='encumbrance',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Без нагрузки'), (1, 'Обременён'), (2, 'Перегружен')], default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='intelligence_mod',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='strength_mod',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='wisdom_mod',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='class',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='class',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='class',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='feat',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='feat',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='feat',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='heritage',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='heritage',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='heritage',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='spell',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spell',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='spell',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='guild_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='action',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='ancestry',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='background',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='character',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='class',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='feat',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='heritage',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='spell',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=256, validators=[django.core.validators.MinLengthValidator(2)]),
+        ),
+        migrations.AddIndex(
+            model_name='character',
+            index=models.Index(fields=['guild_id', 'discord_id'], name='game_character_owner'),
+        ),
+        migrations.AddConstraint(
+            model_name='action',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_action_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='ancestry',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_ancestry_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='background',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_background_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='character',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_character_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='class',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_class_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='feat',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_feat_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='heritage',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_heritage_guild_name'),
+        ),
+        migrations.RunPython(merge_inventory_entries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='inventoryentry',
+            constraint=models.UniqueConstraint(fields=('character', 'item'), name='unique_inventory_entry'),
+        ),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_item_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='spell',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_spell_guild_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('guild_id', 'name'), name='game_tag_guild_name'),
+        ),
+        migrations.RunPython(fill_derived_stats, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,80 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MaxValueValidator, MinValueValidator, MinLengthValidator
 from django.utils.translation import gettext as _
 
 
 # Create your models here.
 
+ABILITIES = ['strength', 'dexterity', 'constitution', 'intelligence', 'wisdom', 'charisma']
+# Carried bulk is counted in L: 10 light items make 1 Bulk
+L_PER_BULK = 10
+UNENCUMBERED, ENCUMBERED, OVERLOADED = 0, 1, 2
+
+
+def ability_modifier(score):
+    return (score - 10) // 2
+
+
+def bulk_units(bulk):
+    # Item.bulk: -1 negligible, 0 light, n Bulk
+    if bulk < 0:
+        return 0
+    if bulk == 0:
+        return 1
+    return bulk * L_PER_BULK
+
+
+def format_bulk(units):
+    whole, light = divmod(units, L_PER_BULK)
+    parts = ([str(whole)] if whole else []) + ([f'{light}L'] if light else [])
+    return ' '.join(parts) or '-'
+
+
+def encumbrance_level(units, strength_mod):
+    # Light items below a whole Bulk do not count towards the limits
+    whole = units // L_PER_BULK
+    if whole > 10 + strength_mod:
+        return OVERLOADED
+    if whole > 5 + strength_mod:
+        return ENCUMBERED
+    return UNENCUMBERED
+
+# Entries made outside a guild (DMs) and everything from before guilds were
+# kept apart; see the assignguild command
+NO_GUILD = 0
+
+
+class GuildQuerySet(models.QuerySet):
+    def for_guild(self, guild_id):
+        return self.filter(guild_id=guild_id or NO_GUILD)
+
+
 class Describable(models.Model):
-    name = models.CharField(max_length=256, validators=[MinLengthValidator(2)], unique=True)
+    # Every guild has its own namespace: (guild_id, name) is unique and indexed,
+    # so a guild's lookups never touch another guild's rows
+    guild_id = models.BigIntegerField(default=NO_GUILD)
+    name = models.CharField(max_length=256, validators=[MinLengthValidator(2)])
     description = models.CharField(max_length=2000)
     image_url = models.CharField(max_length=2000, blank=True, null=True)
+    # sha256 of the locally stored copy, see game/images.py
+    image_hash = models.CharField(max_length=64, blank=True, null=True)
+    # Bumped on every save, keys rendered embeds
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = GuildQuerySet.as_manager()
 
     class Meta:
         abstract = True
+        constraints = [
+            models.UniqueConstraint(fields=['guild_id', 'name'], name='%(app_label)s_%(class)s_guild_name'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.version += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+        super().save(*args, **kwargs)
 
 
 class Effecting(models.Model):
@@ -33,7 +96,7 @@ class Tag(Describable):
 
 
 class Character(Describable, Taggable):
-    # For bot control
+    # For bot control: the owner's Discord user id, see Meta for /me
     discord_id = models.BigIntegerField(default=0, null=True, blank=True)
     # Ability Scores
     strength = models.PositiveIntegerField(default=10)
@@ -65,11 +128,59 @@ class Character(Describable, Taggable):
 
     hero_points = models.PositiveIntegerField(default=0)
 
+    # Derived: modifiers and encumbrance follow the scores on save(), carried bulk
+    # (in L) is adjusted by whatever changes an inventory, see game/derived.py
+    strength_mod = models.IntegerField(default=0, editable=False)
+    dexterity_mod = models.IntegerField(default=0, editable=False)
+    constitution_mod = models.IntegerField(default=0, editable=False)
+    intelligence_mod = models.IntegerField(default=0, editable=False)
+    wisdom_mod = models.IntegerField(default=0, editable=False)
+    charisma_mod = models.IntegerField(default=0, editable=False)
+    carried_bulk = models.PositiveIntegerField(default=0, editable=False)
+    encumbrance = models.PositiveSmallIntegerField(default=UNENCUMBERED, editable=False, choices=[
+        (UNENCUMBERED, 'Без нагрузки'), (ENCUMBERED, 'Обременён'), (OVERLOADED, 'Перегружен')])
+
+    class Meta(Describable.Meta):
+        # A player's characters in a guild, for /me
+        indexes = [
+            models.Index(fields=['guild_id', 'discord_id'], name='game_character_owner'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        character = super().from_db(db, field_names, values)
+        # Lets a save refresh the /me list of an owner it leaves
+        character.loaded_owner = character.__dict__.get('guild_id'), character.__dict__.get('discord_id')
+        return character
+
+    def update_derived_stats(self):
+        for ability in ABILITIES:
+            setattr(self, f'{ability}_mod', ability_modifier(getattr(self, ability)))
+        self.encumbrance = encumbrance_level(self.carried_bulk, self.strength_mod)
+
+    def save(self, *args, **kwargs):
+        self.update_derived_stats()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *(f'{ability}_mod' for ability in ABILITIES), 'encumbrance'}
+        super().save(*args, **kwargs)
+
 
 class Item(Describable, Effecting, Taggable):
     bulk = models.IntegerField(default=-1, validators=[MinValueValidator(-1)])
     level = models.PositiveIntegerField(default=0)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        # Lets a save tell how much every holder's carried bulk moved
+        item.loaded_bulk = item.__dict__.get('bulk')
+        return item
+
+    @property
+    def bulk_units(self):
+        return bulk_units(self.bulk)
+
     @property
     def bulk_txt(self):
         if self.bulk == -1:
@@ -92,25 +203,68 @@ class Item(Describable, Effecting, Taggable):
                 self.bulk = pre_bulk
 
 
-class InventoryEntry(models.Model):
+class CarriedEntryQuerySet(models.QuerySet):
+    def delete(self):
+        # One UPDATE takes every holder's share off their carried_bulk, then the
+        # rows go without the collector, which would fetch them first
+        from game.derived import entries_deleted
+        with transaction.atomic(using=self.db):
+            entries_deleted(self)
+            return self.raw_delete()
+
+    def raw_delete(self):
+        # For callers that recompute carried_bulk themselves
+        deleted = self._raw_delete(self.db)
+        return deleted, {self.model._meta.label: deleted}
+
+
+class CarriedEntry:
+    # An item on a character, counted in their carried_bulk. Remembers what it
+    # was loaded as, so a save can move the count (game/signals.py); deletes go
+    # through CarriedEntryQuerySet
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        entry = super().from_db(db, field_names, values)
+        entry.loaded_carry = entry.carry()
+        return entry
+
+    def carry(self):
+        # (character id, item id, quantity); None where the field was not loaded.
+        # An equipped item counts once.
+        loaded = self.__dict__
+        quantity = loaded.get('quantity') if isinstance(self, InventoryEntry) else 1
+        return loaded.get('character_id'), loaded.get('item_id'), quantity
+
+    def delete(self, using=None, keep_parents=False):
+        deleted = type(self).objects.using(using).filter(pk=self.pk).delete()
+        self.pk = None
+        return deleted
+
+
+class InventoryEntry(CarriedEntry, models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     character = models.ForeignKey(Character, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CarriedEntryQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['character', 'item'], name='unique_inventory_entry'),
+        ]
+
     def total_bulk_txt(self):
-        if self.item.bulk == -1:
-            return '-'
-        elif self.item.bulk == 0:
-            return f'{self.quantity//10} {self.quantity%10}L'
-        else:
-            return f'{self.quantity * self.item.bulk}'
+        return format_bulk(self.quantity * self.item.bulk_units)
 
 
-class EquipmentEntry(models.Model):
+class EquipmentEntry(CarriedEntry, models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     character = models.ForeignKey(Character, on_delete=models.CASCADE)
     slot = models.CharField(max_length=100)
 
+    objects = CarriedEntryQuerySet.as_manager()
+
 
 class Feat(Describable, Effecting, Taggable):
     level = models.PositiveIntegerField(default=1)
@@ -148,3 +302,12 @@ class Background(Describable, Taggable, Effecting):
 
 class Heritage(Describable, Taggable, Effecting):
     pass
+
+
+class WizardDraft(models.Model):
+    # A half-finished /create or /edit flow, see game/wizards.py
+    kind = models.CharField(max_length=20)
+    author_id = models.BigIntegerField()
+    target_id = models.BigIntegerField(null=True)
+    data = models.JSONField(default=dict)
+    expires_at = models.DateTimeField(db_index=True)
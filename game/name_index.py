@@ -0,0 +1,203 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import Lock
+
+from game.models import Character, Item
+from game.repository import db_task
+
+AUTOCOMPLETE_LIMIT = 10
+
+
+def _trigrams(folded: str):
+    return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+
+def _word_tails(folded: str):
+    # Every word after the first, so "fire" finds "Wand of Fireballs" by prefix
+    return [folded[i:] for i in range(1, len(folded)) if folded[i - 1] in ' -,(' and folded[i] not in ' -,(']
+
+
+class NameIndex:
+    # Process-local index of Describable names, kept current by game.signals.
+    # Saves run in database worker threads while lookups run on the event loop
+
+    def __init__(self):
+        self.ready = False
+        self._lock = Lock()
+        self._names = {}
+        self._folded = {}
+        self._sorted = []
+        self._words = []
+        self._trigrams = defaultdict(set)
+
+    def __len__(self):
+        return len(self._names)
+
+    def build(self, rows):
+        rows = list(rows)
+        with self._lock:
+            self._build(rows)
+
+    def _build(self, rows):
+        self._names.clear()
+        self._folded.clear()
+        self._trigrams.clear()
+        for pk, name in rows:
+            self._names[pk] = name
+            folded = name.casefold()
+            self._folded[pk] = folded
+            self._index_grams(pk, folded)
+        self._sorted = sorted((folded, pk) for pk, folded in self._folded.items())
+        self._words = sorted((tail, pk) for pk, folded in self._folded.items() for tail in _word_tails(folded))
+        self.ready = True
+
+    def add(self, pk, name):
+        with self._lock:
+            self._add(pk, name)
+
+    def _add(self, pk, name):
+        if self._names.get(pk) == name:
+            return
+        self._remove(pk)
+        self._names[pk] = name
+        folded = name.casefold()
+        self._folded[pk] = folded
+        insort(self._sorted, (folded, pk))
+        for tail in _word_tails(folded):
+            insort(self._words, (tail, pk))
+        self._index_grams(pk, folded)
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        if pk not in self._names:
+            return
+        del self._names[pk]
+        folded = self._folded.pop(pk)
+        del self._sorted[bisect_left(self._sorted, (folded, pk))]
+        for tail in _word_tails(folded):
+            del self._words[bisect_left(self._words, (tail, pk))]
+        for gram in _trigrams(folded):
+            bucket = self._trigrams[gram]
+            bucket.discard(pk)
+            if not bucket:
+                del self._trigrams[gram]
+
+    def _index_grams(self, pk, folded):
+        for gram in _trigrams(folded):
+            self._trigrams[gram].add(pk)
+
+    def name(self, pk):
+        return self._names.get(pk)
+
+    def search(self, query: str, limit=AUTOCOMPLETE_LIMIT):
+        query = query.strip().casefold()
+        with self._lock:
+            return self._search(query, limit)
+
+    def _search(self, query, limit):
+        found = []
+        # Whole-name prefixes rank first, then word prefixes, then any other substring
+        for entries in (self._sorted, self._words):
+            start = bisect_left(entries, (query,))
+            for tail, pk in entries[start:start + limit]:
+                if len(found) >= limit or not tail.startswith(query):
+                    break
+                if pk not in found:
+                    found.append(pk)
+        if len(found) < limit:
+            # A common trigram can hold most names: take the first matches found
+            # rather than ranking them all, and order just those. Queries too short
+            # for a trigram scan the names themselves.
+            candidates = self._candidates(query) if len(query) >= 3 else self._folded
+            matched = []
+            for pk in candidates:
+                if pk not in found and query in self._folded[pk]:
+                    matched.append((self._folded[pk].find(query), self._folded[pk], pk))
+                    if len(found) + len(matched) >= limit:
+                        break
+            found.extend(pk for _, _, pk in sorted(matched))
+        return [self._names[pk] for pk in found]
+
+    def _candidates(self, query):
+        # Lazily, so the search can stop early
+        buckets = sorted((self._trigrams.get(gram, ()) for gram in _trigrams(query)), key=len)
+        for pk in buckets[0]:
+            if all(pk in bucket for bucket in buckets[1:]):
+                yield pk
+
+
+class GuildNameIndexes:
+    # A NameIndex per guild, since every guild names its entries independently
+
+    def __init__(self):
+        self.ready = False
+        self._lock = Lock()
+        self._guilds = {}
+        self._guild_of = {}
+
+    def __len__(self):
+        return len(self._guild_of)
+
+    def build(self, rows):
+        grouped = defaultdict(list)
+        guild_of = {}
+        for pk, guild_id, name in rows:
+            grouped[guild_id].append((pk, name))
+            guild_of[pk] = guild_id
+        guilds = {}
+        for guild_id, names in grouped.items():
+            guilds[guild_id] = NameIndex()
+            guilds[guild_id].build(names)
+        with self._lock:
+            self._guilds = guilds
+            self._guild_of = guild_of
+            self.ready = True
+
+    def add(self, guild_id, pk, name):
+        with self._lock:
+            previous = self._guild_of.get(pk)
+            if previous is not None and previous != guild_id:
+                self._guilds[previous].remove(pk)
+            self._guild_of[pk] = guild_id
+            index = self._guilds.get(guild_id)
+            if index is None:
+                index = self._guilds[guild_id] = NameIndex()
+                index.build([])
+        index.add(pk, name)
+
+    def remove(self, pk):
+        with self._lock:
+            guild_id = self._guild_of.pop(pk, None)
+            index = self._guilds.get(guild_id)
+        if index is not None:
+            index.remove(pk)
+
+    def search(self, guild_id, query, limit=AUTOCOMPLETE_LIMIT):
+        index = self._guilds.get(guild_id)
+        return index.search(query, limit) if index is not None else []
+
+
+name_indexes = {
+    Character: GuildNameIndexes(),
+    Item: GuildNameIndexes(),
+}
+
+
+def build_name_indexes():
+    for model, index in name_indexes.items():
+        index.build(model.objects.values_list('pk', 'guild_id', 'name').iterator())
+
+
+def orm_search_names(model, guild_id, query, limit=AUTOCOMPLETE_LIMIT):
+    return list(model.objects.for_guild(guild_id).filter(name__icontains=query)
+                .values_list('name', flat=True)[:limit])
+
+
+async def search_names(model, guild_id, query, limit=AUTOCOMPLETE_LIMIT):
+    index = name_indexes.get(model)
+    if index is None or not index.ready:
+        return await db_task(orm_search_names)(model, guild_id, query, limit)
+    return index.search(guild_id, query, limit)
@@ -0,0 +1,202 @@
+import operator
+from functools import lru_cache
+from math import comb
+
+import numpy as np
+from dice.elements import Add, Dice, Div, Highest, Identity, Lowest, Modulo, Mul, Negate, Sub, Total
+from dice.utilities import single
+
+from game.rolls import compile_formula, keep_count
+
+PERCENTILES = (5, 25, 50, 75, 95)
+# Python-level steps allowed for a keep-highest/lowest pool and cells for a product of two outcomes
+MAX_KEEP_STEPS = 20_000
+MAX_PRODUCT_CELLS = 1_000_000
+MAX_OUTCOMES = 100_000
+# Convolutions bigger than this (len x len) go through the FFT: direct is quadratic
+FFT_CELLS = 50_000
+
+_MAPPED_OPERATORS = {
+    Mul: operator.mul,
+    Div: operator.floordiv,
+    Modulo: operator.mod,
+}
+
+
+class UnsupportedFormula(Exception):
+    pass
+
+
+class Distribution:
+    # Exact outcome probabilities: pmf[i] is P(result == offset + i)
+
+    __slots__ = ('offset', 'pmf')
+
+    def __init__(self, offset: int, pmf: np.ndarray):
+        self.offset = offset
+        self.pmf = pmf
+
+    @property
+    def minimum(self):
+        return self.offset
+
+    @property
+    def maximum(self):
+        return self.offset + len(self.pmf) - 1
+
+    @property
+    def values(self):
+        return np.arange(self.offset, self.offset + len(self.pmf))
+
+    @property
+    def mean(self):
+        return float(self.values @ self.pmf)
+
+    def at_least(self, target: int):
+        index = max(0, target - self.offset)
+        return float(self.pmf[index:].sum())
+
+    def trimmed(self):
+        nonzero = np.flatnonzero(self.pmf)
+        return Distribution(self.offset + int(nonzero[0]), self.pmf[nonzero[0]:nonzero[-1] + 1])
+
+    def percentile(self, percent):
+        cdf = np.cumsum(self.pmf)
+        index = int(np.searchsorted(cdf, percent / 100 - 1e-12))
+        return self.offset + min(index, len(self.pmf) - 1)
+
+
+def normalize_formula(formula: str):
+    return ''.join(formula.split()).lower()
+
+
+def odds(formula: str) -> Distribution:
+    return _distribution(normalize_formula(formula))
+
+
+@lru_cache(maxsize=256)
+def _distribution(formula: str) -> Distribution:
+    return _evaluate(single(compile_formula(formula).elements))
+
+
+def _constant(value: int):
+    return Distribution(value, np.ones(1))
+
+
+def _convolve(left, right):
+    if len(left) * len(right) <= FFT_CELLS:
+        return np.convolve(left, right)
+    size = len(left) + len(right) - 1
+    pmf = np.fft.irfft(np.fft.rfft(left, size) * np.fft.rfft(right, size), size)
+    # Rounding leaves tiny negatives where the probability is zero
+    return np.clip(pmf, 0, None)
+
+
+def _add(left: Distribution, right: Distribution):
+    return Distribution(left.offset + right.offset, _convolve(left.pmf, right.pmf))
+
+
+def _negate(dist: Distribution):
+    return Distribution(-dist.maximum, dist.pmf[::-1].copy())
+
+
+def _die_sum(amount: int, sides: int):
+    if amount * sides > MAX_OUTCOMES:
+        raise UnsupportedFormula()
+    single_die = Distribution(1, np.full(sides, 1 / sides))
+    total = _constant(0)
+    # Exponentiation by squaring keeps 40d6 to a handful of convolutions
+    while amount:
+        if amount & 1:
+            total = _add(total, single_die)
+        amount >>= 1
+        if amount:
+            single_die = _add(single_die, single_die)
+    return total
+
+
+def _keep(amount: int, sides: int, keep: int, highest: bool):
+    if keep == amount:
+        return _die_sum(amount, sides)
+    if keep == 0:
+        return _constant(0)
+    if sides * amount * amount > MAX_KEEP_STEPS:
+        raise UnsupportedFormula()
+    # Walk the faces from the kept end: ways[c] counts arrangements of the first c
+    # dice by the sum of the dice kept so far.
+    ways = [None] * (amount + 1)
+    ways[0] = np.zeros(keep * sides + 1)
+    ways[0][0] = 1.0
+    faces = range(sides, 0, -1) if highest else range(1, sides + 1)
+    for face in faces:
+        step = [None] * (amount + 1)
+        for assigned, counts in enumerate(ways):
+            if counts is None:
+                continue
+            for showing in range(amount - assigned + 1):
+                kept = min(assigned + showing, keep) - min(assigned, keep)
+                moved = comb(amount - assigned, showing) * counts
+                if kept:
+                    moved = np.concatenate((np.zeros(kept * face), moved[:-kept * face]))
+                target = assigned + showing
+                step[target] = moved if step[target] is None else step[target] + moved
+        ways = step
+    pmf = ways[amount] / float(sides) ** amount
+    return Distribution(0, pmf).trimmed()
+
+
+def _combine(left: Distribution, right: Distribution, function):
+    if len(left.pmf) * len(right.pmf) > MAX_PRODUCT_CELLS:
+        raise UnsupportedFormula()
+    right_values = right.values
+    if function is not operator.mul and not right_values.all():
+        raise UnsupportedFormula()
+    outcomes = function(left.values[:, None], right_values[None, :]).ravel()
+    weights = np.outer(left.pmf, right.pmf).ravel()
+    low = int(outcomes.min())
+    return Distribution(low, np.bincount(outcomes - low, weights=weights))
+
+
+def _pool(element):
+    if type(element) is not Dice or element.min_value != 1:
+        raise UnsupportedFormula()
+    if not isinstance(element.amount, int) or not isinstance(element.max_value, int):
+        raise UnsupportedFormula()
+    return int(element.amount), int(element.max_value)
+
+
+def _evaluate(element) -> Distribution:
+    if isinstance(element, int):
+        return _constant(int(element))
+
+    if type(element) is Dice:
+        return _die_sum(*_pool(element))
+
+    if type(element) in (Highest, Lowest):
+        amount, sides = _pool(element.original_operands[0])
+        keep = keep_count(element)
+        if keep is None:
+            raise UnsupportedFormula()
+        return _keep(amount, sides, keep, type(element) is Highest)
+
+    if type(element) is Negate:
+        return _negate(_evaluate(element.original_operands[0]))
+
+    if type(element) in (Identity, Total):
+        return _evaluate(element.original_operands[0])
+
+    if type(element) in (Add, Sub):
+        operands = [_evaluate(operand) for operand in element.original_operands]
+        result = operands[0]
+        for operand in operands[1:]:
+            result = _add(result, operand if type(element) is Add else _negate(operand))
+        return result
+
+    if type(element) in _MAPPED_OPERATORS:
+        operands = [_evaluate(operand) for operand in element.original_operands]
+        result = operands[0]
+        for operand in operands[1:]:
+            result = _combine(result, operand, _MAPPED_OPERATORS[type(element)])
+        return result
+
+    raise UnsupportedFormula()
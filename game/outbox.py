@@ -0,0 +1,207 @@
+import asyncio
+import heapq
+import time
+from itertools import count
+
+from game import metrics
+from game.cache import LRUCache
+
+# Lower goes first: acknowledgements have 3 seconds before Discord gives up on
+# the interaction, message edits can wait
+ACK, EDIT = 0, 1
+# The first edit to a message goes at once; edits following it this closely
+# are held and merged, so a burst of clicks costs two requests
+EDIT_DEBOUNCE = 0.3
+# Discord's limits, tracked here so a burst queues locally instead of running
+# into a 429 and the client's backoff: about 50 requests a second per bot, and
+# per route a bucket keyed by its major parameter. Message edits share one per
+# channel; edits through an interaction token (edit_origin after a defer) get
+# one per token.
+GLOBAL_RATE = (50, 1.0)
+ROUTE_RATES = {
+    'channel': (5, 5.0),
+    'interaction': (5, 5.0),
+}
+
+
+class RateBucket:
+    # Token bucket: capacity requests, refilled over period seconds
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class Outgoing:
+    def __init__(self, priority, due, key, bucket, send):
+        self.priority = priority
+        self.due = due
+        self.key = key
+        self.bucket = bucket
+        self.send = send
+        self.futures = []
+
+    def sort_key(self):
+        return self.priority, self.due
+
+
+class Outbox:
+    # Outgoing Discord requests in priority order. A request with a key replaces
+    # the unsent one with the same key (the latest state of a message wins), and
+    # never overtakes one with its key that is still in flight.
+
+    def __init__(self, global_rate=GLOBAL_RATE, route_rates=ROUTE_RATES):
+        self._heap = []
+        self._order = count()
+        self._waiting = {}
+        self._in_flight = set()
+        self._tasks = set()
+        self._global = RateBucket(*global_rate)
+        self._route_rates = route_rates
+        # Per-token buckets come and go with every click; an evicted one was idle
+        self._buckets = LRUCache(maxsize=4096)
+        self._last_edit = LRUCache(maxsize=1024)
+        self._wakeup = None
+        self._dispatcher = None
+
+    def __len__(self):
+        return len(self._heap) + len(self._tasks)
+
+    def submit(self, send, priority, key=None, bucket=None, delay=0.0):
+        # send: coroutine function making the request; bucket: (route, major
+        # parameter). Returns a future for its result, or for the result of the
+        # request that replaced it.
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiting = self._waiting.get(key) if key is not None else None
+        if waiting is not None:
+            metrics.outbox_requests.inc(outcome='coalesced')
+            waiting.send = send
+            waiting.futures.append(future)
+            return future
+        entry = Outgoing(priority, time.monotonic() + delay, key, bucket, send)
+        entry.futures.append(future)
+        if key is not None:
+            self._waiting[key] = entry
+        heapq.heappush(self._heap, (entry.sort_key(), next(self._order), entry))
+        self._start(loop)
+        self._wakeup.set()
+        return future
+
+    def ack(self, send):
+        return self.submit(send, ACK)
+
+    def edit(self, key, bucket, send):
+        last = self._last_edit.get(key)
+        delay = max(0.0, last + EDIT_DEBOUNCE - time.monotonic()) if last is not None else 0.0
+        return self.submit(send, EDIT, key=key, bucket=bucket, delay=delay)
+
+    def _start(self, loop):
+        if self._dispatcher is None or self._dispatcher.done() or self._dispatcher.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            route, _ = key
+            bucket = RateBucket(*self._route_rates[route])
+            self._buckets.put(key, bucket)
+        return bucket
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._send_ready()
+            if not self._heap and not self._tasks:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _send_ready(self):
+        # Starts everything that may go now, best first; returns how long until
+        # the next held-back request might
+        now = time.monotonic()
+        held, delay = [], None
+
+        def hold(item, wait=None):
+            nonlocal delay
+            held.append(item)
+            if wait is not None:
+                delay = wait if delay is None else min(delay, wait)
+
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            entry = item[2]
+            if entry.key in self._in_flight:
+                # Goes once the request before it is done, which wakes the dispatcher
+                hold(item)
+                continue
+            if entry.due > now:
+                hold(item, entry.due - now)
+                continue
+            bucket = self._bucket(entry.bucket) if entry.bucket is not None else None
+            if entry.priority != ACK:
+                # Interaction callbacks do not count against the bot's global limit.
+                # Everything after this one needs a global token too, so stop here.
+                wait = self._global.wait_time(now)
+                if wait > 0:
+                    hold(item, wait)
+                    break
+            if bucket is not None:
+                wait = bucket.wait_time(now)
+                if wait > 0:
+                    hold(item, wait)
+                    continue
+                bucket.take(now)
+            if entry.priority != ACK:
+                self._global.take(now)
+            self._launch(entry)
+        for item in held:
+            heapq.heappush(self._heap, item)
+        return delay
+
+    def _launch(self, entry):
+        if entry.key is not None:
+            del self._waiting[entry.key]
+            self._in_flight.add(entry.key)
+            if entry.priority == EDIT:
+                self._last_edit.put(entry.key, time.monotonic())
+        task = asyncio.get_running_loop().create_task(self._send(entry))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, entry):
+        try:
+            result = await entry.send()
+        except Exception as e:
+            for future in entry.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in entry.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            metrics.outbox_requests.inc(outcome='sent')
+            self._in_flight.discard(entry.key)
+            self._wakeup.set()
+
+
+outbox = Outbox()
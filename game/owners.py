@@ -0,0 +1,41 @@
+from interactions import Embed
+
+from game.cache import TTLCache
+from game.models import Character, format_bulk
+from game.write_behind import resource_buffer
+
+OWNER_CACHE_SIZE = 1024
+# Saves invalidate an owner's entry; the TTL covers queryset updates (/rest,
+# flushes) and edits made from the admin site
+OWNER_CACHE_TTL = 30
+# A select menu holds at most 25 options, an embed at most 25 fields
+SHEET_CHOICES = 25
+OWNER_COLUMNS = ['pk', 'name', 'level', 'character_class__name', 'hp', 'max_hp', 'carried_bulk', 'strength_mod']
+
+# (guild id, discord id) -> owned_characters rows
+owner_cache = TTLCache(maxsize=OWNER_CACHE_SIZE, ttl=OWNER_CACHE_TTL)
+
+
+def owned_characters(guild_id, discord_id):
+    # One query on the owner index, joined to the class. Sorted here: ordering in
+    # SQL lets SQLite prefer walking the guild's (guild_id, name) index instead.
+    rows = Character.objects.for_guild(guild_id).filter(discord_id=discord_id).values_list(*OWNER_COLUMNS)
+    return sorted(rows, key=lambda row: row[1].casefold())
+
+
+def forget_owner(guild_id, discord_id):
+    owner_cache.pop((guild_id, discord_id))
+
+
+def owner_embed(owner_name, rows):
+    embed = Embed(title=f'Персонажи {owner_name}')
+    for pk, name, level, class_name, hp, max_hp, carried_bulk, strength_mod in rows[:SHEET_CHOICES]:
+        # HP changed during play may not be written yet
+        live = resource_buffer.current(pk)
+        if live is not None:
+            hp, max_hp = live['hp'], live['max_hp']
+        embed.add_field(name, f'{level} ур., {class_name or "без класса"}\n'
+                              f'ОЗ {hp}/{max_hp}, нагрузка {format_bulk(carried_bulk)} из {5 + strength_mod}')
+    if len(rows) > SHEET_CHOICES:
+        embed.set_footer(f'… ещё {len(rows) - SHEET_CHOICES}')
+    return embed
@@ -0,0 +1,179 @@
+import os
+import time
+from array import array
+from itertools import count
+
+from django.conf import settings
+
+from game.models import Action, Ancestry, Background, Class, Feat, Heritage, Spell, Tag, Taggable
+from game.name_index import AUTOCOMPLETE_LIMIT, NameIndex, build_name_indexes
+from game.owners import owner_cache
+from game.tag_index import build_tag_indexes
+from game.write_behind import resource_buffer
+
+# Reference data: edited by admins and imports, read by everyone during play.
+# Feats come before classes, whose features name them.
+REFERENCE_MODELS = {
+    'feat': Feat,
+    'spell': Spell,
+    'action': Action,
+    'class': Class,
+    'ancestry': Ancestry,
+    'background': Background,
+    'heritage': Heritage,
+    'tag': Tag,
+}
+RECORD_FIELDS = ['pk', 'guild_id', 'version', 'name', 'description', 'image_url', 'image_hash']
+# Model-specific columns shown as extra embed fields
+DETAIL_FIELDS = {
+    Action: [('length', 'Время'), ('related_feat__name', 'Черта')],
+}
+NO_TAGS = array('q')
+
+_generations = count(1)
+
+
+class Record:
+    # One reference row, detached from the ORM
+
+    __slots__ = ('model', 'pk', 'guild_id', 'version', 'name', 'description', 'image_url', 'image_hash',
+                 'effect', 'level', 'tag_ids', 'details')
+
+    def __init__(self, model, pk, guild_id, version, name, description, image_url, image_hash,
+                 effect=None, level=None, details=()):
+        self.model = model
+        self.pk = pk
+        self.guild_id = guild_id
+        self.version = version
+        self.name = name
+        self.description = description
+        self.image_url = image_url
+        self.image_hash = image_hash
+        self.effect = effect
+        self.level = level
+        self.tag_ids = NO_TAGS
+        self.details = details
+
+
+class CompendiumSnapshot:
+    # Every reference record with its name lookups, built in one go and never
+    # changed afterwards: a reload builds a new snapshot and swaps it in whole,
+    # so a reader sees either the old compendium or the new one
+
+    def __init__(self):
+        self.generation = next(_generations)
+        self.records = {model: {} for model in REFERENCE_MODELS.values()}
+        self._ids = {}
+        self._names = {}
+
+    def __len__(self):
+        return sum(map(len, self.records.values()))
+
+    def get(self, model, guild_id, name):
+        pk = self._ids.get((model, guild_id), {}).get(name.strip().casefold())
+        return self.records[model].get(pk)
+
+    def search(self, model, guild_id, query, limit=AUTOCOMPLETE_LIMIT):
+        index = self._names.get((model, guild_id))
+        return index.search(query, limit) if index is not None else []
+
+    def tag_names(self, record):
+        tags = self.records[Tag]
+        return sorted((tags[tag_id].name for tag_id in record.tag_ids if tag_id in tags), key=str.casefold)
+
+    def _index(self):
+        grouped = {}
+        for model, records in self.records.items():
+            for record in records.values():
+                grouped.setdefault((model, record.guild_id), []).append(record)
+        for key, records in grouped.items():
+            self._ids[key] = {record.name.casefold(): record.pk for record in records}
+            self._names[key] = index = NameIndex()
+            index.build((record.pk, record.name) for record in records)
+
+
+def load_snapshot():
+    # A query per model, per tag table and one for class features
+    snapshot = CompendiumSnapshot()
+    for model in REFERENCE_MODELS.values():
+        names = {field.name for field in model._meta.fields}
+        optional = [field for field in ('effect', 'level') if field in names]
+        details = DETAIL_FIELDS.get(model, [])
+        records = snapshot.records[model]
+        for row in model.objects.values_list(*RECORD_FIELDS, *optional, *(field for field, _ in details)):
+            extra = dict(zip(optional, row[len(RECORD_FIELDS):]))
+            shown = tuple((label, str(value)) for (_, label), value
+                          in zip(details, row[len(RECORD_FIELDS) + len(optional):]) if value)
+            records[row[0]] = Record(model, *row[:len(RECORD_FIELDS)], details=shown, **extra)
+        if issubclass(model, Taggable):
+            tagged = {}
+            for object_id, tag_id in model.tags.through.objects.values_list(f'{model._meta.model_name}_id',
+                                                                            'tag_id'):
+                tagged.setdefault(object_id, []).append(tag_id)
+            for object_id, tag_ids in tagged.items():
+                records[object_id].tag_ids = array('q', tag_ids)
+    _add_class_features(snapshot)
+    snapshot._index()
+    return snapshot
+
+
+def _add_class_features(snapshot):
+    feats, classes = snapshot.records[Feat], snapshot.records[Class]
+    features = {}
+    for class_id, feat_id in Class.features.through.objects.values_list('class_id', 'feat_id'):
+        if feat_id in feats:
+            features.setdefault(class_id, []).append(feats[feat_id].name)
+    for class_id, names in features.items():
+        classes[class_id].details += (('Умения', ', '.join(sorted(names, key=str.casefold))),)
+
+
+def reload_mark():
+    try:
+        with open(settings.COMPENDIUM_RELOAD_FILE) as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def request_reload():
+    # Any process may ask: the admin site, an import, reloadcompendium. The bot
+    # notices the new mark on its next poll.
+    path = settings.COMPENDIUM_RELOAD_FILE
+    with open(f'{path}.tmp', 'w') as file:
+        file.write(str(time.time_ns()))
+    os.replace(f'{path}.tmp', path)
+
+
+class CompendiumStore:
+    def __init__(self):
+        self.snapshot = None
+        self._mark = None
+
+    def reload(self):
+        # The mark is read first, so a change made while loading brings one more reload
+        mark = reload_mark()
+        self.snapshot = load_snapshot()
+        self._mark = mark
+        return self.snapshot
+
+    def reload_if_requested(self):
+        if self.snapshot is not None and reload_mark() == self._mark:
+            return False
+        self.reload()
+        return True
+
+
+compendium = CompendiumStore()
+
+
+def reload_if_requested():
+    # Imports and guild moves write in bulk, past the signals that keep the name
+    # and tag indexes and the cached characters current: their reload request
+    # covers those too
+    if not compendium.reload_if_requested():
+        return False
+    build_name_indexes()
+    build_tag_indexes()
+    resource_buffer.forget_all()
+    owner_cache.clear()
+    return True
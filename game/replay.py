@@ -0,0 +1,108 @@
+import asyncio
+from collections import deque
+from itertools import count
+
+# Offline stand-ins for the Discord side of an interaction, enough to drive
+# CharacterExtension's command coroutines without a gateway connection.
+
+_message_ids = count(1)
+_tokens = count(1)
+
+
+class FakeMessage:
+    def __init__(self, **payload):
+        self.id = next(_message_ids)
+        self.payload = payload
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.display_name = f'Replay {user_id}'
+
+
+class FakeContext:
+    # Plays SlashContext, AutocompleteContext, ComponentContext and ModalContext
+
+    def __init__(self, client, author_id=1, guild_id=1, channel_id=1, input_text='', custom_id=None, values=(),
+                 responses=None, message=None):
+        self.client = client
+        self.author_id = author_id
+        self.author = FakeUser(author_id)
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.token = f'replay-{next(_tokens)}'
+        self.input_text = input_text
+        self.custom_id = custom_id
+        self.values = list(values)
+        self.responses = responses or {}
+        # What the command showed last, to find the custom_id of the next step.
+        # A component context starts with the message its component is on.
+        self.modal = None
+        self.message = message
+
+    async def send(self, content=None, **kwargs):
+        self.client.api_calls += 1
+        self.message = FakeMessage(content=content, **kwargs)
+        return self.message
+
+    async def send_modal(self, modal):
+        self.client.api_calls += 1
+        self.modal = modal
+
+    async def edit_origin(self, **kwargs):
+        self.client.api_calls += 1
+        self.message = FakeMessage(**kwargs)
+
+    async def edit(self, message=None, **kwargs):
+        self.client.api_calls += 1
+
+    async def defer(self, **kwargs):
+        self.client.api_calls += 1
+
+
+def find_custom_id(message: FakeMessage, prefix, suffix=''):
+    components = message.payload.get('components') or []
+    if not isinstance(components, list):
+        components = [components]
+    for component in components:
+        for child in getattr(component, 'components', [component]):
+            custom_id = getattr(child, 'custom_id', '')
+            if custom_id.startswith(prefix) and custom_id.endswith(suffix):
+                return custom_id
+    raise LookupError(prefix + suffix)
+
+
+class FakeComponent:
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+
+class ReplayClient:
+    # Replaces the extension's bot: answers wait_for_* from a script of user actions
+
+    owner = 'replay'
+
+    def __init__(self):
+        self.api_calls = 0
+        self._components = deque()
+        self._modals = deque()
+
+    def context(self, **kwargs):
+        return FakeContext(self, **kwargs)
+
+    def script(self, components=(), modals=()):
+        # components: (custom_id, values) pairs, modals: response dicts
+        self._components.extend(components)
+        self._modals.extend(modals)
+
+    async def wait_for_component(self, messages=None, components=None, check=None, timeout=None):
+        if not self._components:
+            raise asyncio.TimeoutError()
+        custom_id, values = self._components.popleft()
+        return FakeComponent(self.context(custom_id=custom_id, values=values))
+
+    async def wait_for_modal(self, modal, author=None, timeout=None):
+        if not self._modals:
+            raise asyncio.TimeoutError()
+        return self.context(responses=self._modals.popleft())
@@ -0,0 +1,57 @@
+from django.db.models import F, Max, Sum
+from django.db.models.functions import Coalesce
+from interactions import Embed
+
+from game.models import Character, format_bulk
+
+REPORT_PAGE_SIZE = 20
+ENCUMBRANCE_LABELS = dict(Character._meta.get_field('encumbrance').choices)
+
+REPORT_COLUMNS = ['name', 'level', 'hp', 'max_hp', 'carried_bulk', 'strength_mod', 'encumbrance',
+                  'items', 'item_levels', 'max_item_level']
+
+
+def party_members(guild_id, names):
+    # A party is kept as its characters' pks: short enough for page buttons
+    return sorted(Character.objects.for_guild(guild_id).filter(name__in=names).values_list('pk', flat=True))
+
+
+def report_rows(guild_id, pks=None):
+    # One grouped query over the characters' inventories; carried bulk is already
+    # stored on the character (game/derived.py)
+    characters = Character.objects.for_guild(guild_id)
+    if pks is not None:
+        characters = characters.filter(pk__in=pks)
+    return list(characters
+                .annotate(items=Coalesce(Sum('inventoryentry__quantity'), 0),
+                          item_levels=Coalesce(Sum(F('inventoryentry__quantity') * F('inventoryentry__item__level')),
+                                               0),
+                          max_item_level=Max('inventoryentry__item__level'))
+                .order_by('name')
+                .values_list(*REPORT_COLUMNS))
+
+
+def report_summary(rows):
+    hp = sum(row[2] for row in rows)
+    max_hp = sum(row[3] for row in rows)
+    items = sum(row[7] for row in rows)
+    return (f'Персонажей: {len(rows)}, ОЗ {hp}/{max_hp}, '
+            f'нагрузка {format_bulk(sum(row[4] for row in rows))}, предметов {items}')
+
+
+def report_page(title, rows, page, page_size=REPORT_PAGE_SIZE):
+    page_count = max(1, (len(rows) + page_size - 1) // page_size)
+    page = min(max(page, 0), page_count - 1)
+    embed = Embed(title=title, description=report_summary(rows) if rows else 'Никого нет')
+    for name, level, hp, max_hp, bulk, strength_mod, encumbrance, items, item_levels, max_item_level \
+            in rows[page * page_size:(page + 1) * page_size]:
+        load = f'{format_bulk(bulk)} из {5 + strength_mod}'
+        if encumbrance:
+            load += f' ({ENCUMBRANCE_LABELS[encumbrance].lower()})'
+        embed.add_field(f'{name}, ур. {level}',
+                        f'ОЗ {hp}/{max_hp} · нагрузка {load}\n'
+                        f'предметов {items}, сумма уровней {item_levels}'
+                        + (f', макс. уровень {max_item_level}' if max_item_level is not None else ''))
+    if page_count > 1:
+        embed.set_footer(f'Страница {page + 1}/{page_count}')
+    return embed, page, page_count
@@ -0,0 +1,155 @@
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from game import metrics
+
+from game.inventory import give_items as _give_items, inventory_pages as _inventory_pages
+from game.checks import check_rows as _check_rows
+from game.models import Character, Item
+from game.owners import owned_characters as _owned_characters, owner_cache
+from game.reports import party_members, report_page as _report_page, report_rows
+from game.resources import rest as _rest, spells_embed as _spells_embed
+from game.search import ensure_search_index, search as _search
+from game.tag_index import find_page as _find_page, parse_tag_query, resolve_tag_query
+from game.wizards import (commit_draft as _commit_draft, edit_draft as _edit_draft,
+                          evict_expired_drafts as _evict_expired_drafts, open_draft as _open_draft)
+from game.write_behind import (flush_resources as _flush_resources, load_resources as _load_resources,
+                               resource_buffer)
+
+# Django's own async ORM methods (aget, afirst, async for) still hop onto the one
+# thread-sensitive executor, so every guild's queries would queue behind each other.
+# The bot's data access runs here instead: a bounded pool where each worker keeps
+# its own connection.
+_executor = ThreadPoolExecutor(max_workers=settings.DB_WORKERS, thread_name_prefix='db')
+
+
+def db_task(func):
+    def run(submitted, args, kwargs):
+        metrics.observe_executor_wait(time.perf_counter() - submitted)
+        return func(*args, **kwargs)
+    pooled = sync_to_async(run, thread_sensitive=False, executor=_executor)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await pooled(time.perf_counter(), args, kwargs)
+    wrapper.func = func
+    return wrapper
+
+
+@db_task
+def get_character(guild_id, name):
+    return Character.objects.for_guild(guild_id).select_related('character_class').get(name=name)
+
+
+@db_task
+def get_character_by_pk(guild_id, pk):
+    return Character.objects.for_guild(guild_id).select_related('character_class').get(pk=pk)
+
+
+@db_task
+def get_item(guild_id, name):
+    return Item.objects.for_guild(guild_id).get(name=name)
+
+
+@db_task
+def inventory_pages(character):
+    return _inventory_pages(character)
+
+
+@db_task
+def give_items(guild_id, character_names, item_names, quantity):
+    return _give_items(guild_id, character_names, item_names, quantity)
+
+
+@db_task
+def open_draft(kind, author_id, target_id=None, **data):
+    return _open_draft(kind, author_id, target_id, **data)
+
+
+@db_task
+def edit_draft(draft_id, author_id, **data):
+    return _edit_draft(draft_id, author_id, **data)
+
+
+@db_task
+def commit_draft(draft_id, author_id, **data):
+    return _commit_draft(draft_id, author_id, **data)
+
+
+@db_task
+def evict_expired_drafts():
+    return _evict_expired_drafts()
+
+
+@db_task
+def party_page(guild_id, page, names=None, pks=None):
+    # The first page finds the party by name, later ones by the pks its buttons carry
+    if pks is None:
+        pks = party_members(guild_id, names)
+    return (*_report_page('Отряд', report_rows(guild_id, pks), page), pks)
+
+
+@db_task
+def report_page(guild_id, page):
+    return _report_page('Все персонажи', report_rows(guild_id), page)
+
+
+@db_task
+def prepare_search():
+    return ensure_search_index()
+
+
+@db_task
+def search(guild_id, text):
+    return _search(guild_id, text)
+
+
+@db_task
+def find_tagged(model, guild_id, query):
+    terms, missing = resolve_tag_query(guild_id, parse_tag_query(query))
+    return terms, missing, _find_page(model, guild_id, terms, 0)
+
+
+@db_task
+def find_page(model, guild_id, terms, page):
+    return _find_page(model, guild_id, terms, page)
+
+
+@db_task
+def rest(guild_id, character_names=None):
+    # Buffered damage goes in first so the rest overrides it; changes made while
+    # this runs stay buffered and land after it
+    _flush_resources()
+    rested = _rest(guild_id, character_names)
+    resource_buffer.forget_names(guild_id, rested)
+    owner_cache.clear()
+    return rested
+
+
+@db_task
+def check_rows(guild_id, ability, names=None):
+    return _check_rows(guild_id, ability, names)
+
+
+@db_task
+def spells_embed(guild_id, character_name):
+    return _spells_embed(guild_id, character_name)
+
+
+@db_task
+def owned_characters(guild_id, discord_id):
+    return _owned_characters(guild_id, discord_id)
+
+
+@db_task
+def load_resources(guild_id, name):
+    return _load_resources(guild_id, name)
+
+
+@db_task
+def flush_resources():
+    return _flush_resources()
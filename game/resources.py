@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models import F
+from interactions import Embed
+
+from game.models import Character, SpellSlot
+
+
+def rest(guild_id, character_names=None):
+    # Restores HP, focus and spell slots of the named characters, or of everyone
+    # in the guild, with two UPDATEs whatever the party size. Returns the rested names.
+    characters = Character.objects.for_guild(guild_id)
+    if character_names is not None:
+        characters = characters.filter(name__in=character_names)
+    with transaction.atomic():
+        # Writing first takes SQLite's write lock before anything is read
+        characters.update(hp=F('max_hp'), focus_points=F('max_focus'), version=F('version') + 1)
+        SpellSlot.objects.filter(character__in=characters, is_cast=True).update(is_cast=False)
+        return list(characters.order_by('name').values_list('name', flat=True))
+
+
+def spell_slots(guild_id, character_name):
+    # All prepared slots with their spells in one joined query
+    return list(SpellSlot.objects
+                .filter(character__guild_id=guild_id, character__name=character_name)
+                .select_related('spell')
+                .only('level', 'spontaneous', 'is_cast', 'spell__name')
+                .order_by('level', 'spell__name'))
+
+
+def spells_embed(guild_id, character_name):
+    slots = spell_slots(guild_id, character_name)
+    if not slots and not Character.objects.for_guild(guild_id).filter(name=character_name).exists():
+        return None
+    embed = Embed(title=f'Заклинания {character_name}')
+    if not slots:
+        embed.description = 'Нет подготовленных заклинаний'
+        return embed
+    levels = {}
+    for slot in slots:
+        levels.setdefault(slot.level, []).append(slot)
+    for level, level_slots in levels.items():
+        ready = sum(not slot.is_cast for slot in level_slots)
+        embed.add_field(f'{"Заговоры" if level == 0 else f"{level} круг"} ({ready}/{len(level_slots)})',
+                        '\n'.join(map(slot_line, level_slots)))
+    return embed
+
+
+def slot_line(slot):
+    # Cast slots are struck through
+    line = slot.spell.name if slot.spell is not None else '—'
+    if slot.spontaneous:
+        line += ' (спонт.)'
+    return f'~~{line}~~' if slot.is_cast else line
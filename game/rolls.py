@@ -0,0 +1,147 @@
+import operator
+from functools import lru_cache
+
+import dice
+import numpy as np
+from dice.elements import Add, Dice, Div, Highest, Identity, Lowest, Modulo, Mul, Negate, Sub, Total
+from dice.utilities import single
+from pyparsing import ParseBaseException
+
+MAX_TIMES = 1000
+# Larger pools fall back to the per-roll path instead of allocating times x dice arrays
+MAX_VECTOR_DICE = 1000
+
+_rng = np.random.default_rng()
+
+_SCALAR_OPERATORS = {
+    Add: operator.add,
+    Sub: operator.sub,
+    Mul: operator.mul,
+    Div: operator.floordiv,
+    Modulo: operator.mod,
+}
+
+
+class NotVectorizable(Exception):
+    pass
+
+
+class CompiledFormula:
+    # A parsed dice expression that can be rolled any number of times without reparsing
+
+    __slots__ = ('formula', 'elements', '_batch')
+
+    def __init__(self, formula: str, elements):
+        self.formula = formula
+        self.elements = elements
+        try:
+            self._batch = _vectorize(single(elements))
+        except NotVectorizable:
+            self._batch = None
+
+    @property
+    def vectorized(self):
+        return self._batch is not None
+
+    def roll(self):
+        # evaluate() without caching rolls afresh and leaves the parsed tree reusable
+        return single([element.evaluate() for element in self.elements])
+
+    def roll_many(self, times: int, rng=None) -> np.ndarray:
+        if self._batch is None:
+            return np.fromiter((int(self.roll()) for _ in range(times)), dtype=np.int64, count=times)
+        return _total(self._batch(times, rng or _rng))
+
+
+@lru_cache(maxsize=512)
+def compile_formula(formula: str) -> CompiledFormula:
+    try:
+        elements = list(dice.parse_expression(formula))
+    except ParseBaseException as e:
+        raise dice.DiceBaseException.from_other(e)
+    return CompiledFormula(formula, elements)
+
+
+def roll(formula: str):
+    return compile_formula(formula).roll()
+
+
+def roll_many(formula: str, times: int, rng=None) -> np.ndarray:
+    return compile_formula(formula).roll_many(times, rng)
+
+
+def keep_count(element):
+    # How many dice a Highest/Lowest over a plain pool keeps, with the same
+    # slicing quirks as dice.elements: h0 keeps everything, l0 keeps nothing
+    pool, *rest = element.original_operands
+    if rest and not isinstance(rest[0], int):
+        return None
+    amount = int(pool.amount)
+    keep = amount - 1 if not rest else int(rest[0])
+    return max(0, min(keep, amount)) or (amount if type(element) is Highest else 0)
+
+
+# Vectorized evaluators return either a (times,) array of totals or a
+# (times, dice) pool that keep-highest/lowest can still slice.
+
+def _total(values: np.ndarray) -> np.ndarray:
+    return values.sum(axis=1) if values.ndim == 2 else values
+
+
+def _vectorize(element):
+    if isinstance(element, int):
+        value = int(element)
+        return lambda times, rng: np.full(times, value, dtype=np.int64)
+
+    if type(element) is Dice:
+        amount, sides = element.amount, element.max_value
+        if not isinstance(amount, int) or not isinstance(sides, int) or element.min_value != 1:
+            raise NotVectorizable()
+        amount, sides = int(amount), int(sides)
+        if amount > MAX_VECTOR_DICE:
+            raise NotVectorizable()
+        return lambda times, rng: rng.integers(1, sides + 1, size=(times, amount), dtype=np.int64)
+
+    if type(element) in (Highest, Lowest):
+        pool = element.original_operands[0]
+        if type(pool) is not Dice:
+            raise NotVectorizable()
+        source = _vectorize(pool)
+        amount = int(pool.amount)
+        keep = keep_count(element)
+        if keep is None:
+            raise NotVectorizable()
+        highest = type(element) is Highest
+
+        def kept(times, rng):
+            rolled = np.sort(source(times, rng), axis=1)
+            return rolled[:, amount - keep:] if highest else rolled[:, :keep]
+        return kept
+
+    if type(element) is Negate:
+        source = _vectorize(element.original_operands[0])
+        return lambda times, rng: -source(times, rng)
+
+    if type(element) is Identity:
+        return _vectorize(element.original_operands[0])
+
+    if type(element) is Total:
+        source = _vectorize(element.original_operands[0])
+        return lambda times, rng: _total(source(times, rng))
+
+    if type(element) in _SCALAR_OPERATORS:
+        operands = [_vectorize(operand) for operand in element.original_operands]
+        function = _SCALAR_OPERATORS[type(element)]
+        divides = type(element) in (Div, Modulo)
+
+        def combined(times, rng):
+            value = _total(operands[0](times, rng))
+            for operand in operands[1:]:
+                other = _total(operand(times, rng))
+                if divides and not other.all():
+                    raise element.fatal('Division by zero')
+                value = function(value, other)
+            return value
+        return combined
+
+    raise NotVectorizable()
@@ -0,0 +1,153 @@
+import re
+
+from django.db import connections, transaction
+
+from game.models import NO_GUILD, Action, Ancestry, Background, Class, Feat, Heritage, Item, Spell, Tag
+
+SEARCH_TABLE = 'game_search'
+SEARCH_LIMIT = 10
+SNIPPET_TOKENS = 12
+SNIPPET_MARK = '**'
+SEARCH_COLUMNS = ['name', 'description', 'effect', 'guild']
+# A match in the name outranks one in the description or effect; the guild
+# column only holds the g<guild id> token every query is filtered by
+RANK_WEIGHTS = (10.0, 1.0, 1.0, 0.0)
+
+# The FTS rowid packs the model and its pk: pk * 16 + kind. Deleting or
+# replacing an entry is then a rowid lookup rather than a scan.
+SEARCH_MODELS = [Item, Feat, Spell, Action, Ancestry, Background, Heritage, Class, Tag]
+KIND_BITS = 4
+
+_word = re.compile(r'\w+')
+
+
+def _kind(model):
+    return SEARCH_MODELS.index(model) + 1
+
+
+def _has_effect(model):
+    return any(field.name == 'effect' for field in model._meta.fields)
+
+
+def _columns(model, row):
+    effect = f'{row}.effect' if _has_effect(model) else "''"
+    return (f"{row}.id * {1 << KIND_BITS} + {_kind(model)}, {row}.name, {row}.description, {effect}, "
+            f"'g' || {row}.guild_id")
+
+
+def _triggers(model):
+    table = model._meta.db_table
+    rowid = f'old.id * {1 << KIND_BITS} + {_kind(model)}'
+    insert = f'INSERT INTO {SEARCH_TABLE}(rowid, {", ".join(SEARCH_COLUMNS)}) VALUES ({_columns(model, "new")});'
+    delete = f'DELETE FROM {SEARCH_TABLE} WHERE rowid = {rowid};'
+    watched = 'guild_id, name, description' + (', effect' if _has_effect(model) else '')
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN {delete} END',
+        f'CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {watched} ON {table} '
+        f'BEGIN {delete} {insert} END',
+    ]
+
+
+def search_supported(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def ensure_search_index(using='default'):
+    # The table lives outside Django's models, so it is created here, after
+    # migrate and again at bot startup. Triggers keep it current for every
+    # write, including importer upserts and queryset updates that skip signals.
+    if not search_supported(using):
+        return False
+    # post_migrate also runs after migrating to a state without the tables
+    tables = connections[using].introspection.table_names()
+    if any(model._meta.db_table not in tables for model in SEARCH_MODELS):
+        return False
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute('SELECT name FROM pragma_table_info(%s)', [SEARCH_TABLE])
+        columns = [name for name, in cursor.fetchall()]
+        created = columns != SEARCH_COLUMNS
+        if created:
+            # Missing, or laid out by an older version: triggers and all start over
+            _drop(cursor)
+            cursor.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5({', '.join(SEARCH_COLUMNS)}, "
+                           f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', %s)",
+                           [f'bm25({", ".join(map(str, RANK_WEIGHTS))})'])
+        for model in SEARCH_MODELS:
+            for statement in _triggers(model):
+                cursor.execute(statement)
+        if created:
+            _fill(cursor)
+    return created
+
+
+def rebuild_search_index(using='default'):
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        _fill(cursor)
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+
+
+def _fill(cursor):
+    for model in SEARCH_MODELS:
+        cursor.execute(f'INSERT INTO {SEARCH_TABLE}(rowid, {", ".join(SEARCH_COLUMNS)}) '
+                       f'SELECT {_columns(model, "row")} FROM {model._meta.db_table} AS row')
+
+
+def _drop(cursor):
+    for model in SEARCH_MODELS:
+        for action in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {model._meta.db_table}_search_{action}')
+    cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+def fts_queries(guild_id, text):
+    # Tried in order until one fills the page. Ranking costs per matching row, so
+    # names go first (they outrank the rest anyway), then whole words anywhere,
+    # then the last word as a prefix for a half-typed name: a short prefix across
+    # descriptions could match most of the compendium
+    words = _word.findall(text)
+    if not words:
+        return []
+    exact = ' '.join(f'"{word}"' for word in words)
+    prefix = ' '.join([*(f'"{word}"' for word in words[:-1]), f'name : "{words[-1]}"*'])
+    guild = f'guild : "g{guild_id or NO_GUILD}"'
+    return [f'{guild} AND ({query})' for query in (f'name : ({exact})', exact, prefix)]
+
+
+def _snippet(column):
+    return f"snippet({SEARCH_TABLE}, {column}, '{SNIPPET_MARK}', '{SNIPPET_MARK}', '…', {SNIPPET_TOKENS})"
+
+
+def search(guild_id, text, limit=SEARCH_LIMIT):
+    # [(model, pk, name, snippet)], best match first
+    queries = fts_queries(guild_id, text)
+    if not queries:
+        return []
+    if not search_supported():
+        return _search_fallback(guild_id, text, limit)
+    results = {}
+    with connections['default'].cursor() as cursor:
+        for query in queries:
+            if len(results) >= limit:
+                break
+            cursor.execute(f"SELECT rowid, name, {_snippet(1)}, {_snippet(2)} FROM {SEARCH_TABLE} "
+                           f"WHERE {SEARCH_TABLE} MATCH %s ORDER BY rank LIMIT %s", [query, limit])
+            for rowid, name, description, effect in cursor.fetchall():
+                # The name is shown anyway: quote the description or effect, whichever
+                # matched. Either is NULL where the model leaves it blank.
+                description, effect = description or '', effect or ''
+                snippet = effect if SNIPPET_MARK in effect and SNIPPET_MARK not in description else description
+                results.setdefault(rowid, (name, snippet))
+    return [(SEARCH_MODELS[(rowid & ((1 << KIND_BITS) - 1)) - 1], rowid >> KIND_BITS, name, snippet)
+            for rowid, (name, snippet) in list(results.items())[:limit]]
+
+
+def _search_fallback(guild_id, text, limit):
+    results = []
+    for model in SEARCH_MODELS:
+        rows = (model.objects.for_guild(guild_id).filter(name__icontains=text)
+                .values_list('pk', 'name', 'description')[:limit])
+        results.extend((model, pk, name, description[:100]) for pk, name, description in rows)
+    return results[:limit]
@@ -0,0 +1,135 @@
+import json
+
+from game.compendium import IMPORT_BATCH_SIZE, CompendiumImporter
+from game.derived import recompute_derived_stats
+from game.models import NO_GUILD, Character, EquipmentEntry, InventoryEntry, Item, Spell, SpellSlot
+
+EXPORT_CHUNK_SIZE = 500
+
+SCALAR_FIELDS = [field.name for field in Character._meta.concrete_fields
+                 if not field.primary_key and not field.is_relation and field.editable and field.name != 'guild_id']
+FOREIGN_KEYS = [field.name for field in Character._meta.concrete_fields if field.is_relation]
+
+
+# Per-character lists: the query they come from and the columns kept per entry.
+# A single column is stored as a flat list of names.
+SHEET_LISTS = {
+    'tags': (Character.tags.through.objects, 'tag__name'),
+    'feats': (Character.feats.through.objects, 'feat__name'),
+    'spells': (Character.spells.through.objects, 'spell__name'),
+    'inventory': (InventoryEntry.objects, 'item__name', 'quantity'),
+    'equipment': (EquipmentEntry.objects, 'item__name', 'slot'),
+    'spell_slots': (SpellSlot.objects, 'level', 'spell__name', 'spontaneous', 'is_cast'),
+}
+
+
+def export_sheets(guild_id=NO_GUILD, chunk_size=EXPORT_CHUNK_SIZE):
+    # Keyset pages rather than one long iterator(): each page is a few short
+    # queries, so SQLite's read lock is never held long enough to stall the bot.
+    # Every list is fetched for the whole page at once as plain tuples, which
+    # skips building a model instance per inventory row.
+    keys = [*SCALAR_FIELDS, *FOREIGN_KEYS]
+    characters = (Character.objects.for_guild(guild_id).order_by('pk')
+                  .values_list('pk', *SCALAR_FIELDS, *(f'{name}__name' for name in FOREIGN_KEYS)))
+    last = 0
+    while page := list(characters.filter(pk__gt=last)[:chunk_size]):
+        ids = [row[0] for row in page]
+        lists = {key: _grouped(queryset.filter(character_id__in=ids).values_list('character_id', *columns))
+                 for key, (queryset, *columns) in SHEET_LISTS.items()}
+        for pk, *values in page:
+            record = dict(zip(keys, values))
+            for key, grouped in lists.items():
+                record[key] = grouped.get(pk, [])
+            yield record
+        last = ids[-1]
+
+
+def _grouped(rows):
+    grouped = {}
+    for character_id, *columns in rows:
+        grouped.setdefault(character_id, []).append(columns[0] if len(columns) == 1 else columns)
+    return grouped
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError('msgpack sheets need the msgpack package: pip install msgpack') from None
+    return msgpack
+
+
+def write_sheets(path, records):
+    count = 0
+    if str(path).endswith('.msgpack'):
+        packer = _msgpack().Packer()
+        with open(path, 'wb') as file:
+            for count, record in enumerate(records, start=1):
+                file.write(packer.pack(record))
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            for count, record in enumerate(records, start=1):
+                file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+                file.write('\n')
+    return count
+
+
+def read_sheets(path):
+    if str(path).endswith('.msgpack'):
+        with open(path, 'rb') as file:
+            yield from _msgpack().Unpacker(file, raw=False)
+    else:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class SheetImporter(CompendiumImporter):
+    # Characters upsert by name like compendium entries; their inventory, equipment
+    # and spell slots are replaced wholesale for every sheet in the batch
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, guild_id=NO_GUILD):
+        super().__init__(Character, batch_size, guild_id)
+
+    def resolved(self, model, entries):
+        known = self.references(model)
+        for name, *rest in entries:
+            if name is None:
+                yield None, *rest
+            elif name in known:
+                yield known[name], *rest
+            else:
+                self.missing.add(f'{model.__name__} {name}')
+
+    def import_batch(self, batch):
+        rows, ids = super().import_batch(batch)
+        if ids is None:
+            ids = dict(self.scoped().filter(name__in=rows).values_list('name', 'pk'))
+
+        def sheets(key):
+            return {ids[name]: row[key] for name, row in rows.items() if key in row}
+
+        inventory = sheets('inventory')
+        # Replaced wholesale: recompute_derived_stats below counts the new rows
+        InventoryEntry.objects.filter(character_id__in=inventory).raw_delete()
+        InventoryEntry.objects.bulk_create(
+            InventoryEntry(character_id=pk, item_id=item_id, quantity=quantity)
+            for pk, entries in inventory.items() for item_id, quantity in self.resolved(Item, entries))
+
+        equipment = sheets('equipment')
+        EquipmentEntry.objects.filter(character_id__in=equipment).raw_delete()
+        EquipmentEntry.objects.bulk_create(
+            EquipmentEntry(character_id=pk, item_id=item_id, slot=slot)
+            for pk, entries in equipment.items() for item_id, slot in self.resolved(Item, entries))
+
+        slots = sheets('spell_slots')
+        SpellSlot.objects.filter(character_id__in=slots).delete()
+        SpellSlot.objects.bulk_create(
+            SpellSlot(character_id=pk, spell_id=spell_id, level=level, spontaneous=spontaneous, is_cast=is_cast)
+            for pk, entries in slots.items()
+            for spell_id, level, spontaneous, is_cast in self.resolved(Spell, ([spell, level, spontaneous, is_cast]
+                                                                               for level, spell, spontaneous, is_cast
+                                                                               in entries)))
+        recompute_derived_stats(Character.objects.filter(pk__in=ids.values()))
+        return rows, ids
@@ -0,0 +1,125 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+
+from game.derived import entry_changed, item_bulk_changed
+from game.models import Character, Class, EquipmentEntry, InventoryEntry, Item, Tag, Taggable, bulk_units
+from game.name_index import name_indexes
+from game.owners import forget_owner
+from game.reference import REFERENCE_MODELS, request_reload
+from game.tag_index import tag_indexes
+from game.write_behind import resource_buffer
+
+
+def index_saved_name(sender, instance, **kwargs):
+    index = name_indexes[sender]
+    if index.ready:
+        index.add(instance.guild_id, instance.pk, instance.name)
+
+
+def unindex_deleted_name(sender, instance, **kwargs):
+    index = name_indexes[sender]
+    if index.ready:
+        index.remove(instance.pk)
+
+
+def index_created_object(sender, instance, created, **kwargs):
+    index = tag_indexes[sender]
+    if created and index.ready:
+        index.add_objects(instance.guild_id, [instance.pk])
+
+
+def unindex_deleted_object(sender, instance, **kwargs):
+    index = tag_indexes[sender]
+    if index.ready:
+        index.remove_objects([instance.pk])
+
+
+def unindex_deleted_tag(sender, instance, **kwargs):
+    for index in tag_indexes.values():
+        if index.ready:
+            index.drop_tags([instance.pk])
+
+
+def reindex_tags(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # reverse: tag.item_set.add(...), instance is the Tag and pk_set holds object ids
+    index = tag_indexes[model if reverse else type(instance)]
+    if not index.ready:
+        return
+    tag_ids, object_ids = ([instance.pk], pk_set) if reverse else (pk_set, [instance.pk])
+    if action == 'post_add':
+        index.tag(tag_ids, object_ids)
+    elif action == 'post_remove':
+        index.untag(tag_ids, object_ids)
+    elif action == 'post_clear':
+        if reverse:
+            index.drop_tags(tag_ids)
+        else:
+            index.untag_objects(object_ids)
+
+
+def reload_resources(sender, instance, **kwargs):
+    # A saved sheet replaces the buffered copy; unflushed deltas still apply on top
+    resource_buffer.forget([instance.pk])
+
+
+def reload_compendium(sender, **kwargs):
+    # The bot polls for the request; it goes out once the change is committed
+    transaction.on_commit(request_reload)
+
+
+def refresh_owner(sender, instance, **kwargs):
+    owner = instance.guild_id, instance.discord_id
+    loaded = getattr(instance, 'loaded_owner', owner)
+    forget_owner(*owner)
+    if loaded != owner and None not in loaded:
+        forget_owner(*loaded)
+    instance.loaded_owner = owner
+
+
+def move_carried_bulk(sender, instance, created, **kwargs):
+    loaded_bulk = getattr(instance, 'loaded_bulk', None)
+    if not created and loaded_bulk is not None and loaded_bulk != instance.bulk:
+        item_bulk_changed(instance.pk, bulk_units(loaded_bulk), bulk_units(instance.bulk))
+    instance.loaded_bulk = instance.bulk
+
+
+def drop_carried_item(sender, instance, **kwargs):
+    # Before the cascade removes the entries: every holder loses what they carried
+    loaded_bulk = getattr(instance, 'loaded_bulk', None)
+    item_bulk_changed(instance.pk, bulk_units(instance.bulk if loaded_bulk is None else loaded_bulk), 0)
+
+
+def carry_saved_entry(sender, instance, created, **kwargs):
+    # bulk_create and queryset updates skip this; their callers adjust carried_bulk.
+    # There is no delete receiver: it would cost the entries Django's fast delete
+    # when their item or character goes, see CarriedEntryQuerySet.
+    loaded = None if created else getattr(instance, 'loaded_carry', None)
+    if created or (loaded is not None and None not in loaded):
+        entry_changed(loaded, instance.carry())
+    instance.loaded_carry = instance.carry()
+
+
+# Connected per model: a catch-all delete receiver would cost every other
+# model Django's fast delete path
+for model in name_indexes:
+    post_save.connect(index_saved_name, sender=model)
+    post_delete.connect(unindex_deleted_name, sender=model)
+for model in tag_indexes:
+    post_save.connect(index_created_object, sender=model)
+    post_delete.connect(unindex_deleted_object, sender=model)
+    m2m_changed.connect(reindex_tags, sender=model.tags.through)
+post_delete.connect(unindex_deleted_tag, sender=Tag)
+post_save.connect(reload_resources, sender=Character)
+post_delete.connect(reload_resources, sender=Character)
+post_save.connect(refresh_owner, sender=Character)
+post_delete.connect(refresh_owner, sender=Character)
+post_save.connect(move_carried_bulk, sender=Item)
+pre_delete.connect(drop_carried_item, sender=Item)
+for model in (InventoryEntry, EquipmentEntry):
+    post_save.connect(carry_saved_entry, sender=model)
+for model in REFERENCE_MODELS.values():
+    post_save.connect(reload_compendium, sender=model)
+    post_delete.connect(reload_compendium, sender=model)
+    if issubclass(model, Taggable):
+        m2m_changed.connect(reload_compendium, sender=model.tags.through)
+m2m_changed.connect(reload_compendium, sender=Class.features.through)
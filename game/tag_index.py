@@ -0,0 +1,173 @@
+from threading import Lock
+
+import numpy as np
+
+from game.models import Action, Ancestry, Background, Character, Feat, Heritage, Item, Spell, Tag
+
+FIND_PAGE_SIZE = 20
+# In a tag query commas separate AND terms, | separates alternatives and a
+# leading - negates a term: "магический, зелье | свиток, -проклятый"
+AND, OR, NOT = ',', '|', '-'
+
+
+def to_bits(ids):
+    ids = np.fromiter(ids, dtype=np.int64)
+    if not len(ids):
+        return 0
+    flags = np.zeros(int(ids.max()) + 1, dtype=np.uint8)
+    flags[ids] = 1
+    return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+
+def from_bits(bits):
+    if not bits:
+        return np.empty(0, dtype=np.int64)
+    packed = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder='little'))
+
+
+class TagIndex:
+    # One bitset per tag of the object ids carrying it, as Python ints: bit n is
+    # pk n, plus one per guild of the objects it owns. Kept current by
+    # game.signals; queries are set arithmetic on the ints
+
+    def __init__(self, model):
+        self.model = model
+        self.ready = False
+        self._lock = Lock()
+        self._tags = {}
+        self._guilds = {}
+
+    def build(self, objects, links):
+        # objects: (pk, guild_id) rows, links: (pk, tag id) rows
+        owned = {}
+        for object_id, guild_id in objects:
+            owned.setdefault(guild_id, []).append(object_id)
+        tagged = {}
+        for object_id, tag_id in links:
+            tagged.setdefault(tag_id, []).append(object_id)
+        guilds = {guild_id: to_bits(ids) for guild_id, ids in owned.items()}
+        tags = {tag_id: to_bits(ids) for tag_id, ids in tagged.items()}
+        with self._lock:
+            self._tags = tags
+            self._guilds = guilds
+            self.ready = True
+
+    def add_objects(self, guild_id, object_ids):
+        bits = to_bits(object_ids)
+        with self._lock:
+            self._guilds[guild_id] = self._guilds.get(guild_id, 0) | bits
+
+    def remove_objects(self, object_ids):
+        bits = to_bits(object_ids)
+        with self._lock:
+            for guild_id, owned in self._guilds.items():
+                if owned & bits:
+                    self._guilds[guild_id] = owned & ~bits
+            self._untag_all(bits)
+
+    def untag_objects(self, object_ids):
+        bits = to_bits(object_ids)
+        with self._lock:
+            self._untag_all(bits)
+
+    def _untag_all(self, bits):
+        for tag_id, tagged in self._tags.items():
+            if tagged & bits:
+                self._tags[tag_id] = tagged & ~bits
+
+    def tag(self, tag_ids, object_ids):
+        bits = to_bits(object_ids)
+        with self._lock:
+            for tag_id in tag_ids:
+                self._tags[tag_id] = self._tags.get(tag_id, 0) | bits
+
+    def untag(self, tag_ids, object_ids):
+        bits = to_bits(object_ids)
+        with self._lock:
+            for tag_id in tag_ids:
+                if tag_id in self._tags:
+                    self._tags[tag_id] &= ~bits
+
+    def drop_tags(self, tag_ids):
+        with self._lock:
+            for tag_id in tag_ids:
+                self._tags.pop(tag_id, None)
+
+    def query(self, guild_id, terms):
+        # terms: [(negated, [tag ids])], ANDed together; the ids in a term are ORed
+        with self._lock:
+            result = self._guilds.get(guild_id, 0)
+            for negated, tag_ids in terms:
+                bits = 0
+                for tag_id in tag_ids:
+                    bits |= self._tags.get(tag_id, 0)
+                result = result & ~bits if negated else result & bits
+            return result
+
+
+TAGGABLE_MODELS = [Item, Feat, Spell, Action, Ancestry, Background, Heritage, Character]
+tag_indexes = {model: TagIndex(model) for model in TAGGABLE_MODELS}
+
+
+def build_tag_indexes():
+    for model, index in tag_indexes.items():
+        through = model.tags.through
+        source = f'{model._meta.model_name}_id'
+        index.build(model.objects.values_list('pk', 'guild_id').iterator(),
+                    through.objects.values_list(source, 'tag_id').iterator())
+
+
+def parse_tag_query(text):
+    # [(negated, [tag names])]
+    terms = []
+    for term in text.split(AND):
+        term = term.strip()
+        negated = term.startswith(NOT)
+        names = [name.strip() for name in term.lstrip(NOT).split(OR) if name.strip()]
+        if names:
+            terms.append((negated, names))
+    return terms
+
+
+def resolve_tag_query(guild_id, terms):
+    # Tag names to the guild's tag ids, case-insensitively; unknown names match nothing
+    names = {name.casefold() for _, term in terms for name in term}
+    known = {name.casefold(): pk for name, pk in Tag.objects.for_guild(guild_id).values_list('name', 'pk')
+             if name.casefold() in names}
+    missing = sorted({name for _, term in terms for name in term if name.casefold() not in known})
+    return [(negated, [known[name.casefold()] for name in term if name.casefold() in known])
+            for negated, term in terms], missing
+
+
+def format_tag_query(terms):
+    # Tag ids back into the query syntax, compact enough for a custom_id
+    return AND.join((NOT if negated else '') + OR.join(map(str, tag_ids)) for negated, tag_ids in terms)
+
+
+def parse_id_query(text):
+    return [(negated, [int(tag_id) for tag_id in term.split(OR) if tag_id])
+            for negated, term in ((part.startswith(NOT), part.lstrip(NOT)) for part in text.split(AND))]
+
+
+def find_page(model, guild_id, terms, page, page_size=FIND_PAGE_SIZE):
+    # (names on the page, page, page count, total)
+    index = tag_indexes[model]
+    if index.ready:
+        ids = from_bits(index.query(guild_id, terms))
+    else:
+        ids = np.fromiter(orm_find(model, guild_id, terms), dtype=np.int64)
+    total = len(ids)
+    page_count = max(1, (total + page_size - 1) // page_size)
+    page = min(max(page, 0), page_count - 1)
+    page_ids = ids[page * page_size:(page + 1) * page_size].tolist()
+    names = sorted(model.objects.filter(pk__in=page_ids).values_list('name', flat=True), key=str.casefold)
+    return names, page, page_count, total
+
+
+def orm_find(model, guild_id, terms):
+    queryset = model.objects.for_guild(guild_id)
+    for negated, tag_ids in terms:
+        term = model.tags.through.objects.filter(tag_id__in=tag_ids).values(f'{model._meta.model_name}_id')
+        queryset = queryset.exclude(pk__in=term) if negated else queryset.filter(pk__in=term)
+    return queryset.order_by('pk').values_list('pk', flat=True)
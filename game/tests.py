@@ -1,3 +1,752 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+from itertools import product
 
-# Create your tests here.
+import dice
+import interactions
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from bot import embed_cache, embed_payload
+
+from game import images, metrics, repository
+from game.inventory import give_items
+from game.models import (ENCUMBERED, UNENCUMBERED, Character, Class, EquipmentEntry, Feat, InventoryEntry, Item,
+                         SpellSlot, Tag, WizardDraft)
+from game.checks import CHECK_LINES, check_embed, check_rows, roll_check
+from game.name_index import GuildNameIndexes, NameIndex, name_indexes, orm_search_names
+from game.odds import UnsupportedFormula, odds
+from game.outbox import ACK, EDIT, Outbox
+from game.owners import SHEET_CHOICES, owned_characters, owner_cache, owner_embed
+from game.reference import compendium, reload_if_requested
+from game.replay import ReplayClient, find_custom_id
+from game.reports import party_members, report_page, report_rows
+from game.repository import db_task
+from game.resources import rest
+from game.rolls import compile_formula, keep_count, roll_many
+from game.search import search
+from game.tag_index import TagIndex, find_page, format_tag_query, from_bits, orm_find, parse_id_query, to_bits
+from game.wizards import commit_draft, edit_draft, evict_expired_drafts, open_draft
+from game.write_behind import ResourceBuffer, load_resources, resource_buffer
+
+
+class CarriedBulkTests(TestCase):
+    def setUp(self):
+        self.hero = Character.objects.create(name='Hero', description='')
+        self.rock = Item.objects.create(name='Rock', description='', bulk=2)
+        self.pebble = Item.objects.create(name='Pebble', description='', bulk=0)
+
+    def carried(self):
+        self.hero.refresh_from_db()
+        return self.hero.carried_bulk
+
+    def test_give_and_take(self):
+        give_items(0, ['Hero'], ['Rock', 'Pebble'], 4)
+        self.assertEqual(self.carried(), 4 * 20 + 4 * 1)
+        self.assertEqual(self.hero.encumbrance, ENCUMBERED)
+        give_items(0, ['Hero'], ['Rock'], -3)
+        self.assertEqual(self.carried(), 20 + 4)
+        # Taking more than is held only takes what is there
+        give_items(0, ['Hero'], ['Rock', 'Pebble'], -10)
+        self.assertEqual(self.carried(), 0)
+        self.assertEqual(self.hero.encumbrance, UNENCUMBERED)
+        self.assertFalse(InventoryEntry.objects.exists())
+
+    def test_give_bumps_version(self):
+        version = self.hero.version
+        give_items(0, ['Hero'], ['Rock'], 1)
+        self.hero.refresh_from_db()
+        self.assertGreater(self.hero.version, version)
+
+    def test_give_query_count(self):
+        # Lookup, carried_bulk and the upsert, plus the savepoint around the writes
+        with self.assertNumQueries(5):
+            give_items(0, ['Hero'], ['Rock', 'Pebble'], 2)
+        with self.assertNumQueries(5):
+            give_items(0, ['Hero'], ['Rock', 'Pebble'], 3)
+        self.assertEqual(sorted(InventoryEntry.objects.values_list('quantity', flat=True)), [5, 5])
+        # Taking also clamps the rows and deletes the emptied ones
+        with self.assertNumQueries(6):
+            _, _, present = give_items(0, ['Hero'], ['Rock'], -5)
+        self.assertEqual(present, 1)
+        self.assertEqual(self.carried(), 5)
+
+    def test_give_unknown_names(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(give_items(0, ['Nobody'], ['Rock'], 1), ([], ['Rock'], 0))
+
+    def test_entry_saves_and_deletes(self):
+        entry = InventoryEntry.objects.create(character=self.hero, item=self.rock, quantity=2)
+        self.assertEqual(self.carried(), 40)
+        entry = InventoryEntry.objects.get(pk=entry.pk)
+        entry.quantity = 3
+        entry.save()
+        self.assertEqual(self.carried(), 60)
+        EquipmentEntry.objects.create(character=self.hero, item=self.pebble, slot='belt')
+        self.assertEqual(self.carried(), 61)
+        entry.delete()
+        self.assertEqual(self.carried(), 1)
+        EquipmentEntry.objects.all().delete()
+        self.assertEqual(self.carried(), 0)
+
+    def test_queryset_delete_is_set_based(self):
+        give_items(0, ['Hero'], ['Rock', 'Pebble'], 2)
+        EquipmentEntry.objects.create(character=self.hero, item=self.rock, slot='back')
+        # Savepoint, UPDATE, DELETE, release
+        with self.assertNumQueries(4):
+            InventoryEntry.objects.filter(character=self.hero).delete()
+        self.assertEqual(self.carried(), 20)
+
+    def test_item_bulk_change_and_delete(self):
+        give_items(0, ['Hero'], ['Rock'], 3)
+        rock = Item.objects.get(pk=self.rock.pk)
+        rock.bulk = 1
+        rock.save()
+        self.assertEqual(self.carried(), 30)
+        rock.delete()
+        self.assertEqual(self.carried(), 0)
+        give_items(0, ['Hero'], ['Pebble'], 10)
+        self.assertEqual(self.carried(), 10)
+
+
+def enumerate_pool(amount, sides, keep=None, highest=True):
+    # {total: probability} over every ordered roll of the pool
+    totals = {}
+    for faces in product(range(1, sides + 1), repeat=amount):
+        kept = sorted(faces, reverse=highest)[:keep]
+        totals[sum(kept)] = totals.get(sum(kept), 0) + 1
+    return {total: times / sides ** amount for total, times in totals.items()}
+
+
+class RollTests(SimpleTestCase):
+    def test_compiled_formula_rerolls(self):
+        formula = compile_formula('2d6+1')
+        self.assertIs(compile_formula('2d6+1'), formula)
+        random.seed(0)
+        # The cached parse tree must not freeze the first result
+        self.assertGreater(len({int(formula.roll()) for _ in range(50)}), 1)
+
+    def test_keep_highest_and_lowest(self):
+        expected = np.sort(np.random.default_rng(7).integers(1, 7, size=(1000, 4)), axis=1)
+        np.testing.assert_array_equal(roll_many('4d6h3', 1000, np.random.default_rng(7)), expected[:, 1:].sum(axis=1))
+        np.testing.assert_array_equal(roll_many('4d6l1', 1000, np.random.default_rng(7)), expected[:, 0])
+        np.testing.assert_array_equal(roll_many('4d6h3+2', 1000, np.random.default_rng(7)),
+                                      expected[:, 1:].sum(axis=1) + 2)
+
+    def test_keep_count_matches_dice(self):
+        # The same slicing quirks as dice.elements: no count keeps all but one, h0 keeps everything
+        for formula, kept in [('4d6h', 3), ('4d6l', 3), ('4d6h0', 4), ('4d6l0', 0), ('3d6h5', 3)]:
+            with self.subTest(formula):
+                compiled = compile_formula(formula)
+                self.assertTrue(compiled.vectorized)
+                self.assertEqual(keep_count(compiled.elements[0]), kept)
+                self.assertTrue((roll_many(formula, 500, np.random.default_rng(1)) <= 6 * kept).all())
+        random.seed(0)
+        self.assertEqual({int(compile_formula('4d6l0').roll()) for _ in range(20)}, {0})
+
+    def test_distribution(self):
+        exact = np.zeros(19)
+        for faces in product(range(1, 7), repeat=4):
+            exact[sum(faces) - min(faces)] += 1 / 6 ** 4
+        rolled = roll_many('4d6h3', 60000, np.random.default_rng(42))
+        self.assertLess(np.abs(np.bincount(rolled, minlength=19) / len(rolled) - exact).max(), 0.01)
+        self.assertAlmostEqual(rolled.mean(), (exact * np.arange(19)).sum(), delta=0.05)
+
+    def test_fallback_and_errors(self):
+        fudge = compile_formula('4dF')
+        self.assertFalse(fudge.vectorized)
+        random.seed(0)
+        rolled = fudge.roll_many(4000)
+        self.assertEqual(rolled.shape, (4000,))
+        self.assertTrue(((rolled >= -4) & (rolled <= 4)).all())
+        self.assertAlmostEqual(rolled.mean(), 0, delta=0.1)
+        with self.assertRaises(dice.DiceFatalException):
+            roll_many('d6/(d1-1)', 10)
+
+
+class OddsTests(SimpleTestCase):
+    def assertMatches(self, formula, expected):
+        distribution = odds(formula)
+        got = {int(value): float(p) for value, p in zip(distribution.values, distribution.pmf) if p > 1e-12}
+        self.assertEqual(got.keys(), expected.keys())
+        for total, probability in expected.items():
+            self.assertAlmostEqual(got[total], probability, places=12)
+
+    def test_sums(self):
+        self.assertMatches('3d6', enumerate_pool(3, 6))
+        self.assertMatches('d20', enumerate_pool(1, 20))
+
+    def test_keep_highest_and_lowest(self):
+        self.assertMatches('4d6h3', enumerate_pool(4, 6, 3))
+        self.assertMatches('5d4h2', enumerate_pool(5, 4, 2))
+        self.assertMatches('3d8l1', enumerate_pool(3, 8, 1, highest=False))
+        self.assertMatches('4d6l3', enumerate_pool(4, 6, 3, highest=False))
+
+    def test_arithmetic(self):
+        pool = enumerate_pool(2, 6)
+        self.assertMatches('2d6+3', {total + 3: p for total, p in pool.items()})
+        self.assertMatches('2d6*2', {total * 2: p for total, p in pool.items()})
+        self.assertMatches('10-2d6', {10 - total: p for total, p in pool.items()})
+        mixed = {}
+        for (left, p), (right, q) in product(pool.items(), enumerate_pool(1, 4).items()):
+            mixed[left - right] = mixed.get(left - right, 0) + p * q
+        self.assertMatches('2d6-d4', mixed)
+
+    def test_large_pools(self):
+        # Long enough for the FFT: still a distribution, symmetric around the mean
+        distribution = odds('300d100')
+        self.assertAlmostEqual(distribution.pmf.sum(), 1)
+        self.assertAlmostEqual(distribution.mean, 300 * 50.5, places=6)
+        self.assertEqual((distribution.minimum, distribution.maximum), (300, 30000))
+        self.assertGreaterEqual(distribution.pmf.min(), 0)
+        self.assertEqual(distribution.percentile(50), 15150)
+
+    def test_too_big_is_refused(self):
+        with self.assertRaises(UnsupportedFormula):
+            odds('44d100h40')
+
+
+class SheetImportTests(TestCase):
+    def setUp(self):
+        self.items = [Item.objects.create(name=f'Item {i}', description='', bulk=1) for i in range(50)]
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'sheets.jsonl')
+
+    def import_sheets(self, sheets):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.writelines(json.dumps(sheet) + '\n' for sheet in sheets)
+        call_command('importsheets', self.path, stdout=open(os.devnull, 'w'))
+
+    def test_reimport_queries_do_not_grow_with_entries(self):
+        sheets = [{'name': f'Hero {i}', 'description': '', 'strength': 14,
+                   'inventory': [[item.name, 2] for item in self.items], 'equipment': [['Item 0', 'belt']]}
+                  for i in range(20)]
+        self.import_sheets(sheets)
+        # 1000 inventory rows replaced: a delete and an insert, not a query per row
+        with self.assertNumQueries(16):
+            self.import_sheets(sheets)
+        self.assertEqual(set(Character.objects.values_list('carried_bulk', flat=True)), {50 * 2 * 10 + 10})
+
+    def test_reimport_round_trip(self):
+        with override_settings(COMPENDIUM_RELOAD_FILE=os.path.join(self.directory, 'reload')):
+            compendium.reload()
+            self.import_sheets([{'name': 'Hero', 'description': 'First', 'strength': 14,
+                                 'inventory': [['Item 0', 2], ['Item 1', 1]]}])
+            self.assertTrue(reload_if_requested())
+            self.assertEqual(name_indexes[Character].search(0, 'her'), ['Hero'])
+            self.import_sheets([{'name': 'Hero', 'description': 'Second', 'strength': 18,
+                                 'inventory': [['Item 1', 5]], 'equipment': [['Item 2', 'belt']]},
+                                {'name': 'Heroine', 'description': ''}])
+            self.assertTrue(reload_if_requested())
+            self.assertFalse(reload_if_requested())
+        self.assertEqual(name_indexes[Character].search(0, 'her'), ['Hero', 'Heroine'])
+        hero = Character.objects.get(name='Hero')
+        self.assertEqual((hero.description, hero.strength_mod, hero.carried_bulk), ('Second', 4, 60))
+        self.assertEqual(list(hero.inventoryentry_set.values_list('item__name', 'quantity')), [('Item 1', 5)])
+        self.assertEqual(list(hero.equipmententry_set.values_list('item__name', 'slot')), [('Item 2', 'belt')])
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        self.hero = Character.objects.create(name='Hero', description='', hp=7, max_hp=10)
+        self.mage = Character.objects.create(name='Mage', description='', hp=4, max_hp=6)
+        Character.objects.create(name='Hero', description='', hp=1, max_hp=1, guild_id=2)
+        Item.objects.create(name='Rock', description='', bulk=2, level=3)
+        Item.objects.create(name='Rope', description='', bulk=0, level=1)
+        give_items(0, ['Hero'], ['Rock'], 4)
+        give_items(0, ['Hero', 'Mage'], ['Rope'], 1)
+
+    def test_rows(self):
+        with self.assertNumQueries(1):
+            rows = report_rows(0)
+        self.assertEqual(rows, [
+            ('Hero', 1, 7, 10, 81, 0, ENCUMBERED, 5, 13, 3),
+            ('Mage', 1, 4, 6, 1, 0, UNENCUMBERED, 1, 1, 1),
+        ])
+        Character.objects.create(name='Bard', description='')
+        self.assertEqual(report_rows(0, party_members(0, ['Bard', 'Mage', 'Nobody'])),
+                         [('Bard', 1, 0, 0, 0, 0, UNENCUMBERED, 0, 0, None),
+                          ('Mage', 1, 4, 6, 1, 0, UNENCUMBERED, 1, 1, 1)])
+        self.assertEqual([row[0] for row in report_rows(2)], ['Hero'])
+
+    def test_page(self):
+        embed, page, page_count = report_page('Отряд', report_rows(0), 5, page_size=1)
+        self.assertEqual((page, page_count), (1, 2))
+        self.assertEqual(embed.description, 'Персонажей: 2, ОЗ 11/16, нагрузка 8 2L, предметов 6')
+        self.assertEqual([field.name for field in embed.fields], ['Mage, ур. 1'])
+        self.assertEqual(embed.footer.text, 'Страница 2/2')
+        embed, _, _ = report_page('Отряд', report_rows(0), 0)
+        self.assertIn('нагрузка 8 1L из 5 (обременён)', embed.fields[0].value)
+        self.assertEqual(report_page('Отряд', [], 0)[0].description, 'Никого нет')
+
+
+class WizardDraftTests(TestCase):
+    def setUp(self):
+        self.hero = Character.objects.create(name='Hero', description='old', level=2)
+
+    def test_draft_is_saved_only_on_commit(self):
+        draft_id = open_draft('character', 7, guild_id=0, discord_id=7)
+        self.assertEqual(edit_draft(draft_id, 7, name='Nova', description='new', level=3).name, 'Nova')
+        self.assertEqual(edit_draft(draft_id, 7, strength=16).strength_mod, 3)
+        # Every step lands in the database, nothing waits in memory
+        self.assertEqual(WizardDraft.objects.get(pk=draft_id).data,
+                         {'guild_id': 0, 'discord_id': 7, 'name': 'Nova', 'description': 'new', 'level': 3,
+                          'strength': 16})
+        self.assertFalse(Character.objects.filter(name='Nova').exists())
+        nova = commit_draft(draft_id, 7, wisdom=12)
+        self.assertEqual(Character.objects.get(name='Nova').pk, nova.pk)
+        self.assertEqual((nova.strength, nova.wisdom, nova.discord_id), (16, 12, 7))
+        self.assertFalse(WizardDraft.objects.exists())
+        self.assertIsNone(commit_draft(draft_id, 7))
+
+    def test_edit_existing(self):
+        draft_id = open_draft('character', 7, self.hero.pk)
+        self.assertEqual(edit_draft(draft_id, 7, description='new').description, 'new')
+        self.hero.refresh_from_db()
+        self.assertEqual(self.hero.description, 'old')
+        commit_draft(draft_id, 7)
+        self.hero.refresh_from_db()
+        self.assertEqual(self.hero.description, 'new')
+
+    def test_other_author_and_expiry(self):
+        draft_id = open_draft('character', 7, self.hero.pk)
+        self.assertIsNone(edit_draft(draft_id, 8, description='theirs'))
+        self.assertIsNone(commit_draft(draft_id, 8))
+        WizardDraft.objects.filter(pk=draft_id).update(expires_at=timezone.now())
+        self.assertIsNone(edit_draft(draft_id, 7, description='late'))
+        self.assertEqual(evict_expired_drafts(), 1)
+
+
+class WizardRestartTests(TransactionTestCase):
+    # The DB workers only see committed rows, so no wrapping transaction here
+
+    def extension(self):
+        # A fresh client and extension, as after a restart
+        client = interactions.Client(token='replay')
+        client.load_extension('bot')
+        extension = client.get_ext('CharacterExtension')
+        extension.bot = ReplayClient()
+        return extension
+
+    async def test_resume_after_restart(self):
+        extension = self.extension()
+        ctx = extension.bot.context(author_id=7)
+        await extension.create_character.callback(ctx)
+        ctx = extension.bot.context(author_id=7, custom_id=ctx.modal.custom_id,
+                                    responses={'name': 'Nova', 'description': 'new', 'level': '3'})
+        await extension.character_modal.callback(ctx)
+
+        # Only the custom_ids on the message outlive the process
+        extension = self.extension()
+        for page in (('strength', '16'),), (('wisdom', '12'),):
+            for stat, value in page:
+                ctx = extension.bot.context(author_id=7, values=[value], message=ctx.message,
+                                            custom_id=find_custom_id(ctx.message, 'character_stat:', f':{stat}'))
+                await extension.character_stat.callback(ctx)
+            ctx = extension.bot.context(author_id=7, message=ctx.message,
+                                        custom_id=find_custom_id(ctx.message, 'character_next:'))
+            await extension.character_next.callback(ctx)
+
+        nova = await sync_to_async(Character.objects.get)(name='Nova')
+        self.assertEqual((nova.guild_id, nova.discord_id, nova.level, nova.strength, nova.wisdom), (1, 7, 3, 16, 12))
+        self.assertFalse(await sync_to_async(WizardDraft.objects.exists)())
+
+
+class OwnerCacheTests(TestCase):
+    def cache(self, *owners):
+        for owner in owners:
+            owner_cache.put((0, owner), owned_characters(0, owner))
+
+    def test_changing_owner_refreshes_both_lists(self):
+        hero = Character.objects.create(name='Hero', description='', discord_id=1)
+        self.cache(1, 2)
+        hero.discord_id = 2
+        hero.save()
+        self.assertIsNone(owner_cache.get((0, 1)))
+        self.assertIsNone(owner_cache.get((0, 2)))
+        self.cache(2, 3)
+        hero = Character.objects.get(pk=hero.pk)
+        hero.discord_id = 3
+        hero.save()
+        self.assertIsNone(owner_cache.get((0, 2)))
+        self.assertEqual([row[1] for row in owned_characters(0, 3)], ['Hero'])
+
+
+class EmbedCacheTests(TestCase):
+    def setUp(self):
+        embed_cache.clear()
+        self.fighter = Class.objects.create(name='Fighter', description='')
+        self.hero = Character.objects.create(name='Hero', description='', character_class=self.fighter)
+
+    def sheet(self):
+        return embed_payload(Character.objects.select_related('character_class').get(pk=self.hero.pk))
+
+    def test_hit_and_invalidate_on_save(self):
+        first = self.sheet()
+        hits = embed_cache.hits
+        self.assertIs(self.sheet(), first)
+        self.assertEqual(embed_cache.hits, hits + 1)
+        self.hero.description = 'Changed'
+        self.hero.save()
+        self.assertEqual(self.sheet()['fields'][1]['value'], 'Changed')
+
+    def test_renamed_class_is_shown(self):
+        self.assertEqual(self.sheet()['fields'][0]['name'], 'Fighter')
+        self.fighter.name = 'Warrior'
+        self.fighter.save()
+        self.assertEqual(self.sheet()['fields'][0]['name'], 'Warrior')
+        self.fighter.delete()
+        self.assertEqual(self.sheet()['fields'][0]['name'], 'Character 1')
+
+
+class RestTests(TestCase):
+    def setUp(self):
+        # Hero's max HP was lowered below what they have
+        self.hero = Character.objects.create(name='Hero', description='', hp=12, max_hp=10, focus_points=0,
+                                             max_focus=2)
+        self.mage = Character.objects.create(name='Mage', description='', hp=1, max_hp=6)
+        self.other = Character.objects.create(name='Hero', description='', hp=1, max_hp=9, guild_id=2)
+        for character in (self.hero, self.mage, self.other):
+            SpellSlot.objects.create(character=character, level=1, is_cast=True)
+
+    def tearDown(self):
+        resource_buffer.take_pending()
+        resource_buffer.forget_all()
+
+    def resources(self, character):
+        character.refresh_from_db()
+        return character.hp, character.focus_points, list(character.prepared_spells.values_list('is_cast', flat=True))
+
+    def test_named_characters(self):
+        # The two UPDATEs and the names, inside a savepoint
+        with self.assertNumQueries(5):
+            self.assertEqual(rest(0, ['Hero', 'Nobody']), ['Hero'])
+        self.assertEqual(self.resources(self.hero), (10, 2, [False]))
+        self.assertEqual(self.resources(self.mage), (1, 0, [True]))
+        self.assertEqual(self.resources(self.other), (1, 0, [True]))
+
+    def test_everyone_in_guild(self):
+        self.assertEqual(rest(0), ['Hero', 'Mage'])
+        self.assertEqual(self.resources(self.mage), (6, 0, [False]))
+        self.assertEqual(self.resources(self.other), (1, 0, [True]))
+        self.assertEqual(rest(3), [])
+
+    def test_overrides_buffered_damage(self):
+        resource_buffer.remember(load_resources(0, 'Hero'))
+        self.assertEqual(resource_buffer.change(0, 'Hero', 'hp', -20), (0, 10))
+        version = Character.objects.get(pk=self.hero.pk).version
+        self.assertEqual(repository.rest.func(0, ['Hero']), ['Hero'])
+        self.assertEqual(self.resources(self.hero)[0], 10)
+        self.assertGreater(self.hero.version, version)
+        # Nothing of the damage is left to flush over the rest
+        self.assertIsNone(resource_buffer.current(self.hero.pk))
+        self.assertEqual(resource_buffer.take_pending(), {})
+
+
+class CheckTests(TestCase):
+    def setUp(self):
+        Character.objects.create(name='Hero', description='', wisdom=16)
+        Character.objects.create(name='Mage', description='', wisdom=8)
+        Character.objects.create(name='Bard', description='', wisdom=17)
+        Character.objects.create(name='Hero', description='', wisdom=20, guild_id=2)
+
+    def test_rows_use_stored_modifiers(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(check_rows(0, 'wisdom'), [('Bard', 3), ('Hero', 3), ('Mage', -1)])
+        self.assertEqual(check_rows(0, 'wisdom', ['Mage', 'Nobody']), [('Mage', -1)])
+        self.assertEqual(check_rows(2, 'wisdom'), [('Hero', 5)])
+
+    def test_modifiers_and_order(self):
+        rows = [('Mage', -1), ('Hero', 3), ('Bard', 3)]
+        rolled = np.random.default_rng(5).integers(1, 21, size=3)
+        results = roll_check('d20', rows, np.random.default_rng(5))
+        expected = [(name, int(roll), modifier, int(roll) + modifier) for (name, modifier), roll in zip(rows, rolled)]
+        self.assertEqual(results, sorted(expected, key=lambda result: -result[3]))
+        # Equal totals keep the rows' (name) order
+        self.assertEqual(roll_check('10', rows), [('Hero', 10, 3, 13), ('Bard', 10, 3, 13), ('Mage', 10, -1, 9)])
+
+    def test_dc_outcome(self):
+        results = [('Hero', 12, 3, 15), ('Bard', 11, 3, 14), ('Mage', 16, -1, 15)]
+        embed = check_embed('Проверка', results, dc=15)
+        self.assertEqual(embed.description.split('\n'),
+                         ['**15** Hero (12 +3) ✓', '**14** Bard (11 +3) ✗', '**15** Mage (16 -1) ✓'])
+        self.assertEqual((embed.fields[0].name, embed.fields[0].value), ('КС 15', 'Успехов: 2/3'))
+        embed = check_embed('Проверка', results * CHECK_LINES)
+        self.assertFalse(embed.fields)
+        self.assertNotIn('✓', embed.description)
+        self.assertTrue(embed.description.endswith(f'… и ещё {2 * CHECK_LINES}'))
+
+
+class ResourceBufferTests(SimpleTestCase):
+    # row: pk, guild_id, name, hp, max_hp, focus_points, max_focus, hero_points
+    def setUp(self):
+        self.buffer = ResourceBuffer()
+        self.buffer.remember((1, 5, 'Hero', 10, 20, 1, 2, 0))
+
+    def test_changes_clamp_and_accumulate(self):
+        self.assertEqual(self.buffer.change(5, 'Hero', 'hp', 15), (20, 20))
+        self.assertEqual(self.buffer.change(5, 'Hero', 'hp', -25), (0, 20))
+        self.assertEqual(self.buffer.change(5, 'Hero', 'hero_points', 5), (3, 3))
+        self.assertIsNone(self.buffer.change(6, 'Hero', 'hp', 1))
+        self.assertEqual(self.buffer.take_pending(), {1: {'hp': -10, 'hero_points': 3}})
+        self.assertEqual(self.buffer.pending_changes, 0)
+
+    def test_failed_flush_restores_deltas(self):
+        self.buffer.change(5, 'Hero', 'hp', -4)
+        pending = self.buffer.take_pending()
+        self.buffer.change(5, 'Hero', 'hp', -1)
+        self.buffer.restore_pending(pending)
+        self.assertEqual(self.buffer.take_pending(), {1: {'hp': -5}})
+
+    def test_reload_applies_unflushed_deltas(self):
+        self.buffer.change(5, 'Hero', 'hp', -4)
+        self.buffer.forget([1])
+        self.buffer.remember((1, 5, 'Hero', 10, 20, 1, 2, 0))
+        self.assertEqual(self.buffer.change(5, 'Hero', 'hp', 0), (6, 20))
+
+    def test_renamed_elsewhere_is_rekeyed(self):
+        self.buffer.change(5, 'Hero', 'hp', -4)
+        self.buffer.remember((1, 5, 'Heroine', 10, 20, 1, 2, 0))
+        self.assertIsNone(self.buffer.change(5, 'Hero', 'hp', 0))
+        self.assertEqual(self.buffer.change(5, 'Heroine', 'hp', 0), (6, 20))
+
+
+class OwnerEmbedTests(SimpleTestCase):
+    def test_fields_are_capped(self):
+        rows = [(pk, f'Hero {pk}', 1, None, 10, 10, 0, 0) for pk in range(SHEET_CHOICES + 5)]
+        embed = owner_embed('Player', rows)
+        self.assertEqual(len(embed.fields), SHEET_CHOICES)
+        self.assertEqual(embed.footer.text, '… ещё 5')
+
+
+class OutboxTests(SimpleTestCase):
+    def setUp(self):
+        self.outbox = Outbox()
+        self.sent = []
+
+    def request(self, value, release=None):
+        async def send():
+            self.sent.append(value)
+            if release is not None:
+                await release.wait()
+            return value
+        return send
+
+    async def test_unsent_edits_coalesce(self):
+        futures = [self.outbox.submit(self.request(value), EDIT, key='message') for value in 'abc']
+        self.assertEqual(await asyncio.gather(*futures), ['c', 'c', 'c'])
+        self.assertEqual(self.sent, ['c'])
+
+    async def test_edit_waits_for_the_one_in_flight(self):
+        release = asyncio.Event()
+        first = self.outbox.submit(self.request('a', release), EDIT, key='message')
+        await asyncio.sleep(0.01)
+        later = [self.outbox.submit(self.request(value), EDIT, key='message') for value in 'bc']
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.sent, ['a'])
+        release.set()
+        self.assertEqual(await asyncio.gather(first, *later), ['a', 'c', 'c'])
+        self.assertEqual(self.sent, ['a', 'c'])
+
+    async def test_acknowledgements_go_first(self):
+        self.outbox.submit(self.request('edit'), EDIT, key='message')
+        await self.outbox.submit(self.request('ack'), ACK)
+        self.assertEqual(self.sent[0], 'ack')
+
+
+class MetricsTests(TestCase):
+    async def test_collecting_follows_workers_and_nests(self):
+        metrics.install_query_counter()
+        count_items = db_task(lambda: Item.objects.count())
+        with metrics.collecting() as outer:
+            await count_items()
+            with metrics.collecting() as inner:
+                await count_items()
+                await count_items()
+        self.assertEqual(inner.queries, 2)
+        self.assertEqual(outer.queries, 3)
+
+
+class NameIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = NameIndex()
+        self.index.build(enumerate(['Fireball', 'Wand of Fireballs', 'Bonfire', 'Campfire Song', 'Firm Grip',
+                                    *(f'Ring {i} of spitfire' for i in range(50))]))
+
+    def test_prefixes_rank_first(self):
+        self.assertEqual(self.index.search('fire', 2), ['Fireball', 'Wand of Fireballs'])
+        self.assertEqual(self.index.search('FIR', 2), ['Fireball', 'Firm Grip'])
+
+    def test_substrings_stop_at_the_limit(self):
+        found = self.index.search('pitfire', 5)
+        self.assertEqual(len(found), 5)
+        self.assertTrue(all('spitfire' in name for name in found))
+        self.assertEqual(self.index.search('xyz'), [])
+
+    def test_short_queries_match_inside_names(self):
+        self.index.add(100, 'Slab Armor')
+        self.assertEqual(self.index.search('ab'), ['Slab Armor'])
+        self.assertEqual(self.index.search('IP'), ['Firm Grip'])
+
+
+class TagIndexTests(TestCase):
+    def setUp(self):
+        self.tags = [Tag.objects.create(name=name, description='') for name in ('magic', 'potion', 'scroll', 'cursed')]
+        magic, potion, scroll, cursed = self.tags
+        for i, tags in enumerate([[magic, potion], [magic, scroll, cursed], [potion], [scroll], [magic], []]):
+            Item.objects.create(name=f'Item {i}', description='').tags.set(tags)
+        Item.objects.create(name='Elsewhere', description='', guild_id=7).tags.set([magic])
+        self.index = TagIndex(Item)
+        self.index.build(Item.objects.values_list('pk', 'guild_id'),
+                         Item.tags.through.objects.values_list('item_id', 'tag_id'))
+
+    def test_bits_round_trip(self):
+        self.assertEqual(from_bits(to_bits([5, 0, 64, 3])).tolist(), [0, 3, 5, 64])
+        self.assertEqual(to_bits([]), 0)
+
+    def test_query_matches_the_orm(self):
+        magic, potion, scroll, cursed = (tag.pk for tag in self.tags)
+        for terms in ([(False, [magic])],
+                      [(False, [potion, scroll])],
+                      [(False, [magic]), (True, [cursed])],
+                      [(True, [magic, potion])],
+                      [(False, [magic]), (False, [])]):
+            with self.subTest(terms=terms):
+                self.assertEqual(from_bits(self.index.query(0, terms)).tolist(), list(orm_find(Item, 0, terms)))
+
+    def test_format_parse_round_trip(self):
+        for terms in ([(False, [1])], [(False, [1, 22]), (True, [333])], [(True, [4]), (False, [])]):
+            with self.subTest(terms=terms):
+                self.assertEqual(parse_id_query(format_tag_query(terms)), terms)
+
+
+class GuildIsolationTests(TestCase):
+    # The same names in two guilds, and one name only the second guild has
+    def setUp(self):
+        self.heroes, self.rocks = {}, {}
+        for guild_id in (1, 2):
+            self.heroes[guild_id] = Character.objects.create(name='Hero', description='', guild_id=guild_id)
+            self.rocks[guild_id] = Item.objects.create(name='Rock', description='', bulk=1, guild_id=guild_id)
+            tag = Tag.objects.create(name='stone', description='', guild_id=guild_id)
+            self.rocks[guild_id].tags.set([tag])
+        Item.objects.create(name='Rope', description='', guild_id=2)
+
+    def test_names_are_unique_per_guild(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Item.objects.create(name='Rock', description='', guild_id=1)
+        self.assertEqual(Item.objects.for_guild(1).get(name='Rock'), self.rocks[1])
+
+    def test_autocomplete(self):
+        index = GuildNameIndexes()
+        index.build(Item.objects.values_list('pk', 'guild_id', 'name'))
+        self.assertEqual(index.search(1, 'ro'), ['Rock'])
+        self.assertEqual(index.search(2, 'ro'), ['Rock', 'Rope'])
+        self.assertEqual(index.search(3, 'ro'), [])
+        self.assertEqual(orm_search_names(Item, 1, 'ro'), ['Rock'])
+
+    def test_find(self):
+        stone = Tag.objects.for_guild(1).get(name='stone').pk
+        names, _, _, total = find_page(Item, 1, [(False, [stone])], 0)
+        self.assertEqual((names, total), (['Rock'], 1))
+        # The other guild's tag of the same name matches nothing here
+        self.assertEqual(find_page(Item, 2, [(False, [stone])], 0)[3], 0)
+        index = TagIndex(Item)
+        index.build(Item.objects.values_list('pk', 'guild_id'),
+                    Item.tags.through.objects.values_list('item_id', 'tag_id'))
+        self.assertEqual(from_bits(index.query(1, [(True, [])])).tolist(), [self.rocks[1].pk])
+
+    def test_give(self):
+        characters, items, _ = give_items(1, ['Hero'], ['Rock', 'Rope'], 2)
+        self.assertEqual((characters, items), (['Hero'], ['Rock']))
+        self.assertEqual(list(InventoryEntry.objects.values_list('character_id', 'item_id', 'quantity')),
+                         [(self.heroes[1].pk, self.rocks[1].pk, 2)])
+        self.heroes[2].refresh_from_db()
+        self.assertEqual(self.heroes[2].carried_bulk, 0)
+
+
+class SearchTests(TestCase):
+    # The index is created by post_migrate with the test database; triggers fill it
+    def setUp(self):
+        self.sword = Item.objects.create(name='Dragon Sword', description='Forged in dragon fire')
+        Item.objects.create(name='Shield', description='Stops a dragon bite', guild_id=5)
+
+    def test_rows_written_later_are_found(self):
+        self.assertEqual([(model, pk, name) for model, pk, name, _ in search(0, 'dragon')],
+                         [(Item, self.sword.pk, 'Dragon Sword')])
+        Feat.objects.create(name='Fire Breath', description='Like a dragon')
+        self.assertEqual([name for _, _, name, _ in search(0, 'dragon')], ['Dragon Sword', 'Fire Breath'])
+        self.sword.name = 'Blade'
+        self.sword.save()
+        self.assertEqual([name for _, _, name, _ in search(0, 'blade')], ['Blade'])
+        self.sword.delete()
+        self.assertEqual([name for _, _, name, _ in search(0, 'dragon')], ['Fire Breath'])
+
+    def test_snippets_and_prefixes(self):
+        (_, _, _, snippet), = search(0, 'fire')
+        self.assertIn('**fire**', snippet)
+        self.assertEqual([name for _, _, name, _ in search(0, 'drag')], ['Dragon Sword'])
+
+    def test_query_syntax_is_quoted(self):
+        for text in ('dragon"', '"dragon', 'dragon AND', 'NOT dragon', 'dragon*', 'name:dragon', '(dragon', "d'ragon"):
+            with self.subTest(text=text):
+                search(0, text)
+        self.assertEqual(search(0, '"*()'), [])
+        self.assertEqual([name for _, _, name, _ in search(0, 'dragon"')], ['Dragon Sword'])
+
+
+class ImageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = override_settings(IMAGE_ROOT=self.root, IMAGE_FILE_URLS=True)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def picture(self, name, size=(600, 300), mode='RGB'):
+        path = os.path.join(self.root, name)
+        Image.new(mode, size).save(path, 'PNG')
+        return path, f'file://{path}'
+
+    async def test_sizes_and_shared_originals(self):
+        path, url = self.picture('a.png')
+        shutil.copy(path, os.path.join(self.root, 'b.png'))
+        with open(path, 'rb') as file:
+            expected = hashlib.sha256(file.read()).hexdigest()
+        digest = await images.ingest(url)
+        self.assertEqual(digest, expected)
+        self.assertEqual(await images.ingest(f'file://{self.root}/b.png'), digest)
+        self.assertEqual(os.listdir(os.path.dirname(images.original_path(self.root, digest))), [digest])
+        for size, dimensions in (('thumb', (256, 128)), ('large', (600, 300))):
+            with Image.open(images.image_path(self.root, size, digest)) as stored:
+                self.assertEqual(stored.size, dimensions)
+
+    async def test_failures_fall_back_and_are_retried(self):
+        path = os.path.join(self.root, 'broken.png')
+        with open(path, 'wb') as file:
+            file.write(b'not an image')
+        url = f'file://{path}'
+        self.assertIsNone(await images.ingest(url))
+        self.picture('broken.png')
+        self.assertIsNotNone(await images.ingest(url))
+
+    async def test_decoder_errors_are_logged(self):
+        # Past Pillow's decompression bomb limit
+        _, url = self.picture('bomb.png', (14000, 14000), mode='1')
+        with self.assertLogs('game.images', 'ERROR'):
+            self.assertIsNone(await images.ingest(url))
+
+    async def test_file_urls_need_the_setting(self):
+        _, url = self.picture('local.png')
+        with override_settings(IMAGE_FILE_URLS=False):
+            self.assertIsNone(await images.ingest(url))
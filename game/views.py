@@ -1,3 +1,32 @@
-from django.shortcuts import render
+import os
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+
+from game.images import IMAGE_FORMAT, IMAGE_SIZES, image_path
 
 # Create your views here.
+
+
+def metrics(request):
+    # The bot runs in its own process and leaves a snapshot on disk
+    try:
+        with open(settings.METRICS_FILE) as file:
+            body = file.read()
+    except FileNotFoundError:
+        body = ''
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def image(request, size, prefix, name):
+    # Content-addressed, so a URL never changes what it points to
+    digest, _, extension = name.partition('.')
+    if (size not in IMAGE_SIZES or extension != IMAGE_FORMAT or len(digest) != 64 or prefix != digest[:2]
+            or not all(c in '0123456789abcdef' for c in digest)):
+        raise Http404()
+    path = image_path(settings.IMAGE_ROOT, size, digest)
+    if not os.path.exists(path):
+        raise Http404()
+    response = FileResponse(open(path, 'rb'), content_type=f'image/{IMAGE_FORMAT}')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
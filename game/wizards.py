@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from game.models import Character, Item, WizardDraft
+
+# The create/edit wizards keep no coroutine or object alive between clicks: the
+# draft id travels in every custom_id and the draft itself waits here, in the
+# database, so a restart or a thousand abandoned wizards cost nothing.
+DRAFT_TTL = timedelta(hours=1)
+
+WIZARD_MODELS = {
+    'item': Item,
+    'character': Character,
+}
+
+
+def _expiry():
+    return timezone.now() + DRAFT_TTL
+
+
+def _apply(entity, data):
+    for field, value in data.items():
+        if field == 'bulk_txt':
+            entity.txt_to_bulk(value)
+        else:
+            setattr(entity, field, value)
+    return entity
+
+
+def _entity(draft):
+    model = WIZARD_MODELS[draft.kind]
+    if draft.target_id is None:
+        entity = model()
+    else:
+        queryset = model.objects.select_related('character_class') if model is Character else model.objects
+        entity = queryset.get(pk=draft.target_id)
+    _apply(entity, draft.data)
+    if model is Character:
+        # The preview shows modifiers for the scores picked so far
+        entity.update_derived_stats()
+    return entity
+
+
+def _live_draft(draft_id, author_id):
+    return (WizardDraft.objects.select_for_update()
+            .filter(pk=draft_id, author_id=author_id, expires_at__gt=timezone.now())
+            .first())
+
+
+def open_draft(kind, author_id, target_id=None, **data):
+    return WizardDraft.objects.create(kind=kind, author_id=author_id, target_id=target_id, data=data,
+                                      expires_at=_expiry()).pk
+
+
+def edit_draft(draft_id, author_id, **data):
+    # Returns the entity as the draft would save it, or None once the draft is
+    # gone, expired or belongs to someone else
+    with transaction.atomic():
+        draft = _live_draft(draft_id, author_id)
+        if draft is None:
+            return None
+        draft.data.update(data)
+        draft.expires_at = _expiry()
+        draft.save(update_fields=['data', 'expires_at'])
+    return _entity(draft)
+
+
+def commit_draft(draft_id, author_id, **data):
+    with transaction.atomic():
+        draft = _live_draft(draft_id, author_id)
+        if draft is None:
+            return None
+        draft.data.update(data)
+        entity = _entity(draft)
+        entity.save()
+        draft.delete()
+    return entity
+
+
+def evict_expired_drafts():
+    deleted, _ = WizardDraft.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
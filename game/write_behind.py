@@ -0,0 +1,169 @@
+import time
+from threading import Lock
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest, Least
+
+from game.models import Character
+
+# Buffered resource -> the field capping it (or a fixed cap)
+RESOURCE_LIMITS = {
+    'hp': 'max_hp',
+    'focus_points': 'max_focus',
+    'hero_points': 3,
+}
+# What a cached character holds: each resource and the field capping it
+RESOURCE_COLUMNS = [column for field, limit in RESOURCE_LIMITS.items()
+                    for column in ([field, limit] if isinstance(limit, str) else [field])]
+# Cached characters nobody touched for this long are dropped on the next flush,
+# so edits made elsewhere (the admin, an import) show up again
+ENTRY_TTL = 300
+
+
+class ResourceBuffer:
+    # In-memory copy of the characters' HP, focus and hero points during play.
+    # Changes apply here and answer at once; what changed is kept as per-character
+    # deltas and written in one UPDATE per flush. Deltas rather than values, so a
+    # flush never overwrites what /rest or an edit wrote in between.
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = {}
+        self._names = {}
+        self._pending = {}
+        self.pending_changes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def remember(self, row):
+        # row: pk, guild_id, name, then RESOURCE_COLUMNS
+        pk, guild_id, name, *values = row
+        entry = dict(zip(RESOURCE_COLUMNS, values))
+        with self._lock:
+            cached = self._entries.get(pk)
+            if cached is not None:
+                # Keeps the cached values, which may hold changes the row does not
+                # have yet; the name or guild may have changed without a signal here
+                # (an admin edit, assignguild, importsheets)
+                self._rekey(pk, cached, (guild_id, name))
+                return
+            # Deltas still waiting for a flush are not in the row yet
+            for field, delta in self._pending.get(pk, {}).items():
+                entry[field] = self._clamp(entry, field, entry[field] + delta)
+            entry['key'] = guild_id, name
+            entry['touched'] = time.monotonic()
+            self._entries[pk] = entry
+            self._names[guild_id, name] = pk
+
+    def _rekey(self, pk, entry, key):
+        if entry['key'] == key:
+            return
+        if self._names.get(entry['key']) == pk:
+            del self._names[entry['key']]
+        entry['key'] = key
+        self._names[key] = pk
+
+    @staticmethod
+    def _clamp(entry, field, value):
+        limit = RESOURCE_LIMITS[field]
+        return max(0, min(value, entry[limit] if isinstance(limit, str) else limit))
+
+    def change(self, guild_id, name, field, delta):
+        # (new value, its limit), or None when the character is not loaded
+        with self._lock:
+            pk = self._names.get((guild_id, name))
+            if pk is None:
+                return None
+            entry = self._entries[pk]
+            value = self._clamp(entry, field, entry[field] + delta)
+            if value != entry[field]:
+                pending = self._pending.setdefault(pk, {})
+                pending[field] = pending.get(field, 0) + value - entry[field]
+                entry[field] = value
+                self.pending_changes += 1
+            entry['touched'] = time.monotonic()
+            limit = RESOURCE_LIMITS[field]
+            return value, entry[limit] if isinstance(limit, str) else limit
+
+    def current(self, pk):
+        # The buffered resources of a loaded character, or None
+        with self._lock:
+            entry = self._entries.get(pk)
+            return {field: entry[field] for field in RESOURCE_COLUMNS} if entry is not None else None
+
+    def forget(self, pks):
+        # Drops the cached values, keeping unflushed deltas for the next load
+        with self._lock:
+            for pk in pks:
+                entry = self._entries.pop(pk, None)
+                if entry is not None and self._names.get(entry['key']) == pk:
+                    del self._names[entry['key']]
+
+    def forget_all(self):
+        with self._lock:
+            pks = list(self._entries)
+        self.forget(pks)
+
+    def forget_names(self, guild_id, names):
+        with self._lock:
+            pks = [self._names[guild_id, name] for name in names if (guild_id, name) in self._names]
+        self.forget(pks)
+
+    def take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self.pending_changes = 0
+            return pending
+
+    def restore_pending(self, pending):
+        # A failed flush puts its deltas back in front of anything newer
+        with self._lock:
+            for pk, deltas in pending.items():
+                merged = self._pending.setdefault(pk, {})
+                for field, delta in deltas.items():
+                    merged[field] = merged.get(field, 0) + delta
+                self.pending_changes += len(deltas)
+
+    def evict_idle(self, ttl=ENTRY_TTL):
+        now = time.monotonic()
+        with self._lock:
+            idle = [pk for pk, entry in self._entries.items()
+                    if now - entry['touched'] > ttl and pk not in self._pending]
+        self.forget(idle)
+
+
+resource_buffer = ResourceBuffer()
+
+
+def load_resources(guild_id, name):
+    return (Character.objects.for_guild(guild_id).filter(name=name)
+            .values_list('pk', 'guild_id', 'name', *RESOURCE_COLUMNS).first())
+
+
+def flush_resources(buffer=resource_buffer):
+    # Every buffered delta in one UPDATE, clamped again in SQL in case the limits
+    # changed since the values were cached. Returns the characters written.
+    pending = buffer.take_pending()
+    if pending:
+        try:
+            with transaction.atomic():
+                apply_deltas(pending)
+        except BaseException:
+            buffer.restore_pending(pending)
+            raise
+    buffer.evict_idle()
+    return len(pending)
+
+
+def apply_deltas(pending):
+    updates = {}
+    for field, limit in RESOURCE_LIMITS.items():
+        changed = [When(pk=pk, then=Value(deltas[field])) for pk, deltas in pending.items() if deltas.get(field)]
+        if changed:
+            delta = Case(*changed, default=Value(0), output_field=IntegerField())
+            updates[field] = Greatest(Least(F(field) + delta, F(limit) if isinstance(limit, str) else Value(limit)),
+                                      Value(0))
+    if updates:
+        Character.objects.filter(pk__in=pending).update(**updates, version=F('version') + 1)
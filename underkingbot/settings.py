@@ -41,6 +41,12 @@ INSTALLED_APPS = [
     'game',
 ]
 
+# The bot process needs only the game models; `DJANGO_BOT_ONLY=1 manage.py launchbot`
+# skips importing and readying admin, auth, sessions and friends on every restart
+BOT_ONLY = bool(os.getenv('DJANGO_BOT_ONLY'))
+if BOT_ONLY:
+    INSTALLED_APPS = ['game']
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -79,6 +85,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Several DB workers may wait on SQLite's write lock at once
+            'timeout': 20,
+        },
     }
 }
 
@@ -127,3 +137,26 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_DEBUG_SCOPE = os.getenv('DISCORD_DEBUG_SCOPE')
+# Worker threads for the bot's database access, see game/repository.py
+DB_WORKERS = int(os.getenv('DB_WORKERS', 4))
+# Prometheus text snapshot the bot writes and /metrics/ serves
+METRICS_FILE = os.getenv('METRICS_FILE', BASE_DIR / 'metrics.prom')
+METRICS_INTERVAL = int(os.getenv('METRICS_INTERVAL', 15))
+# Content-addressed attachment store and the public URL it is served under,
+# e.g. https://example.org/images (see game/images.py and the images/ route)
+IMAGE_ROOT = os.getenv('IMAGE_ROOT', BASE_DIR / 'images')
+IMAGE_BASE_URL = os.getenv('IMAGE_BASE_URL')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+# Lets image URLs name local files (file://...), to try the pipeline without
+# Discord. Off by default: imported compendia and sheets carry image URLs too.
+IMAGE_FILE_URLS = bool(os.getenv('IMAGE_FILE_URLS'))
+# HP/focus/hero point changes are buffered in the bot and written every
+# RESOURCE_FLUSH_INTERVAL seconds, or sooner once this many are waiting
+RESOURCE_FLUSH_INTERVAL = int(os.getenv('RESOURCE_FLUSH_INTERVAL', 5))
+RESOURCE_FLUSH_CHANGES = int(os.getenv('RESOURCE_FLUSH_CHANGES', 50))
+# Touched to make the bot reload its compendium snapshot (see game/reference.py);
+# the bot checks it every COMPENDIUM_POLL_INTERVAL seconds
+COMPENDIUM_RELOAD_FILE = os.getenv('COMPENDIUM_RELOAD_FILE', BASE_DIR / '.compendium_reload')
+COMPENDIUM_POLL_INTERVAL = int(os.getenv('COMPENDIUM_POLL_INTERVAL', 10))
+# Hash of the slash-command tree last synced to Discord, see launchbot
+COMMAND_TREE_HASH_FILE = os.getenv('COMMAND_TREE_HASH_FILE', BASE_DIR / '.command_tree_hash')
@@ -14,9 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path
 
+from game import views
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    path('metrics/', views.metrics),
+    path('images/<str:size>/<str:prefix>/<str:name>', views.image),
 ]
+
+# The bot-only process leaves admin out of INSTALLED_APPS
+if not settings.BOT_ONLY:
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))